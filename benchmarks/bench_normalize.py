@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Compare normalizing and rendering article lists through
+json_normalize and a DataFrame with the pandas-free Article records of
+newsapi_wrapper.records. Reports the best time and the peak memory
+allocated (tracemalloc) of each path.
+
+Usage:
+    python benchmarks/bench_normalize.py [-r repeat] [articles ...]
+"""
+import os
+import sys
+import argparse
+import timeit
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(
+    __file__))))
+from newsapi_wrapper.records import articles_from_json
+from newsapi_wrapper.render import render_records
+from bench_render import render_apply
+
+COLUMNS = ['Date','Title', 'Summary', 'Author', 'Source']
+LINKS = {'Title': 'URL'}
+ARTICLE_COUNTS = [100, 1000, 10000]
+
+def make_articles(count):
+    return [{
+        'source': {'id': None, 'name': 'Source {}'.format(i % 13)},
+        'author': 'Author {}'.format(i % 97),
+        'title': 'Title {} <b>&</b> "quoted"'.format(i),
+        'description': 'Summary of article {} '.format(i) * 4,
+        'url': 'https://example.com/news/{}?a=1&b=2'.format(i),
+        'urlToImage': None,
+        'publishedAt': '2020-08-{:02d}T10:00:00Z'.format(1 + i % 28),
+        'content': 'Content {}'.format(i)} for i in range(count)]
+
+def normalize_dataframe(articles):
+    # Normalization as done before newsapi_wrapper.records existed
+    df = pd.json_normalize(articles)
+    df = df.rename(columns={
+        'author':'Author', 'title':'Title', 'description':'Summary',
+        'url': 'URL','urlToImage':'URL to Image', 'publishedAt':'Date',
+        'content': 'Content', 'source.name': 'Source'})
+    df['Date'] = df['Date'].astype('datetime64[D]')
+    return df[['Date','Title', 'Summary', 'Author', 'Source', 'Content',
+               'URL', 'URL to Image']]
+
+def peak_memory(func, articles):
+    tracemalloc.start()
+    result = func(articles)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('articles', type=int, nargs='*',
+                        default=ARTICLE_COUNTS)
+    args = parser.parse_args()
+
+    paths = [
+        ('normalize', normalize_dataframe, articles_from_json),
+        ('normalize+render',
+         lambda articles: render_apply(normalize_dataframe(articles)),
+         lambda articles: render_records(articles_from_json(articles),
+                                         COLUMNS, LINKS))]
+    print('{:>8} {:<17}{:>12}{:>12}{:>9}{:>11}{:>11}{:>8}'.format(
+        'articles', 'stage', 'pandas ms', 'records ms', 'speedup',
+        'pandas MB', 'records MB', 'ratio'))
+    for count in args.articles:
+        articles = make_articles(count)
+        for stage, old, new in paths:
+            times = [min(timeit.repeat(lambda: func(articles), number=1,
+                                       repeat=args.repeat))
+                     for func in (old, new)]
+            memory = [peak_memory(func, articles) for func in (old, new)]
+            print('{:>8} {:<17}{:>12.2f}{:>12.2f}{:>8.1f}x{:>11.2f}{:>11.2f}'
+                  '{:>7.1f}x'.format(
+                      count, stage, times[0]*1000, times[1]*1000,
+                      times[0]/times[1], memory[0]/2**20, memory[1]/2**20,
+                      memory[0]/memory[1]))
+
+if __name__ == '__main__':
+    main()
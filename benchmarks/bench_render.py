@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Compare the row-wise DataFrame.apply + to_html rendering of result
+tables with the newsapi_wrapper.render.render_rows path the HTML writers
+use on Article records.
+
+Usage:
+    python benchmarks/bench_render.py [-r repeat] [rows ...]
+"""
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(
+    __file__))))
+from newsapi_wrapper.records import Article, articles_from_json, to_dataframe
+from newsapi_wrapper.render import table_head, render_rows, TABLE_TAIL
+
+COLUMNS = ['Date','Title', 'Summary', 'Author', 'Source']
+LINKS = {'Title': 'URL'}
+ROW_COUNTS = [100, 1000, 10000]
+
+def make_articles(count):
+    return [{
+        'source': {'id': None, 'name': 'Source {}'.format(i % 13)},
+        'author': 'Author {}'.format(i % 97),
+        'title': 'Title {} <b>&</b> "quoted"'.format(i),
+        'description': 'Summary of article {} '.format(i) * 4,
+        'url': 'https://example.com/news/{}?a=1&b=2'.format(i),
+        'urlToImage': None,
+        'publishedAt': '2020-08-{:02d}T10:00:00Z'.format(1 + i % 28),
+        'content': 'Content {}'.format(i)} for i in range(count)]
+
+def render_apply(df):
+    # Rendering as done before newsapi_wrapper.render existed
+    df = df.copy()
+    df['Title'] = df.apply(
+        lambda df: f'<a href="{df["URL"]}">{df["Title"]}</a>', axis=1)
+    return df[COLUMNS].to_html(escape=False, index=False)
+
+def render_writer(records):
+    # Table markup as written by writers.HtmlTableWriter
+    return table_head(COLUMNS) + render_rows(records, COLUMNS, LINKS) + \
+        TABLE_TAIL
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("rows", type=int, nargs='*', default=ROW_COUNTS)
+    args = parser.parse_args()
+    print('{:>8} {:>12} {:>12} {:>8}'.format(
+        'rows', 'apply (ms)', 'rows (ms)', 'speedup'))
+    for rows in args.rows:
+        records = articles_from_json(make_articles(rows))
+        df = to_dataframe(records, Article)
+        old = min(timeit.repeat(lambda: render_apply(df),
+                                number=1, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: render_writer(records),
+                                number=1, repeat=args.repeat))
+        print('{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            rows, old*1000, new*1000, old/new))
+
+if __name__ == "__main__":
+    main()
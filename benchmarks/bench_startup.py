@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Measure the start up cost of the command line utility: importing
+newsapi_wrapper, printing the --help text and answering a query from the
+response cache. Every sample runs in a fresh interpreter, the reported
+times include the interpreter start. The cached query runs with
+temporary Data/ and Cache/ directories.
+
+Usage:
+    python benchmarks/bench_startup.py [-r repeat]
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+from newsapi_wrapper.cache import ResponseCache
+
+QUERY_NAME = 'bench-startup'
+QUERY_ARGS = {'q': 'bench startup', 'language': 'en', 'page_size': 100}
+ARTICLE_COUNT = 100
+
+CACHED_QUERY = """
+import sys
+import newsapi_wrapper as nw
+import newsapi_wrapper.newsapi_wrapper as nw_module
+nw_module.DATA_PATH, nw_module.CACHE_PATH = sys.argv[2:4]
+news = nw.NewsApiWrapper('bench-key', sys.argv[1], storage='json')
+if not news.get_all_news(query_name={!r}, q={!r}):
+    sys.exit('query was not answered')
+""".format(QUERY_NAME, QUERY_ARGS['q'])
+
+def make_response(count):
+    return {'status': 'ok', 'totalResults': count, 'articles': [{
+        'source': {'id': None, 'name': 'Source {}'.format(i % 13)},
+        'author': 'Author {}'.format(i % 97),
+        'title': 'Title {}'.format(i),
+        'description': 'Summary of article {}'.format(i),
+        'url': 'https://example.com/news/{}'.format(i),
+        'urlToImage': None,
+        'publishedAt': '2020-08-{:02d}T10:00:00Z'.format(1 + i % 28),
+        'content': 'Content {}'.format(i)} for i in range(count)]}
+
+def run(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT_DIR, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<28}{:>10}'.format('scenario', 'best ms'))
+    baseline = run(['-c', 'pass'], args.repeat)
+    print('{:<28}{:>10.1f}'.format('python -c pass', baseline*1000))
+    elapsed = run(['-c', 'import newsapi_wrapper'], args.repeat)
+    print('{:<28}{:>10.1f}'.format('import newsapi_wrapper', elapsed*1000))
+    elapsed = run(['newsapi_cmd.py', '--help'], args.repeat)
+    print('{:<28}{:>10.1f}'.format('newsapi_cmd.py --help', elapsed*1000))
+
+    # The response is seeded into a cache of its own, so that the query
+    # neither uses nor leaves behind entries of newsapi_wrapper/Cache
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_dir = os.path.join(work_dir, 'data') + os.sep
+        cache_dir = os.path.join(work_dir, 'cache') + os.sep
+        results_dir = os.path.join(work_dir, 'results')
+        os.mkdir(results_dir)
+        ResponseCache(cache_dir).put('get_everything', QUERY_ARGS,
+                                     make_response(ARTICLE_COUNT))
+        elapsed = run(['-c', CACHED_QUERY, results_dir, data_dir,
+                       cache_dir], args.repeat)
+    print('{:<28}{:>10.1f}'.format(
+        'cached query ({} articles)'.format(ARTICLE_COUNT), elapsed*1000))
+
+if __name__ == '__main__':
+    main()
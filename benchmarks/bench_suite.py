@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Benchmark queries end to end against a simulated News API and save
+the results for comparison with an earlier run.
+
+Every scenario runs a get_everything query of the given number of
+articles through NewsApiWrapper, with SimulatedNewsApiClient (or
+ReplayNewsApiClient with --replay) in place of NewsApiClient:
+
+    query   get_all_news, the default path
+    stream  get_all_news with stream=True
+    formats get_all_news writing jsonl and csv next to the HTML
+    sharded get_all_news against a News API serving at most 100 results
+            per query, so that the query is split into time windows
+    cli     newsapi_cmd.py -a in a fresh interpreter, incl. start up
+
+The other scenarios run with sharding disabled (max_results=None), as
+their simulated News API serves every page.
+
+Besides the wall time ('total') the timings of the stages recorded by
+the wrapper metrics (fetch, normalize, render_html, persist,
+write_outputs, ...) are reported. Times are the best of the repeats, in
+milliseconds. Every run uses temporary Data/, Cache/ and results
+directories, so the files of newsapi_wrapper/Data are neither read nor
+changed. Results are written to benchmarks/results/<commit>.json;
+with --compare the run is compared with an earlier results file and the
+exit status is 1 if a stage got slower than --threshold.
+
+Usage:
+    python benchmarks/bench_suite.py [-r repeat] [--latency seconds]
+        [--jitter seconds] [--replay json_file ...] [--scenarios names]
+        [-o results_file] [--compare results_file] [articles ...]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+import newsapi_wrapper as nw
+import newsapi_wrapper.newsapi_wrapper as nw_module
+from simulator import SimulatedNewsApiClient, ReplayNewsApiClient
+
+QUERY_NAME = 'bench-suite'
+QUERY_ARGS = {'q': 'bench suite', 'sort_by': 'publishedAt'}
+ARTICLE_COUNTS = [100, 1000, 5000]
+SCENARIOS = ['query', 'stream', 'formats', 'sharded', 'cli']
+LATENCY = 0.02
+JITTER = 0.01
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+# Stages taking less than this many milliseconds are too noisy to compare
+MIN_COMPARE_MS = 1.0
+THRESHOLD = 1.25
+# Deepest result served in the sharded scenario, as on the Developer plan
+SHARDED_MAX_RESULTS = 100
+
+CLI_RUNNER = """
+import sys
+import runpy
+sys.path[:0] = [{root!r}, {bench!r}]
+import newsapi_wrapper as nw
+import newsapi_wrapper.newsapi_wrapper as nw_module
+from simulator import {client}
+
+nw_module.DATA_PATH = {data!r}
+nw_module.CACHE_PATH = {cache!r}
+
+class BenchNewsApiWrapper(nw.NewsApiWrapper):
+    def __init__(self, *args, **kwargs):
+        kwargs['newsapi_client'] = {client}(*{client_args!r})
+        super().__init__(*args, **kwargs)
+
+nw.NewsApiWrapper = BenchNewsApiWrapper
+sys.argv = [{cmd!r}] + sys.argv[1:]
+runpy.run_path({cmd!r}, run_name='__main__')
+"""
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def work_dirs(work_dir):
+    """Return the results, Data/ and Cache/ directories of a run in
+    work_dir; the wrapper takes the latter two with a trailing separator
+    """
+    results_dir = os.path.join(work_dir, 'results')
+    os.mkdir(results_dir)
+    return {'results': results_dir,
+            'data': os.path.join(work_dir, 'data') + os.sep,
+            'cache': os.path.join(work_dir, 'cache') + os.sep}
+
+def client_args(args, count):
+    if args.replay:
+        return (args.replay, args.latency, args.jitter)
+    return (count, args.latency, args.jitter)
+
+def make_client(args, count, max_results=None):
+    if args.replay:
+        return ReplayNewsApiClient(*client_args(args, count),
+                                   max_results=max_results)
+    return SimulatedNewsApiClient(*client_args(args, count),
+                                  max_results=max_results)
+
+def best_of(samples):
+    """Return {stage: best ms} of samples, a list of {stage: seconds}"""
+    stages = {}
+    for sample in samples:
+        for stage, seconds in sample.items():
+            stages[stage] = min(stages.get(stage, seconds), seconds)
+    return {stage: round(seconds*1000, 3)
+            for stage, seconds in sorted(stages.items())}
+
+def stage_times(stats):
+    return {stage: span['total'] for stage, span in stats['stages'].items()}
+
+def run_wrapper(args, count, results_dir, scenario):
+    metrics = nw.Metrics()
+    query_args = dict(QUERY_ARGS)
+    max_results = None
+    if scenario == 'sharded':
+        max_results = SHARDED_MAX_RESULTS
+    client = make_client(args, count, max_results)
+    if scenario == 'sharded':
+        # The window of the simulated articles, which the planner splits
+        from_param, to = client.published_range()
+        query_args.update(from_param=from_param, to=to)
+    elif scenario == 'formats':
+        query_args.update(formats='jsonl,csv')
+    news = nw.NewsApiWrapper(
+        'bench-key', results_dir, newsapi_client=client, use_cache=False,
+        storage='json', stream=scenario == 'stream', metrics=metrics,
+        max_results=max_results)
+    try:
+        start = time.perf_counter()
+        path = news.get_all_news(query_name=QUERY_NAME, **query_args)
+        elapsed = time.perf_counter() - start
+    finally:
+        news.close()
+    if not path or not os.path.exists(path):
+        raise RuntimeError('{} query failed: {}'.format(scenario, path))
+    sample = stage_times(metrics.stats())
+    sample.update(total=elapsed)
+    return sample
+
+def run_cli(args, count, dirs):
+    # The command line utility reads its setup from .env and its logging
+    # configuration from the working directory
+    work_dir = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT_DIR, 'newsapi_cmd_log.ini'), work_dir)
+        with open(os.path.join(work_dir, '.env'), 'w') as file:
+            file.write('NEWSAPI_KEY="bench-key"\n')
+        input_path = os.path.join(work_dir, 'query.yaml')
+        with open(input_path, 'w') as file:
+            json.dump(dict(QUERY_ARGS, query_name=QUERY_NAME), file)
+        metrics_path = os.path.join(work_dir, 'metrics.json')
+        runner = CLI_RUNNER.format(
+            root=ROOT_DIR, bench=BENCH_DIR, data=dirs['data'],
+            cache=dirs['cache'], cmd=os.path.join(ROOT_DIR, 'newsapi_cmd.py'),
+            client='ReplayNewsApiClient' if args.replay
+            else 'SimulatedNewsApiClient',
+            client_args=client_args(args, count))
+        env = dict(os.environ, NEWSAPI_KEY='bench-key',
+                   RESULTS_DIR_NAME=dirs['results'], NEWSAPI_MAX_RESULTS='0')
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', runner, '-a', input_path,
+                        '--storage', 'json', '--no-cache',
+                        '--metrics', metrics_path],
+                       cwd=work_dir, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if not os.path.exists(metrics_path):
+            with open(os.path.join(work_dir, 'newsapi_log.log')) as file:
+                raise RuntimeError('cli query failed:\n{}'.format(
+                    file.read()[-2000:]))
+        with open(metrics_path, 'r') as file:
+            sample = stage_times(json.load(file))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sample.update(total=elapsed)
+    return sample
+
+def run_scenario(args, count, scenario):
+    samples = []
+    for _ in range(args.repeat):
+        # Every run starts without persisted runs, quota, seen articles,
+        # sources catalog or cached responses
+        with tempfile.TemporaryDirectory() as work_dir:
+            dirs = work_dirs(work_dir)
+            if scenario == 'cli':
+                samples.append(run_cli(args, count, dirs))
+                continue
+            nw_module.DATA_PATH = dirs['data']
+            nw_module.CACHE_PATH = dirs['cache']
+            samples.append(run_wrapper(args, count, dirs['results'],
+                                       scenario))
+    return best_of(samples)
+
+def print_results(results):
+    print('{:<16}{:<16}{:>12}'.format('scenario', 'stage', 'best ms'))
+    for name, stages in results.items():
+        for stage, ms in stages.items():
+            print('{:<16}{:<16}{:>12.2f}'.format(name, stage, ms))
+
+def compare(results, baseline, threshold):
+    """Print the ratio of every stage to baseline; return the number of
+    stages slower than threshold times their baseline
+    """
+    regressions = 0
+    print('\n{:<16}{:<16}{:>12}{:>12}{:>8}'.format(
+        'scenario', 'stage', 'base ms', 'new ms', 'ratio'))
+    for name, stages in results.items():
+        for stage, ms in stages.items():
+            base = baseline.get(name, {}).get(stage)
+            if base is None:
+                continue
+            ratio = ms/base if base else float('inf')
+            flag = ''
+            if ratio > threshold and max(base, ms) >= MIN_COMPARE_MS:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('{:<16}{:<16}{:>12.2f}{:>12.2f}{:>7.2f}x{}'.format(
+                name, stage, base, ms, ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=LATENCY,
+                        help='seconds every simulated call takes')
+    parser.add_argument('--jitter', type=float, default=JITTER,
+                        help='maximum random seconds added to latency')
+    parser.add_argument('--replay', nargs='+', metavar='json_file',
+                        help='serve the articles of recorded responses or '
+                        'persisted result blobs instead of generated ones')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run')
+    parser.add_argument('-o', '--output',
+                        help='results file (default: '
+                        'benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', metavar='results_file',
+                        help='results file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='ratio to the earlier run reported as a '
+                        'regression')
+    parser.add_argument('articles', type=int, nargs='*',
+                        default=ARTICLE_COUNTS)
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',')]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario: {}'.format(name))
+    # Replayed recordings have a fixed number of articles
+    counts = [None] if args.replay else args.articles
+
+    results = {}
+    for count in counts:
+        for scenario in scenarios:
+            name = scenario if count is None else '{}-{}'.format(
+                scenario, count)
+            results[name] = run_scenario(args, count, scenario)
+    print_results(results)
+
+    commit = git_commit()
+    settings = {'repeat': args.repeat, 'latency': args.latency,
+                'jitter': args.jitter, 'replay': args.replay}
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(
+        commit or datetime.now().strftime('%Y%m%d-%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({
+            'commit': commit,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': settings,
+            'results': results}, file, indent=2)
+    print('\nResults saved in {}'.format(output))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        # The number of repeats does not make runs incomparable
+        other = dict(baseline.get('settings', {}), repeat=args.repeat)
+        if other != settings:
+            print('WARNING: {} was run with other settings: {}'.format(
+                args.compare, baseline.get('settings')))
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Stand-ins for newsapi.NewsApiClient used by the benchmarks. They are
+passed to NewsApiWrapper as newsapi_client, so every query runs through
+the real scheduler, pager, shard planner, normalization, rendering and
+persistence without calling News API. Like News API they honor the
+from_param/to window of get_everything and can refuse results deeper
+than max_results.
+
+SimulatedNewsApiClient generates realistic pages of articles; the same
+seed always gives the same articles. ReplayNewsApiClient serves the
+articles of recorded responses, eg the blobs under
+newsapi_wrapper/Data/, split into pages.
+"""
+import json
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+
+# News API never returns more than 100 articles per page
+MAX_PAGE_SIZE = 100
+DEFAULT_PAGE_SIZE = 20
+PUBLISHERS = [
+    'Reuters', 'Associated Press', 'BBC News', 'The Guardian', 'CNN',
+    'Bloomberg', 'TechCrunch', 'The Verge', 'Wired', 'Ars Technica',
+    'Financial Times', 'Al Jazeera English', 'NPR', 'Engadget', 'Politico',
+    'Business Insider', 'The Washington Post', 'Forbes', 'Axios', 'CNBC']
+WORDS = """
+    market stocks rally investors bank rates inflation economy growth
+    report quarter earnings profit shares tech company launch product
+    election vote senate court ruling policy government minister talks
+    climate energy oil prices storm record heat summit deal trade china
+    europe united states president officials says new first year week
+    data security breach users app update phone chip ai model research
+    study health vaccine hospital patients league season win coach team
+    film music festival award city police fire crash airline travel
+    """.split()
+CATEGORIES = ['business', 'entertainment', 'general', 'health', 'science',
+              'sports', 'technology']
+COUNTRIES = ['us', 'gb', 'de', 'fr', 'in', 'au', 'ca', 'it', 'jp', 'br']
+# Content is truncated by News API to about 200 characters
+CONTENT_CHARS = 200
+# Minutes between two generated articles
+ARTICLE_MINUTES = 7
+NEWEST = datetime(2020, 8, 28, 12, 0, 0)
+
+def parse_time(value, end=False):
+    # News API from/to: a date, or a date and time
+    value = str(value).replace('Z', '')
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) <= len('YYYY-MM-DD'):
+        parsed += timedelta(days=1, seconds=-1)
+    return parsed
+
+class SimulatedNewsApiClient:
+    """Generate News API responses of total_results articles, newest
+    first, paged like News API. Every call sleeps latency seconds, plus
+    up to jitter seconds, like a round trip to News API would.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, total_results=1000, latency=0.0, jitter=0.0,
+                 seed=0, source_count=128, max_results=None):
+        """
+        Default arguments:
+            total_results: Number of articles a query matches, published
+                           every ARTICLE_MINUTES minutes back from NEWEST
+            latency: Seconds every call takes
+            jitter: Maximum random seconds added to latency
+            seed: Seed of the generated articles and of the jitter
+            source_count: Number of sources get_sources returns
+            max_results: Deepest result served; pages beyond it fail with
+                         maximumResultsReached like on the Developer plan.
+                         None serves every page.
+        """
+        self._total_results = total_results
+        self._max_results = max_results
+        self._latency = latency
+        self._jitter = jitter
+        self._seed = seed
+        self._source_count = source_count
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    #
+    # Private methods
+    #
+    def _sleep(self):
+        with self._lock:
+            self._calls += 1
+            delay = self._latency + self._random.random()*self._jitter
+        if delay:
+            time.sleep(delay)
+
+    def _sentence(self, rand, low, high):
+        return ' '.join(rand.choice(WORDS)
+                        for _ in range(rand.randint(low, high)))
+
+    def _article(self, index):
+        # Article index of every query, generated from its own seed so
+        # that pages can be generated in any order
+        rand = random.Random(self._seed*1000003 + index)
+        publisher = PUBLISHERS[index % len(PUBLISHERS)]
+        source_id = publisher.lower().replace(' ', '-')
+        title = self._sentence(rand, 6, 14).capitalize()
+        slug = '-'.join(title.lower().split()[:8])
+        content = self._sentence(rand, 30, 60).capitalize() + '.'
+        published = NEWEST - timedelta(minutes=ARTICLE_MINUTES*index)
+        return {
+            'source': {'id': source_id if index % 3 else None,
+                       'name': publisher},
+            'author': None if index % 5 == 0 else '{} {}'.format(
+                rand.choice(WORDS).title(), rand.choice(WORDS).title()),
+            'title': '{} - {}'.format(title, publisher),
+            'description': self._sentence(rand, 20, 45).capitalize() + '.',
+            'url': 'https://www.{}.com/{}/{}-{}?utm_source=newsapi'.format(
+                source_id, published.strftime('%Y/%m/%d'), slug, index),
+            'urlToImage': 'https://cdn.{}.com/img/{}.jpg'.format(
+                source_id, index) if index % 4 else None,
+            'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'content': '{}… [+{} chars]'.format(
+                content[:CONTENT_CHARS], rand.randint(500, 8000))}
+
+    def _indices(self, from_param, to):
+        # Indices of the articles published within from_param and to
+        first, last = 0, self._total_results - 1
+        step = timedelta(minutes=ARTICLE_MINUTES)
+        if to:
+            first = max(first, -(-(NEWEST - parse_time(to, end=True))//step))
+        if from_param:
+            last = min(last, (NEWEST - parse_time(from_param))//step)
+        return range(first, last + 1)
+
+    def _articles(self, page, page_size, from_param=None, to=None):
+        page_size = min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        start = (page - 1)*page_size
+        self._sleep()
+        if self._max_results is not None and start >= self._max_results:
+            return {'status': 'error', 'code': 'maximumResultsReached',
+                    'message': 'You have requested too many results. '
+                    'Limited to a max of {} results.'.format(
+                        self._max_results)}
+        indices = self._indices(from_param, to)
+        return {'status': 'ok', 'totalResults': len(indices),
+                'articles': [self._article(index) for index in
+                             indices[start:start + page_size]]}
+
+    #
+    # Public methods
+    #
+    def calls(self):
+        """Return the number of calls made"""
+        with self._lock:
+            return self._calls
+
+    def published_range(self):
+        """Return the from_param and to of a query matching all articles"""
+        if not self._total_results:
+            return None, None
+        return (self._article(self._total_results - 1)['publishedAt'],
+                self._article(0)['publishedAt'])
+
+    def get_top_headlines(self, page=1, page_size=None, **query_args):
+        return self._articles(page, page_size)
+
+    def get_everything(self, page=1, page_size=None, from_param=None,
+                       to=None, **query_args):
+        return self._articles(page, page_size, from_param, to)
+
+    def get_sources(self, **query_args):
+        self._sleep()
+        sources = []
+        for index in range(self._source_count):
+            rand = random.Random(self._seed*1000003 - index)
+            name = '{} {}'.format(rand.choice(WORDS).title(),
+                                  rand.choice(['News', 'Times', 'Daily']))
+            source_id = '{}-{}'.format(name.lower().replace(' ', '-'), index)
+            sources.append({
+                'id': source_id, 'name': name,
+                'description': self._sentence(rand, 10, 25).capitalize(),
+                'url': 'https://{}.com'.format(source_id),
+                'category': CATEGORIES[index % len(CATEGORIES)],
+                'language': 'en',
+                'country': COUNTRIES[index % len(COUNTRIES)]})
+        return {'status': 'ok', 'sources': sources}
+
+
+class ReplayNewsApiClient(SimulatedNewsApiClient):
+    """Serve recorded articles instead of generated ones. The recordings
+    are JSON files holding a News API response or a result blob persisted
+    by NewsApiWrapper (storage='json'); their articles, and sources, are
+    concatenated, newest first, and split into pages of the requested
+    size.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, paths, latency=0.0, jitter=0.0, seed=0,
+                 max_results=None):
+        """
+        Default arguments:
+            paths: Recorded JSON files
+            latency: Seconds every call takes
+            jitter: Maximum random seconds added to latency
+            seed: Seed of the jitter
+            max_results: Deepest result served, see SimulatedNewsApiClient
+        """
+        self._recorded = []
+        self._sources = []
+        for path in paths:
+            with open(path, 'r') as file:
+                response = json.load(file)
+            self._recorded += response.get('articles', [])
+            self._sources += response.get('sources', [])
+        self._recorded.sort(key=lambda article: article.get('publishedAt')
+                            or '', reverse=True)
+        SimulatedNewsApiClient.__init__(
+            self, total_results=len(self._recorded), latency=latency,
+            jitter=jitter, seed=seed, max_results=max_results)
+
+    #
+    # Private methods
+    #
+    def _indices(self, from_param, to):
+        first = parse_time(from_param) if from_param else None
+        last = parse_time(to, end=True) if to else None
+        indices = []
+        for index, article in enumerate(self._recorded):
+            published = parse_time((article.get('publishedAt') or '')[:19]
+                                   or '1970-01-01')
+            if (first is None or published >= first) and \
+                    (last is None or published <= last):
+                indices.append(index)
+        return indices
+
+    def _article(self, index):
+        return self._recorded[index]
+
+    #
+    # Public methods
+    #
+    def get_sources(self, **query_args):
+        self._sleep()
+        return {'status': 'ok', 'sources': list(self._sources)}
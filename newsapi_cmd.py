@@ -1,13 +1,11 @@
 # importing the required modules
 import os
+import glob
+import time
 import argparse
-import pandas as pd
-import yaml
+import signal
 import logging
 from logging.config import fileConfig
-from dotenv import load_dotenv
-
-import newsapi_wrapper as nw
 
 # Configure logging
 fileConfig('newsapi_cmd_log.ini')
@@ -32,35 +30,261 @@ def write_env(args):
     except Exception as e:
         print(e)
 
-def query(action, args):
+BATCH_WORKERS = 4
+SEARCH_LIMIT = 20
+WATCH_STATUS_FILE = 'newsapi_watch_status.json'
+# NewsApiWrapper method called for each query action
+QUERY_ACTIONS = {
+    'topnews': 'get_top_headlines_html',
+    'allnews': 'get_all_news',
+    'sources': 'get_sources'}
+# Keys of query files read by --watch only, not passed to News API
+WATCH_KEYS = ('interval',)
+
+def _env_number(name, convert):
+    value = os.getenv(name)
+    return convert(value) if value else None
+
+def create_wrapper(use_cache=True, **kwargs):
+    import newsapi_wrapper as nw
+    from dotenv import load_dotenv
+    load_dotenv()
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    results_dir = os.path.join(dir_path, os.getenv("RESULTS_DIR_NAME"))
+    # Rows per result HTML file, 0 for a single file, see README
+    page_rows = _env_number("NEWSAPI_HTML_PAGE_ROWS", int)
+    if page_rows is not None:
+        kwargs.update(html_page_rows=page_rows)
+    # Deepest result of the News API plan; sharding is off unless set
+    max_results = _env_number("NEWSAPI_MAX_RESULTS", int)
+    if max_results is not None:
+        kwargs.update(max_results=max_results)
+    # Optional plan limits, see README
+    return nw.NewsApiWrapper(os.getenv("NEWSAPI_KEY"), 
+                             results_dir,
+                             logger=logger,
+                             use_cache=use_cache,
+                             rate_limit=_env_number(
+                                 "NEWSAPI_RATE_LIMIT", float),
+                             daily_quota=_env_number(
+                                 "NEWSAPI_DAILY_QUOTA", int),
+                             **kwargs)
+
+def dump_metrics(news, path):
+    """Write the stage timings and counters of news to path, as JSON if
+    it ends with .json and in the Prometheus text format otherwise
+    """
+    if not path:
+        return
+    try:
+        news.metrics().dump(path)
+    except OSError as e:
+        logger.exception(e)
+
+def run_query(news, action, params):
+    if action not in QUERY_ACTIONS:
+        raise ValueError("Invalid action passed to query: {}".format(action))
+    # Watch files can be run once with -a, -t, -s or --batch too
+    params = {key: value for key, value in params.items()
+              if key not in WATCH_KEYS}
+    return getattr(news, QUERY_ACTIONS[action])(**params)
+
+def query(action, args, use_cache=True, stream=False, storage='sqlite',
+          formats=None, dedup=False, metrics_path=None):
     logger.debug('top_headlines')
     try:
-        load_dotenv()
+        import yaml
         with open(args[0], 'r') as file:
             params = yaml.safe_load(file)
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        results_dir = os.path.join(dir_path, os.getenv("RESULTS_DIR_NAME"))
-        news = nw.NewsApiWrapper(os.getenv("NEWSAPI_KEY"), 
-                                 results_dir,
-                                 logger=logger)
-        if action == 'topnews':
-            html_path = news.get_top_headlines_html(**params)
-        elif action == 'allnews':
-            html_path = news.get_all_news(**params)
-        elif action == 'sources':
-            html_path= news.get_sources(**params)
-        else:
-            raise logger.exception("Invalid acttion passed to query")
-        print('Results saved in {}'.format(html_path) )
-        logger.debug('Results saved in {}'.format(html_path))
+        # action is only meaningful in batch mode
+        params.pop('action', None)
+        if formats:
+            params['formats'] = formats
+        if dedup:
+            params['dedup'] = True
+        news = create_wrapper(use_cache, stream=stream, storage=storage)
+        try:
+            html_path = run_query(news, action, params)
+            print('Results saved in {}'.format(html_path) )
+            logger.debug('Results saved in {}'.format(html_path))
+            logger.debug('Cache stats: {}'.format(news.cache_stats()))
+            logger.debug('Request stats: {}'.format(news.request_stats()))
+            logger.debug('Dedup stats: {}'.format(news.dedup_stats()))
+            dump_metrics(news, metrics_path)
+        finally:
+            news.close()
+    except Exception as e:
+        logger.exception(e, exc_info=True)
+
+def search(args, limit=SEARCH_LIMIT):
+    """Print the stored articles best matching the search query args[0]"""
+    try:
+        news = create_wrapper(use_cache=False)
+        results = news.search_articles(args[0], limit=limit)
+        news.close()
+    except ValueError as e:
+        print(e)
+        return
+    except Exception as e:
+        logger.exception(e, exc_info=True)
+        return
+    if not results:
+        print('No stored articles match {}'.format(args[0]))
+    for score, article in results:
+        print('{:6.2f}  {}  {}  {}\n        {}'.format(
+            score, (article['publishedAt'] or '')[:10],
+            article['source']['name'], article['title'], article['url']))
+
+def compact():
+    """Migrate the JSON blobs of earlier runs into the run archive"""
+    try:
+        news = create_wrapper(use_cache=False, storage='archive')
+        stats = news.compact_data()
+        archive_stats = news.archive().stats()
+        news.close()
     except Exception as e:
         logger.exception(e, exc_info=True)
-        
+        return
+    print('Archived {} runs ({} failed): {:.1f} kB of JSON into {:.1f} kB'
+          .format(stats['runs'], stats['failed'],
+                  stats['bytes_before']/1024, stats['bytes_after']/1024))
+    print('Archive: {} runs in {} segments, {:.1f} kB'.format(
+        archive_stats['runs'], archive_stats['segments'],
+        archive_stats['bytes']/1024))
+
+def load_batch_queries(path):
+    """Return (label, params) for every query document found in path.
+    path can be a directory of YAML files, a glob pattern or a single,
+    possibly multi-document, YAML file.
+    """
+    import yaml
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, '*.yaml')) + \
+            glob.glob(os.path.join(path, '*.yml'))
+    else:
+        files = glob.glob(path)
+    queries = []
+    for fname in sorted(files):
+        with open(fname, 'r') as file:
+            docs = [doc for doc in yaml.safe_load_all(file) if doc]
+        for count, doc in enumerate(docs):
+            label = fname if len(docs) == 1 else '{}#{}'.format(fname, count)
+            queries.append((label, doc))
+    return queries
+
+def _run_batch_query(news, label, params, formats=None, dedup=False):
+    start = time.perf_counter()
+    try:
+        params = dict(params)
+        if formats:
+            params['formats'] = formats
+        if dedup:
+            params['dedup'] = True
+        action = params.pop('action', None)
+        if action is None:
+            raise ValueError("action is not provided")
+        path = run_query(news, action, params)
+        status = 'ok' if path and os.path.exists(path) else 'failed'
+    except Exception as e:
+        logger.exception(e)
+        status, path = 'failed', str(e)
+    return label, status, time.perf_counter() - start, path
+
+def batch_query(args, workers=BATCH_WORKERS, use_cache=True,
+                stream=False, storage='sqlite', formats=None, dedup=False,
+                metrics_path=None):
+    """Run every query found in args[0] with one shared NewsApiWrapper,
+    at most workers queries at a time, and print a summary.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from newsapi_wrapper.pager import MAX_WORKERS
+    queries = load_batch_queries(args[0])
+    if not queries:
+        print('No queries found in {}'.format(args[0]))
+        return
+    start = time.perf_counter()
+    news = create_wrapper(use_cache, stream=stream, storage=storage,
+                          http_pool_size=workers*MAX_WORKERS)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda query: _run_batch_query(news, *query, formats, dedup),
+                queries))
+    finally:
+        news.close()
+    failed = 0
+    for label, status, elapsed, path in results:
+        failed += status != 'ok'
+        print('{:6} {:8.2f}s  {} -> {}'.format(status, elapsed, label, path))
+    print('{} queries, {} failed, {:.2f}s total'.format(
+        len(results), failed, time.perf_counter() - start))
+    logger.debug('Cache stats: {}'.format(news.cache_stats()))
+    logger.debug('Request stats: {}'.format(news.request_stats()))
+    logger.debug('Dedup stats: {}'.format(news.dedup_stats()))
+    dump_metrics(news, metrics_path)
+
+def watch(args, storage='sqlite', formats=None,
+          status_file=WATCH_STATUS_FILE, metrics_path=None):
+    """Run the queries found in args[0], each every 'interval', with one
+    NewsApiWrapper until SIGINT or SIGTERM. Queries are deduplicated
+    against earlier runs unless they set 'dedup: false', so each cycle
+    only writes new articles. The metrics, if metrics_path is given, are
+    written after every run.
+    """
+    from newsapi_wrapper.watch import QueryWatcher
+    queries = load_batch_queries(args[0])
+    if not queries:
+        print('No queries found in {}'.format(args[0]))
+        return
+    for label, params in queries:
+        if params.get('action') not in QUERY_ACTIONS:
+            print('{}: action must be one of {}'.format(
+                label, ', '.join(QUERY_ACTIONS)))
+            return
+    # Intervals can be shorter than the response cache lifetime, every
+    # cycle has to call News API
+    news = create_wrapper(use_cache=False, storage=storage)
+
+    def run(label, params):
+        params.setdefault('dedup', True)
+        if formats:
+            params['formats'] = formats
+        try:
+            return run_query(news, params.pop('action'), params)
+        finally:
+            dump_metrics(news, metrics_path)
+
+    try:
+        watcher = QueryWatcher(run, queries, status_file,
+                               quota_remaining=news.quota_remaining,
+                               logger=logger)
+    except ValueError as e:
+        print(e)
+        news.close()
+        return
+    remaining = news.quota_remaining()
+    if remaining is not None and watcher.daily_requests() > remaining:
+        logger.warning('Queries need at least {} requests a day, {} left '
+                       'today'.format(watcher.daily_requests(), remaining))
+    # Finish the running query, then exit
+    signal.signal(signal.SIGINT, lambda *_: watcher.stop())
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    print('Watching {} queries, status in {}. Stop with Ctrl-C.'.format(
+        len(queries), status_file))
+    try:
+        watcher.run()
+    finally:
+        news.close()
+    logger.debug('Cache stats: {}'.format(news.cache_stats()))
+    logger.debug('Request stats: {}'.format(news.request_stats()))
+    logger.debug('Dedup stats: {}'.format(news.dedup_stats()))
+
 def check_setup():
     if not os.path.exists('.env'):
         print('Setup is not done.')
         print('Run => news_api.py --configure newsapi_key')
         exit()
+    from dotenv import load_dotenv
     load_dotenv()
     if not os.getenv("NEWSAPI_KEY"):
         print('Setup is not done.')
@@ -83,6 +307,41 @@ def main():
         for input file: {}.".format(sources_tmplt)
     
     config_help = 'newsapi_key: API key from newsapi.org'
+    batch_help = "run every query in a directory of YAML files, a glob \
+        pattern or a multi-document YAML file; each query needs an \
+        'action' key set to topnews, allnews or sources."
+    workers_help = "maximum number of batch queries run in parallel \
+        (default: {}).".format(BATCH_WORKERS)
+    stream_help = 'write top headlines and everything results to disk \
+        page by page, as HTML rows and JSON Lines, instead of collecting \
+        them in memory first'
+    storage_help = "where query results are persisted: 'sqlite' article \
+        store, one 'json' file per query or the compressed run 'archive' \
+        (default: sqlite)."
+    compact_help = "move the runs persisted as JSON files in \
+        newsapi_wrapper/Data into the compressed run archive."
+    search_help = "search the articles saved by previous queries, without \
+        calling News API. Same syntax as the q parameter: \"exact phrase\", \
+        +must, -must_not, AND / OR / NOT and parentheses."
+    limit_help = "maximum number of search results (default: {}).".format(
+        SEARCH_LIMIT)
+    no_cache_help = 'always call News API instead of reusing a recent \
+        cached response for the same query'
+    format_help = "comma-seperated output formats written next to the \
+        html results: jsonl, csv, parquet (needs pyarrow); replaces the \
+        formats of the input files."
+    watch_help = "run the queries in a directory of YAML files, a glob \
+        pattern or a multi-document YAML file again and again, each every \
+        'interval' (eg 90s, 15m, 2h; default 15m), writing only new \
+        articles, until interrupted; each query needs an 'action' key."
+    status_help = "JSON file the state of --watch is written to \
+        (default: {}).".format(WATCH_STATUS_FILE)
+    metrics_help = "write per-stage timings and counters (API calls, pages, \
+        articles, cache hits, bytes written) to metrics_file when done, as \
+        JSON if it ends with .json, else in the Prometheus text format; \
+        with --watch after every run."
+    dedup_help = "drop articles already returned by earlier queries run \
+        with --dedup in the last week, by URL or near-duplicate title."
 
     # create parser object
     parser = argparse.ArgumentParser(description \
@@ -97,6 +356,31 @@ def main():
                         metavar=('input_file'), help=allnews_help)
     parser.add_argument("-s", "--sources", type=str, nargs=1,
                         metavar=('input_file'), help=sources_help)
+    parser.add_argument("-b", "--batch", type=str, nargs=1,
+                        metavar=('input_path'), help=batch_help)
+    parser.add_argument("-w", "--workers", type=int, default=BATCH_WORKERS,
+                        help=workers_help)
+    parser.add_argument("--stream", action="store_true",
+                        help=stream_help)
+    parser.add_argument("-q", "--search", type=str, nargs=1,
+                        metavar=('query'), help=search_help)
+    parser.add_argument("-l", "--limit", type=int, default=SEARCH_LIMIT,
+                        help=limit_help)
+    parser.add_argument("--storage", choices=['sqlite', 'json', 'archive'],
+                        default='sqlite', help=storage_help)
+    parser.add_argument("--compact", action="store_true",
+                        help=compact_help)
+    parser.add_argument("--no-cache", action="store_true",
+                        help=no_cache_help)
+    parser.add_argument("-f", "--format", type=str, metavar=('formats'),
+                        help=format_help)
+    parser.add_argument("--dedup", action="store_true", help=dedup_help)
+    parser.add_argument("--metrics", type=str, metavar=('metrics_file'),
+                        help=metrics_help)
+    parser.add_argument("--watch", type=str, nargs=1,
+                        metavar=('input_path'), help=watch_help)
+    parser.add_argument("--status-file", type=str, default=WATCH_STATUS_FILE,
+                        help=status_help)
 
     # parse the arguments from standard input
     args = parser.parse_args()
@@ -106,11 +390,25 @@ def main():
     if args.configure != None:
         write_env(args.configure)
     elif args.topnews != None:
-        query('topnews', args.topnews)
+        query('topnews', args.topnews, not args.no_cache, args.stream,
+              args.storage, args.format, args.dedup, args.metrics)
     elif args.allnews != None:
-        query('allnews', args.allnews)
+        query('allnews', args.allnews, not args.no_cache, args.stream,
+              args.storage, args.format, args.dedup, args.metrics)
     elif args.sources != None:
-        query('sources', args.sources)
+        query('sources', args.sources, not args.no_cache, args.stream,
+              args.storage, args.format, args.dedup, args.metrics)
+    elif args.search != None:
+        search(args.search, args.limit)
+    elif args.compact:
+        compact()
+    elif args.batch != None:
+        batch_query(args.batch, args.workers, not args.no_cache,
+                    args.stream, args.storage, args.format, args.dedup,
+                    args.metrics)
+    elif args.watch != None:
+        watch(args.watch, args.storage, args.format, args.status_file,
+              args.metrics)
     else:
         parser.print_help()
 
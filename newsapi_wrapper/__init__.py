@@ -1,5 +1,18 @@
 from . import newsapi_wrapper
 
 from .newsapi_wrapper import NewsApiWrapper
+from .scheduler import NewsApiError, RetryableError, QuotaExceededError
+from .records import Article, Source, to_dataframe
+from .metrics import Metrics
 
-__all__ = ['NewsApiWrapper']
+__all__ = ['NewsApiWrapper', 'AsyncNewsApiWrapper', 'NewsApiError',
+           'RetryableError', 'QuotaExceededError', 'Article', 'Source',
+           'to_dataframe', 'Metrics']
+
+def __getattr__(name):
+    # asyncio is only imported when the async wrapper is used
+    if name == 'AsyncNewsApiWrapper':
+        from .async_wrapper import AsyncNewsApiWrapper
+        return AsyncNewsApiWrapper
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import re
+import gzip
+import json
+import mmap
+import threading
+import logging
+from datetime import datetime
+
+from .store import RUN_SUFFIX_RE
+from .filelock import file_lock
+
+ARCHIVE_PATH = "Archive/"
+INDEX_FILE = "index.jsonl"
+SEGMENT_FILE = "segment-{:05d}.nwa"
+SEGMENT_RE = re.compile(r'^segment-(\d{5})\.nwa$')
+# A new segment is started once the current one reaches this size
+SEGMENT_SIZE = 64*1024*1024
+# Articles or sources per compressed chunk; reading part of a run only
+# decompresses the chunks it overlaps
+CHUNK_ITEMS = 1000
+# Keys of a persisted run holding its list of articles or sources
+ITEM_KEYS = ('articles', 'sources')
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6
+# Blobs of query runs persisted in Data/ with json storage
+RUN_BLOB_RE = re.compile(r'.+-\d{2}_\d{2}_\d{4}-\d{2}_\d{2}_\d{2}\.json$')
+
+def default_codec():
+    """'zstd' when zstandard is installed, 'gzip' otherwise"""
+    try:
+        import zstandard
+        return 'zstd'
+    except ImportError:
+        return 'gzip'
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compressed archives need zstandard: "
+                          "pip install zstandard")
+    return zstandard
+
+
+class RunArchive:
+    """Compressed, append-only archive of persisted query runs. Runs are
+    appended to segment files, segment-00001.nwa, ..., as separately
+    compressed frames: one with the query and its status and one per
+    CHUNK_ITEMS articles or sources. index.jsonl holds one line per run
+    with the offset and length of its frames (chunks as [offset, length,
+    first item, item count]), so runs can be listed without reading
+    the segments and part of a run read by decompressing only the frames
+    it needs, from the memory-mapped segment. A run appended again under
+    the same name supersedes the earlier one. Appends hold a file lock,
+    so several processes can share an archive.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, codec=None, segment_size=SEGMENT_SIZE,
+                 chunk_items=CHUNK_ITEMS, logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: Directory of the archive; created on the first append
+            codec: 'zstd' or 'gzip' for the runs appended. Default:
+                   default_codec(). Runs are read with the codec they were
+                   written with.
+            segment_size: Size in bytes after which a new segment starts
+            chunk_items: Articles or sources per compressed frame
+        """
+        self._path = path
+        self._codec = codec or default_codec()
+        if self._codec not in ('zstd', 'gzip'):
+            raise ValueError("Invalid archive codec: {}".format(codec))
+        if self._codec == 'zstd':
+            _zstandard()
+        self._segment_size = segment_size
+        self._chunk_items = chunk_items
+        self._logger = logger
+        self._lock = threading.Lock()
+        # run name -> index entry, in append order
+        self._runs = {}
+        self._index_pos = 0
+        # segment number -> mmap of the segment
+        self._maps = {}
+
+    #
+    # Private methods
+    #
+    def _index_path(self):
+        return os.path.join(self._path, INDEX_FILE)
+
+    def _segment_path(self, segment):
+        return os.path.join(self._path, SEGMENT_FILE.format(segment))
+
+    def _sync_index(self):
+        # Read the index lines appended since the last call, also by other
+        # processes. A partly written last line is read on a later call.
+        path = self._index_path()
+        if not os.path.exists(path) or \
+                os.path.getsize(path) == self._index_pos:
+            return
+        with open(path, 'rb') as file:
+            file.seek(self._index_pos)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                self._index_pos += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    self._logger.warning('Skipped archive index line: '
+                                         '{}'.format(e))
+                    continue
+                self._runs.pop(entry['run'], None)
+                self._runs[entry['run']] = entry
+
+    def _current_segment(self):
+        segments = [int(match.group(1)) for match in
+                    map(SEGMENT_RE.match, os.listdir(self._path)) if match]
+        segment = max(segments) if segments else 1
+        path = self._segment_path(segment)
+        if os.path.exists(path) and \
+                os.path.getsize(path) >= self._segment_size:
+            segment += 1
+        return segment
+
+    def _compress(self, data):
+        if self._codec == 'zstd':
+            compressor = _zstandard().ZstdCompressor(level=ZSTD_LEVEL)
+            return compressor.compress(data)
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+    def _decompress(self, codec, data):
+        if codec == 'zstd':
+            return _zstandard().ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _view(self, segment, end):
+        # mmap of segment covering at least end bytes; remapped once the
+        # segment grew past the mapped size
+        view = self._maps.get(segment)
+        if view is None or len(view) < end:
+            if view is not None:
+                view.close()
+            with open(self._segment_path(segment), 'rb') as file:
+                view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = view
+        return view
+
+    def _read_frame(self, entry, frame):
+        offset, length = frame[0], frame[1]
+        with self._lock:
+            view = self._view(entry['segment'], offset + length)
+            data = view[offset:offset + length]
+        return json.loads(self._decompress(entry['codec'], data))
+
+    def _entry(self, run_name):
+        with self._lock:
+            self._sync_index()
+            return self._runs.get(run_name)
+
+    #
+    # Public methods
+    #
+    def append(self, run_name, results, created=None):
+        """Append results, a persisted query run, as run_name. Its
+        'articles' or 'sources' are stored in chunks, everything else in
+        the first frame.
+        Default arguments:
+            created: ISO 8601 time of the run. Default: now
+        Response:
+            The index entry of the run.
+        """
+        meta = dict(results)
+        items_key = next((key for key in ITEM_KEYS if key in meta), None)
+        items = meta.pop(items_key) if items_key else []
+        frames = [self._compress(json.dumps(meta).encode('utf-8'))]
+        for start in range(0, len(items), self._chunk_items):
+            chunk = items[start:start + self._chunk_items]
+            frames.append(self._compress(json.dumps(chunk).encode('utf-8')))
+        with self._lock:
+            os.makedirs(self._path, exist_ok=True)
+            # Other processes append to the same segments and index: the
+            # file lock on the index is held from picking the segment
+            # offset to writing the index line
+            with file_lock(self._index_path()):
+                segment = self._current_segment()
+                with open(self._segment_path(segment), 'ab') as file:
+                    offset = file.seek(0, os.SEEK_END)
+                    for frame in frames:
+                        file.write(frame)
+                entry = {
+                    'run': run_name,
+                    'query_name': RUN_SUFFIX_RE.sub('', run_name),
+                    'api_name': meta.get('query', {}).get('api_name'),
+                    'created': created or datetime.now().isoformat(
+                        timespec='seconds'),
+                    'codec': self._codec, 'segment': segment,
+                    'items': items_key, 'count': len(items),
+                    'size': sum(len(frame) for frame in frames),
+                    'meta': [offset, len(frames[0])], 'chunks': []}
+                offset += len(frames[0])
+                starts = range(0, len(items), self._chunk_items)
+                for start, frame in zip(starts, frames[1:]):
+                    entry['chunks'].append([
+                        offset, len(frame), start,
+                        min(self._chunk_items, len(items) - start)])
+                    offset += len(frame)
+                # The index line is written once the frames are, so that
+                # readers never see a run whose data is missing
+                self._sync_index()
+                with open(self._index_path(), 'ab') as file:
+                    line = (json.dumps(entry) + '\n').encode('utf-8')
+                    file.write(line)
+                self._index_pos += len(line)
+                self._runs.pop(run_name, None)
+                self._runs[run_name] = entry
+        return entry
+
+    def runs(self, query_name=None):
+        """Return the index entries of the archived runs, of query_name
+        only if given, oldest first. Entries hold the run name,
+        query_name, api_name, created, count of articles or sources and
+        compressed size.
+        """
+        with self._lock:
+            self._sync_index()
+            entries = list(self._runs.values())
+        if query_name is not None:
+            entries = [entry for entry in entries
+                       if entry['query_name'] == query_name]
+        return sorted(entries, key=lambda entry: entry['created'])
+
+    def latest_run_name(self, query_name):
+        """Return the name of the newest archived run of query_name or
+        None
+        """
+        runs = self.runs(query_name)
+        return runs[-1]['run'] if runs else None
+
+    def items(self, run_name, start=0, stop=None):
+        """Return the articles, or sources, start to stop of run_name,
+        decompressing only the chunks holding them. Raises KeyError for
+        unknown runs.
+        """
+        entry = self._entry(run_name)
+        if entry is None:
+            raise KeyError(run_name)
+        stop = entry['count'] if stop is None else min(stop, entry['count'])
+        items = []
+        for offset, length, first, count in entry['chunks']:
+            if first >= stop or first + count <= start:
+                continue
+            chunk = self._read_frame(entry, (offset, length))
+            items += chunk[max(start - first, 0):stop - first]
+        return items
+
+    def load_run(self, run_name):
+        """Return an archived run in the shape it was appended in, or None
+        if there is no such run
+        """
+        entry = self._entry(run_name)
+        if entry is None:
+            return None
+        results = self._read_frame(entry, entry['meta'])
+        if entry['items']:
+            results[entry['items']] = self.items(run_name)
+        return results
+
+    def import_blobs(self, data_dir, remove=True):
+        """Append the JSON blobs of query runs persisted in data_dir,
+        <query_name>-<timestamp>.json, oldest first, and remove them.
+        Blobs that cannot be read are left in place.
+        Response:
+            {'runs', 'failed', 'bytes_before', 'bytes_after'}
+        """
+        fnames = [fname for fname in os.listdir(data_dir)
+                  if RUN_BLOB_RE.match(fname)]
+        paths = sorted((os.path.join(data_dir, fname) for fname in fnames),
+                       key=os.path.getmtime)
+        stats = {'runs': 0, 'failed': 0, 'bytes_before': 0,
+                 'bytes_after': 0}
+        for path in paths:
+            try:
+                with open(path, 'r') as file:
+                    results = json.load(file)
+                created = datetime.fromtimestamp(
+                    os.path.getmtime(path)).isoformat(timespec='seconds')
+                entry = self.append(os.path.basename(path)[:-len('.json')],
+                                    results, created=created)
+            except (OSError, ValueError) as e:
+                self._logger.exception(e)
+                stats['failed'] += 1
+                continue
+            stats['runs'] += 1
+            stats['bytes_before'] += os.path.getsize(path)
+            stats['bytes_after'] += entry['size']
+            if remove:
+                os.remove(path)
+        return stats
+
+    def stats(self):
+        """Return the number of runs and segments and the archive size"""
+        runs = self.runs()
+        segments = [fname for fname in os.listdir(self._path)
+                    if SEGMENT_RE.match(fname)] \
+            if os.path.exists(self._path) else []
+        return {
+            'runs': len(runs), 'segments': len(segments),
+            'bytes': sum(os.path.getsize(os.path.join(self._path, fname))
+                         for fname in segments)}
+
+    def close(self):
+        with self._lock:
+            for view in self._maps.values():
+                view.close()
+            self._maps = {}
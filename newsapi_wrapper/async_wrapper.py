@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding: utf-8
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from .newsapi_wrapper import NewsApiWrapper
+from .pager import MAX_WORKERS
+from .writers import parse_formats
+from .catalog import split_sources, merge_responses
+
+NEWSAPI_URL = "https://newsapi.org/v2/"
+ENDPOINTS = {
+    'get_top_headlines': 'top-headlines',
+    'get_everything': 'everything',
+    'get_sources': 'top-headlines/sources'}
+# NewsApiClient argument names that differ from the HTTP parameter names
+PARAM_NAMES = {
+    'qintitle': 'qInTitle', 'exclude_domains': 'excludeDomains',
+    'from_param': 'from', 'sort_by': 'sortBy', 'page_size': 'pageSize'}
+TIMEOUT = 30
+KEEPALIVE_TIMEOUT = 60
+
+class AsyncNewsApiWrapper(NewsApiWrapper):
+    """asyncio variant of NewsApiWrapper. query(), incremental_query(),
+    get_top_headlines_html(), get_all_news() and get_sources() are
+    coroutines taking the same arguments as their NewsApiWrapper
+    counterparts. Requests go through one pooled aiohttp session with
+    keep-alive; result pages are fetched concurrently, at most
+    max_workers at a time. Rendering, persisting and the file I/O of the
+    response cache and quota tracker run in the default executor so they
+    do not block the event loop. Use it as an async context manager, or
+    await close(), to release the connections.
+    Eg:
+        async with AsyncNewsApiWrapper(api_key, results_dir) as news:
+            html_path = await news.get_all_news(query_name='ai', q='ai')
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, api_key, results_dir, logger=logging.getLogger(),
+                 max_workers=MAX_WORKERS, timeout=TIMEOUT,
+                 base_url=NEWSAPI_URL, **kwargs):
+        """
+        Default arguments:
+            api_key: News API key
+            results_dir: Directory to save query results
+            max_workers: Maximum number of concurrent News API requests
+            timeout: Seconds allowed for one News API request
+            base_url: News API URL; point it at a stub server for testing
+        Other keyword arguments are passed to NewsApiWrapper. stream is not
+        supported.
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("AsyncNewsApiWrapper needs aiohttp: "
+                              "pip install aiohttp")
+        self._aiohttp = aiohttp
+        NewsApiWrapper.__init__(self, api_key, results_dir, logger=logger,
+                                max_workers=max_workers, **kwargs)
+        self._stream = False
+        self._base_url = base_url.rstrip('/') + '/'
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._http = None
+        # Event loop the wrapper runs on, see _fetch_sources()
+        self._loop = None
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    #
+    # Private methods
+    #
+    def _new_session(self):
+        # The session has to be created inside the running event loop
+        connector = self._aiohttp.TCPConnector(
+            limit=self._max_workers, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        return self._aiohttp.ClientSession(
+            connector=connector, timeout=self._timeout,
+            headers={'X-Api-Key': self._api_key})
+
+    def _client_session(self):
+        if self._http is None or self._http.closed:
+            self._http = self._new_session()
+        return self._http
+
+    def _request_params(self, query_args):
+        params = {}
+        for key, val in query_args.items():
+            if val is None:
+                continue
+            params[PARAM_NAMES.get(key, key)] = str(val)
+        return params
+
+    async def _run_sync(self, func, *args):
+        self._loop = asyncio.get_running_loop()
+        return await self._loop.run_in_executor(None, partial(func, *args))
+
+    def _fetch_sources(self):
+        # The sources catalog is fetched from executor or background
+        # threads, the request running on the wrapper's event loop. From a
+        # coroutine, eg sources_catalog().refresh(), or once that loop is
+        # gone, the request runs on a loop of its own in a worker thread
+        # instead of blocking the loop it would wait for.
+        try:
+            asyncio.get_running_loop()
+            on_loop = True
+        except RuntimeError:
+            on_loop = False
+        loop = self._loop
+        with self._metrics.span('catalog_refresh'):
+            if on_loop or loop is None or not loop.is_running():
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    results = executor.submit(
+                        asyncio.run, self._fetch_sources_apart()).result()
+            else:
+                results = asyncio.run_coroutine_threadsafe(
+                    self._call('get_sources'), loop).result()
+        return results['sources']
+
+    async def _fetch_sources_apart(self):
+        async with self._new_session() as http:
+            return await self._call('get_sources', http=http)
+
+    async def _request(self, api_name, http=None, **query_args):
+        self._logger.debug('Calling {}() page {}'.format(
+            api_name, query_args.get('page', 1)))
+        self._metrics.count('api_calls')
+        http = http or self._client_session()
+        with self._metrics.span('api_call'):
+            async with http.get(
+                    self._base_url + ENDPOINTS[api_name],
+                    params=self._request_params(query_args)) as response:
+                return await response.json(content_type=None)
+
+    async def _call(self, api_name, http=None, **query_args):
+        # Rate limiting, quota accounting and retries as for the
+        # synchronous wrapper
+        request = partial(self._request, http=http) if http else \
+            self._request
+        result = await self._scheduler.call_async(api_name, request,
+                                                  **query_args)
+        self._validate_response(result, api_name)
+        self._count_page(result)
+        return result
+
+    def _fetch_page(self, api_name, page, **query_args):
+        # Called by the shard planner from executor threads; the request
+        # itself runs on the event loop
+        return asyncio.run_coroutine_threadsafe(
+            self._call(api_name, page=page, **query_args),
+            self._loop).result()
+
+    async def _fetch_all_pages_async(self, api_name, query_args):
+        if api_name == 'get_everything' and self._planner:
+            # The planner runs in the executor, see _fetch_page()
+            return await self._run_sync(self._fetch_shards, query_args)
+        # One query per batch of at most MAX_SOURCES sources
+        responses = []
+        for batch_args in split_sources(query_args):
+            responses.append(await self._fetch_batch_async(api_name,
+                                                           batch_args))
+        return merge_responses(responses, query_args.get('sort_by'))
+
+    async def _fetch_batch_async(self, api_name, query_args):
+        results = await self._call(api_name, **query_args)
+        if api_name == 'get_sources':
+            return results
+        pages = self._page_count(results.get('totalResults', 0))
+        if pages < 2:
+            return results
+        self._logger.debug('Retrieving remaining {} pages'.format(pages - 1))
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        async def fetch_page(page):
+            async with semaphore:
+                return await self._call(api_name, page=page, **query_args)
+
+        tasks = [asyncio.ensure_future(fetch_page(page))
+                 for page in range(2, pages + 1)]
+        try:
+            # gather keeps the page order
+            next_pages = await asyncio.gather(*tasks)
+        except BaseException:
+            # Do not leave requests running after a failure or cancellation
+            for task in tasks:
+                task.cancel()
+            raise
+        for next_pg in next_pages:
+            results['articles'] += next_pg['articles']
+        return results
+
+    #
+    # Public methods
+    #
+    async def query(self, api_name, queryname, persist=True, dedup=False,
+                    **query_args):
+        self._logger.debug('Query Name: {}'.format(queryname))
+        with self._metrics.span('query'):
+            self._prepare_query_args(api_name, query_args)
+            # Cache files are read and written in the executor
+            results = await self._run_sync(self._cached_response, api_name,
+                                           query_args)
+            if results is None:
+                with self._metrics.span('fetch'):
+                    results = await self._fetch_all_pages_async(api_name,
+                                                                query_args)
+                await self._run_sync(self._cache_response, api_name,
+                                     query_args, results)
+            return await self._run_sync(self._finish_query, api_name,
+                                        queryname, results, query_args,
+                                        persist, dedup)
+
+    async def incremental_query(self, query_name, queryname, **query_args):
+        self._apply_watermark(query_name, query_args)
+        results = await self.query('get_everything', queryname,
+                                   persist=False, **query_args)
+        return await self._run_sync(self._merge_with_latest_run, query_name,
+                                    queryname, results)
+
+    async def get_top_headlines_html(self, **query_args):
+        """See NewsApiWrapper.get_top_headlines_html()"""
+        try:
+            with self._metrics.span('get_top_headlines_html'):
+                # The sources catalog may have to be fetched first
+                args = await self._run_sync(partial(
+                    self._validate_top_headlines_args, **query_args))
+                formats = parse_formats(args.pop('formats', None))
+                queryname = self._query_name_with_timestamp(
+                    args.pop('query_name'))
+                results = await self.query('get_top_headlines', queryname,
+                                           **args)
+                return await self._run_sync(
+                    self._render_articles, 'get_top_headlines', results,
+                    queryname, formats)
+        except Exception as e:
+            self._logger.exception(e)
+
+    async def get_all_news(self, **query_args):
+        """See NewsApiWrapper.get_all_news()"""
+        try:
+            with self._metrics.span('get_all_news'):
+                args = await self._run_sync(partial(
+                    self._validate_everything_args, **query_args))
+                incremental = args.pop('incremental', False)
+                formats = parse_formats(args.pop('formats', None))
+                query_name = args.pop('query_name')
+                queryname = self._query_name_with_timestamp(query_name)
+                if incremental:
+                    results = await self.incremental_query(
+                        query_name, queryname, **args)
+                else:
+                    results = await self.query('get_everything', queryname,
+                                               **args)
+                return await self._run_sync(
+                    self._render_articles, 'get_everything', results,
+                    queryname, formats)
+        except Exception as e:
+            self._logger.exception(e)
+
+    async def get_sources(self, **query_args):
+        """See NewsApiWrapper.get_sources()"""
+        try:
+            with self._metrics.span('get_sources'):
+                args = self._remove_empty_args(**query_args)
+                formats = parse_formats(args.pop('formats', None))
+                queryname = self._query_name_with_timestamp(args.pop(
+                    'query_name'))
+                results = await self._run_sync(partial(
+                    self.sources_query, queryname, **args))
+                return await self._run_sync(self._render_sources, results,
+                                            queryname, formats)
+        except Exception as e:
+            self._logger.exception(e)
+
+    async def close(self):
+        """Close the HTTP session and the article store"""
+        if self._http is not None:
+            await self._http.close()
+        NewsApiWrapper.close(self)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+CACHE_PATH = "Cache/"
+# Seconds a cached response stays valid, per News API endpoint; headlines
+# change often. Sources are kept in the sources catalog instead, see
+# SourceCatalog.
+DEFAULT_TTLS = {
+    'get_top_headlines': 5*60,
+    'get_everything': 15*60}
+DEFAULT_TTL = 5*60
+MAX_ENTRIES = 256
+MAX_BYTES = 64*1024*1024
+# Query arguments holding comma-separated lists whose order is irrelevant
+LIST_ARGS = ('sources', 'domains', 'exclude_domains')
+# Query arguments that do not change the logical result set
+IGNORED_ARGS = ('page', 'page_size')
+
+class ResponseCache:
+    #
+    # Constructor
+    #
+    def __init__(self, cache_dir, ttls=None, max_entries=MAX_ENTRIES,
+                 max_bytes=MAX_BYTES, logger=logging.getLogger()):
+        """
+        Default arguments:
+            cache_dir: Directory to keep the cached responses in
+            ttls: Dict of News API name to time to live in seconds.
+                  Overrides DEFAULT_TTLS for the given APIs.
+            max_entries: Maximum number of responses kept in the cache
+            max_bytes: Maximum total size of the cached responses
+        """
+        self._logger = logger
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._cache_dir = cache_dir
+        self._ttls = dict(DEFAULT_TTLS)
+        self._ttls.update(ttls or {})
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # key -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._load_index()
+
+    #
+    # Private methods
+    #
+    def _load_index(self):
+        entries = []
+        for fname in os.listdir(self._cache_dir):
+            if not fname.endswith('.json'):
+                continue
+            stat = os.stat(os.path.join(self._cache_dir, fname))
+            entries.append((stat.st_mtime, fname[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + '.json')
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = sum(self._entries.values())
+        while self._entries and (len(self._entries) > self._max_entries
+                                 or total > self._max_bytes):
+            key, size = self._entries.popitem(last=False)
+            self._remove(key)
+            total -= size
+            self._evictions += 1
+            self._logger.debug('Evicted cached response {}'.format(key))
+
+    def _normalize_args(self, query_args):
+        args = {}
+        for key, val in query_args.items():
+            if key in IGNORED_ARGS or val is None:
+                continue
+            if isinstance(val, str):
+                val = val.strip()
+                if not val:
+                    continue
+                if key in LIST_ARGS:
+                    val = ','.join(sorted(
+                        item.strip().lower() for item in val.split(',')
+                        if item.strip()))
+            args[key.lower()] = val
+        return args
+
+    #
+    # Public methods
+    #
+    def make_key(self, api_name, query_args):
+        """Return the content address of api_name called with query_args"""
+        blob = json.dumps([api_name, self._normalize_args(query_args)],
+                          sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def ttl(self, api_name):
+        return self._ttls.get(api_name, DEFAULT_TTL)
+
+    def get(self, api_name, query_args):
+        """Return the cached response for api_name called with query_args
+        or None when it is not cached or has expired.
+        """
+        key = self.make_key(api_name, query_args)
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return None
+            try:
+                with open(self._path(key), 'r') as file:
+                    entry = json.load(file)
+            except (OSError, ValueError) as e:
+                self._logger.debug('Dropping unreadable cache entry {}: {}'\
+                    .format(key, e))
+                self._remove(key)
+                self._misses += 1
+                return None
+            if time.time() - entry['stored_at'] > self.ttl(api_name):
+                self._remove(key)
+                self._misses += 1
+                return None
+            # Mark as most recently used, also for other processes
+            self._entries.move_to_end(key)
+            os.utime(self._path(key))
+            self._hits += 1
+            return entry['response']
+
+    def put(self, api_name, query_args, response):
+        """Cache response for api_name called with query_args"""
+        key = self.make_key(api_name, query_args)
+        entry = {
+            'api_name': api_name,
+            'query_args': self._normalize_args(query_args),
+            'stored_at': time.time(),
+            'response': response}
+        with self._lock:
+            path = self._path(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, path)
+            self._entries[key] = os.path.getsize(path)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size"""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'bytes': sum(self._entries.values())}
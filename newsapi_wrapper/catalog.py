@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import re
+import json
+import time
+import threading
+import logging
+
+from .scheduler import NewsApiError
+
+CATALOG_FILE = "sources.json"
+# Sources change rarely; the catalog is refreshed in the background once
+# it is older than this
+CATALOG_TTL = 7*24*60*60
+# Seconds before a failed refresh is tried again
+RETRY_AFTER = 15*60
+# Most sources News API accepts in one request
+MAX_SOURCES = 20
+CATEGORIES = ('business', 'entertainment', 'general', 'health', 'science',
+              'sports', 'technology')
+COUNTRIES = ('ae', 'ar', 'at', 'au', 'be', 'bg', 'br', 'ca', 'ch', 'cn',
+             'co', 'cu', 'cz', 'de', 'eg', 'fr', 'gb', 'gr', 'hk', 'hu',
+             'id', 'ie', 'il', 'in', 'it', 'jp', 'kr', 'lt', 'lv', 'ma',
+             'mx', 'my', 'ng', 'nl', 'no', 'nz', 'ph', 'pl', 'pt', 'ro',
+             'rs', 'ru', 'sa', 'se', 'sg', 'si', 'sk', 'th', 'tr', 'tw',
+             'ua', 'us', 've', 'za')
+LANGUAGES = ('ar', 'de', 'en', 'es', 'fr', 'he', 'it', 'nl', 'no', 'pt',
+             'ru', 'se', 'sv', 'ud', 'zh')
+DOMAIN_RE = re.compile(
+    r'^(?!-)[a-z0-9-]{1,63}(?<!-)(\.(?!-)[a-z0-9-]{1,63}(?<!-))+$')
+# Sort orders whose results can be merged by publication date
+DATE_SORTS = (None, '', 'publishedAt')
+
+def split_list(value):
+    """Return the items of a comma-separated string or of a list"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return [item.strip() for item in value or [] if item.strip()]
+
+def split_sources(query_args, size=MAX_SOURCES):
+    """Return query_args as a list of queries of at most size sources
+    each; query_args itself when it has no more sources than that
+    """
+    sources = split_list(query_args.get('sources'))
+    if len(sources) <= size:
+        return [query_args]
+    batches = []
+    for start in range(0, len(sources), size):
+        batch_args = dict(query_args)
+        batch_args.update(sources=','.join(sources[start:start + size]))
+        batches.append(batch_args)
+    return batches
+
+def merge_responses(responses, sort_by=None):
+    """Return one response with the articles and total results of the
+    responses of the batches of a query. Articles are sorted newest first
+    unless sort_by is relevancy or popularity, which cannot be merged;
+    then the batches are concatenated.
+    """
+    results = responses[0]
+    if len(responses) == 1:
+        return results
+    for response in responses[1:]:
+        results['articles'] += response['articles']
+        results['totalResults'] = results.get('totalResults', 0) + \
+            response.get('totalResults', 0)
+    if sort_by in DATE_SORTS:
+        results['articles'].sort(
+            key=lambda article: article.get('publishedAt') or '',
+            reverse=True)
+    return results
+
+
+class SourceCatalog:
+    """Local copy of the News API sources list, indexed by id, category,
+    language and country. It is kept in a JSON file, fetched on first use
+    and refreshed in a background thread once older than ttl; the stale
+    catalog is used meanwhile. Queries are validated against it and
+    category/country filters of get_everything, which News API does not
+    support, are expanded into source lists.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, fetch, ttl=CATALOG_TTL,
+                 logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: JSON file the catalog is kept in
+            fetch: Called without arguments to get the list of all
+                   sources from News API
+            ttl: Seconds after which the catalog is refreshed
+        """
+        self._path = path
+        self._fetch = fetch
+        self._ttl = ttl
+        self._logger = logger
+        self._lock = threading.Lock()
+        # Held while fetching the catalog in the foreground
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._loaded = False
+        self._updated = None
+        self._failed_at = None
+        self._sources = []
+        self._by_id = {}
+        self._by_key = {}
+
+    #
+    # Private methods
+    #
+    def _index(self, sources, updated):
+        by_id = {}
+        by_key = {}
+        for source in sources:
+            by_id[source.get('id')] = source
+            for key in ('category', 'language', 'country'):
+                by_key.setdefault((key, source.get(key)), []).append(
+                    source.get('id'))
+        with self._lock:
+            self._sources = sources
+            self._by_id = by_id
+            self._by_key = by_key
+            self._updated = updated
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, 'r') as file:
+                catalog = json.load(file)
+            self._index(catalog['sources'], catalog['updated'])
+        except (OSError, ValueError, KeyError) as e:
+            self._logger.exception(e)
+
+    def _save(self, sources, updated):
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'updated': updated, 'sources': sources}, file)
+        os.replace(tmp_path, self._path)
+
+    def _refresh(self):
+        try:
+            sources = self._fetch()
+            updated = time.time()
+            self._index(sources, updated)
+            self._save(sources, updated)
+            self._logger.debug('Sources catalog refreshed: {} sources'.format(
+                len(sources)))
+        except Exception as e:
+            self._failed_at = time.time()
+            self._logger.exception(e)
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        finally:
+            self._refreshing = False
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh,
+                         name='sources-catalog', daemon=True).start()
+
+    def _fresh(self):
+        return self._updated is not None and \
+            time.time() - self._updated <= self._ttl
+
+    def _ensure(self):
+        # Load the catalog on first use, fetch it if there is none yet and
+        # refresh it in the background once stale
+        if self._fresh():
+            return
+        with self._fetch_lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load()
+                if self._fresh():
+                    return
+            retry = not self._failed_at or \
+                time.time() - self._failed_at >= RETRY_AFTER
+            if self._updated is None and retry:
+                # Other threads wait for the first fetch
+                self._refresh()
+                return
+        if self._updated is not None and retry:
+            self._start_refresh()
+
+    def _check_values(self, args, name, allowed):
+        for value in split_list(args.get(name)):
+            if value not in allowed:
+                raise NewsApiError(
+                    "ERROR: Invalid {}: {}. Possible options: {}".format(
+                        name, value, ' '.join(allowed)), 'parameterInvalid')
+
+    def _check_domains(self, args, name):
+        for domain in split_list(args.get(name)):
+            if not DOMAIN_RE.match(domain.lower()):
+                raise NewsApiError("ERROR: Invalid domain in {}: {}".format(
+                    name, domain), 'parameterInvalid')
+
+    #
+    # Public methods
+    #
+    def available(self):
+        """True when a catalog, possibly stale, is available"""
+        self._ensure()
+        return self._updated is not None
+
+    def refresh(self, wait=True):
+        """Fetch the catalog from News API now, or in the background"""
+        if not wait:
+            self._start_refresh()
+            return
+        with self._fetch_lock:
+            self._loaded = True
+            self._refresh()
+
+    def source(self, source_id):
+        """Return the source with source_id, or None"""
+        self._ensure()
+        with self._lock:
+            return self._by_id.get(source_id)
+
+    def sources(self, category=None, language=None, country=None):
+        """Return the sources matching all the given filters, in catalog
+        order. Filters are single values or comma-separated lists.
+        """
+        self._ensure()
+        with self._lock:
+            sources, by_key = self._sources, self._by_key
+        ids = None
+        for key, values in (('category', category), ('language', language),
+                            ('country', country)):
+            values = split_list(values)
+            if not values:
+                continue
+            matching = set()
+            for value in values:
+                matching.update(by_key.get((key, value), ()))
+            ids = matching if ids is None else ids & matching
+        if ids is None:
+            return list(sources)
+        return [source for source in sources if source.get('id') in ids]
+
+    def validate(self, api_name, args):
+        """Check the arguments of an api_name query locally and return
+        them, for get_everything with category and country expanded into
+        the matching sources. Raises NewsApiError, with the error code
+        News API would answer with, for invalid categories, countries,
+        languages, domains and unknown sources.
+        """
+        self._check_values(args, 'category', CATEGORIES)
+        self._check_values(args, 'country', COUNTRIES)
+        self._check_values(args, 'language', LANGUAGES)
+        if api_name == 'get_everything':
+            self._check_domains(args, 'domains')
+            self._check_domains(args, 'exclude_domains')
+        category = args.get('category')
+        country = args.get('country')
+        if api_name == 'get_everything' and (category or country):
+            if args.get('sources'):
+                raise NewsApiError("ERROR: you can't mix category or "
+                                   "country with the sources param",
+                                   'parameterInvalid')
+            if not self.available():
+                raise NewsApiError("ERROR: category and country need the "
+                                   "sources catalog, which is not "
+                                   "available", 'parameterInvalid')
+            args = dict(args)
+            args.pop('category', None)
+            args.pop('country', None)
+            ids = [source['id'] for source in self.sources(
+                category=category, country=country)]
+            if not ids:
+                raise NewsApiError("ERROR: No sources match category {} "
+                                   "and country {}".format(category, country),
+                                   'sourcesDoNotExist')
+            self._logger.debug('Expanded category {} and country {} into '
+                               '{} sources'.format(category, country,
+                                                   len(ids)))
+            args.update(sources=','.join(ids))
+        elif args.get('sources') and self.available():
+            with self._lock:
+                by_id = self._by_id
+            unknown = [source_id for source_id in split_list(args['sources'])
+                       if source_id not in by_id]
+            if unknown:
+                raise NewsApiError("ERROR: Unknown sources: {}".format(
+                    ', '.join(unknown)), 'sourceDoesNotExist')
+        return args
+
+    def stats(self):
+        """Return the number of sources and the age of the catalog"""
+        with self._lock:
+            return {
+                'sources': len(self._sources),
+                'updated': self._updated,
+                'age': round(time.time() - self._updated)
+                if self._updated else None}
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .filelock import file_lock
+
+SEEN_FILE = "seen.json"
+# Articles are remembered for a week after they were first seen
+SEEN_TTL = 7*24*60*60
+# Titles whose 64 bit SimHashes differ in at most this many bits are
+# near-duplicates. Headlines are short, so one added or changed word
+# already moves the SimHash by 5 to 10 bits.
+MAX_DISTANCE = 6
+# Titles with fewer words are only deduplicated by URL
+MIN_TITLE_WORDS = 4
+HASH_BITS = 64
+# Trailing " - Publisher" or " | Publisher" added by syndicating sites
+TITLE_SUFFIX_RE = re.compile(r'\s+[-|–—]\s+[^-|–—]{1,40}$')
+WORD_RE = re.compile(r'\w+')
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'ocid', 'cmpid')
+
+def url_key(url):
+    """Return a hash of url ignoring the scheme, a leading www., the
+    fragment, a trailing slash and tracking query parameters.
+    """
+    parts = urlsplit((url or '').strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted(
+        (key, val) for key, val in parse_qsl(parts.query)
+        if not key.lower().startswith(TRACKING_PARAMS)))
+    normalized = urlunsplit(('', host, parts.path.rstrip('/'), query, ''))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+def title_words(title):
+    """Return the lower case words of title without its publisher suffix"""
+    title = TITLE_SUFFIX_RE.sub('', title or '')
+    return WORD_RE.findall(title.lower())
+
+# SPREAD[byte] has bit i of byte moved to bit 8*i, so that the bits of
+# many hashes can be counted in parallel in 8 bit lanes of one integer
+SPREAD = [sum((byte >> i & 1) << 8*i for i in range(8)) for byte in range(256)]
+# Features counted per SimHash; more would overflow the 8 bit lanes
+MAX_FEATURES = 255
+
+def simhash(words):
+    """Return the 64 bit SimHash of words, using the words and the pairs
+    of adjacent words as features.
+    """
+    features = words + [a + ' ' + b for a, b in zip(words, words[1:])]
+    features = features[:MAX_FEATURES]
+    lanes = 0
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode('utf-8'),
+                                 digest_size=HASH_BITS//8).digest()
+        for pos, byte in enumerate(digest):
+            lanes += SPREAD[byte] << 64*pos
+    # Lane k counts the features with bit k set; keep the majority
+    return sum(1 << bit for bit, ones in enumerate(
+        lanes.to_bytes(HASH_BITS, 'little')) if 2*ones > len(features))
+
+
+class ArticleDeduplicator:
+    """Drop articles already seen by this or earlier queries: same URL,
+    or a title whose SimHash is within max_distance bits of a title seen
+    before. Seen articles are kept in a JSON file and forgotten ttl
+    seconds after they were first seen. Saving merges the file with the
+    articles other processes saved meanwhile, under a file lock.
+    Near-duplicates are looked up by splitting the fingerprints into
+    max_distance + 1 disjoint bands: two fingerprints within max_distance
+    bits agree on at least one band.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, ttl=SEEN_TTL, max_distance=MAX_DISTANCE,
+                 logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: JSON file the seen articles are kept in
+            ttl: Seconds an article is remembered after it was first seen
+            max_distance: Maximum number of differing SimHash bits of
+                          near-duplicate titles
+        """
+        self._path = path
+        self._ttl = ttl
+        self._max_distance = max_distance
+        self._band_bits = HASH_BITS//(max_distance + 1)
+        self._logger = logger
+        self._lock = threading.Lock()
+        # Loaded on first use: url key -> [title SimHash or None, seen at]
+        self._seen = None
+        self._bands = {}
+        self._url_duplicates = 0
+        self._title_duplicates = 0
+
+    #
+    # Private methods
+    #
+    def _band_keys(self, fingerprint):
+        mask = (1 << self._band_bits) - 1
+        return [(band, fingerprint >> band*self._band_bits & mask)
+                for band in range(self._max_distance + 1)]
+
+    def _remember(self, key, fingerprint, seen_at):
+        self._seen[key] = [fingerprint, seen_at]
+        if fingerprint is not None:
+            for band_key in self._band_keys(fingerprint):
+                self._bands.setdefault(band_key, []).append(fingerprint)
+
+    def _reset(self, seen):
+        # Rebuild the seen articles and the band index without the
+        # expired entries
+        self._seen, self._bands = {}, {}
+        oldest = time.time() - self._ttl
+        for key, (fingerprint, seen_at) in seen.items():
+            if seen_at >= oldest:
+                self._remember(key, fingerprint, seen_at)
+
+    def _read(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self._logger.exception(e)
+            return {}
+
+    def _load(self):
+        self._reset(self._read())
+
+    def _near_duplicate(self, fingerprint):
+        for band_key in self._band_keys(fingerprint):
+            for other in self._bands.get(band_key, ()):
+                if bin(fingerprint ^ other).count('1') <= self._max_distance:
+                    return True
+        return False
+
+    #
+    # Public methods
+    #
+    def filter(self, articles):
+        """Return the articles not seen before, in their order, and
+        remember them. Duplicates within articles are dropped as well.
+        """
+        with self._lock:
+            if self._seen is None:
+                self._load()
+            now = time.time()
+            kept = []
+            for article in articles:
+                key = url_key(article.get('url'))
+                if key in self._seen:
+                    self._url_duplicates += 1
+                    continue
+                fingerprint = None
+                words = title_words(article.get('title'))
+                if len(words) >= MIN_TITLE_WORDS:
+                    fingerprint = simhash(words)
+                    if self._near_duplicate(fingerprint):
+                        self._title_duplicates += 1
+                        continue
+                self._remember(key, fingerprint, now)
+                kept.append(article)
+            return kept
+
+    def save(self):
+        """Write the seen articles, without the expired ones, to disk,
+        merged with the articles other processes saved since they were
+        loaded
+        """
+        with self._lock, file_lock(self._path):
+            if self._seen is None:
+                return
+            seen = self._read()
+            for key, (fingerprint, seen_at) in self._seen.items():
+                # An article keeps the time it was first seen
+                if key not in seen or seen[key][1] > seen_at:
+                    seen[key] = [fingerprint, seen_at]
+            self._reset(seen)
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self._seen, file)
+            os.replace(tmp_path, self._path)
+
+    def stats(self):
+        """Return the number of duplicates dropped and articles seen"""
+        with self._lock:
+            return {
+                'url_duplicates': self._url_duplicates,
+                'title_duplicates': self._title_duplicates,
+                'seen': len(self._seen) if self._seen is not None else None}
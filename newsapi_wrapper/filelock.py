@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# coding: utf-8
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: files are only locked against other threads of the process
+    fcntl = None
+
+LOCK_SUFFIX = ".lock"
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path for the with block, across
+    processes. The lock is taken on the file path.lock, so that path
+    itself can be replaced with os.replace() while locked.
+    """
+    with open(path + LOCK_SUFFIX, 'a') as file:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+import re
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+METRIC_PREFIX = "newsapi"
+NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+class Metrics:
+    """Per-stage timings and counters of NewsApiWrapper.
+    Stages are timed with span(); each stage keeps its count, total and
+    maximum duration. Counters are incremented with count(). Hooks added
+    with add_hook() are called as hook(kind, name, value) for every ended
+    span ('span', stage, seconds) and counter increment ('counter', name,
+    amount), eg to forward them to a monitoring system.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, logger=logging.getLogger()):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+        self._hooks = []
+
+    #
+    # Private methods
+    #
+    def _notify(self, kind, name, value):
+        for hook in self._hooks:
+            try:
+                hook(kind, name, value)
+            except Exception as e:
+                # A failing hook must not fail the query
+                self._logger.exception(e)
+
+    #
+    # Public methods
+    #
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    @contextmanager
+    def span(self, stage):
+        """Time the with block as stage, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        """Record a duration of stage measured elsewhere"""
+        with self._lock:
+            span = self._spans.setdefault(stage, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+        self._notify('span', stage, seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+        self._notify('counter', name, amount)
+
+    def stats(self):
+        """Return {'stages': {stage: {count, total, max, mean}},
+        'counters': {name: value}}; durations in seconds
+        """
+        with self._lock:
+            stages = {stage: {'count': count, 'total': round(total, 6),
+                              'max': round(most, 6),
+                              'mean': round(total/count, 6)}
+                      for stage, (count, total, most) in self._spans.items()}
+            return {'stages': stages, 'counters': dict(self._counters)}
+
+    def to_json(self):
+        return json.dumps(self.stats(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = []
+        name = METRIC_PREFIX + '_stage_seconds'
+        lines.append('# HELP {} Time spent per query stage.'.format(name))
+        lines.append('# TYPE {} summary'.format(name))
+        for stage, span in sorted(stats['stages'].items()):
+            lines.append('{}_count{{stage="{}"}} {}'.format(
+                name, stage, span['count']))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(
+                name, stage, span['total']))
+        lines.append('# HELP {}_max Longest time spent in a query '
+                     'stage.'.format(name))
+        lines.append('# TYPE {}_max gauge'.format(name))
+        for stage, span in sorted(stats['stages'].items()):
+            lines.append('{}_max{{stage="{}"}} {}'.format(
+                name, stage, span['max']))
+        for counter, value in sorted(stats['counters'].items()):
+            metric = '{}_{}_total'.format(METRIC_PREFIX,
+                                          NAME_RE.sub('_', counter))
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write the metrics to path, as JSON if it ends with .json and
+        in the Prometheus text format otherwise
+        """
+        text = self.to_json() if path.endswith('.json') else \
+            self.to_prometheus()
+        with open(path, 'w') as file:
+            file.write(text)
@@ -2,38 +2,121 @@
 # coding: utf-8
 import time
 import os
+import re
 import json
 import shutil
 import errno
-import pandas as pd
-from pandas import json_normalize
-from newsapi import NewsApiClient
+import threading
+from functools import partial
+from html import escape
 from datetime import datetime, timedelta, date
 import logging
 from logging.config import fileConfig
 
-pd.options.display.float_format = '{:.2f}'.format
-pd.set_option('display.max_columns', 30)
-pd.set_option('display.max_rows', 100)
+from .pager import PageFetcher, MAX_WORKERS
+from .scheduler import RequestScheduler, TokenBucket, QuotaTracker, \
+    NewsApiError, QUOTA_FILE, MAX_RETRIES
+from .cache import ResponseCache, CACHE_PATH
+from .writers import HtmlTableWriter, JsonLinesWriter, open_writers, \
+    parse_formats
+from .render import load_template
+from .records import Article, Source, articles_from_json, \
+    sources_from_json, to_dataframe
+from .watermark import WatermarkStore, WATERMARK_FILE
+from .store import ArticleStore, STORE_FILE
+from .search import to_fts_query
+from .dedup import ArticleDeduplicator, SEEN_FILE, SEEN_TTL
+from .metrics import Metrics
+from .catalog import SourceCatalog, CATALOG_FILE, CATALOG_TTL, \
+    split_sources, merge_responses
+from .shard import ShardPlanner, MAX_SHARDS
+from .archive import RunArchive, ARCHIVE_PATH
 
 TEMPLATE_PATH = "Templates/"
 DATA_PATH = "Data/"
 HTML_TEMPLATE = "query_result_template.html"
 PAGE_SIZE = 100
+# Article columns shown in the result HTML table
+ARTICLE_HTML_COLUMNS = ['Date','Title', 'Summary', 'Author', 'Source']
+NEWSAPI_CALLS = ('get_top_headlines', 'get_everything', 'get_sources')
+# Records handed to the output writers at a time
+OUTPUT_CHUNK = 1000
+# Rows per page of the result HTML reports; larger results are split
+# into several linked files
+HTML_PAGE_ROWS = 2000
 
 class NewsApiWrapper:
     #
     # Constructor
     #    
-    def __init__(self, api_key, results_dir, logger=logging.getLogger()):
+    def __init__(self, api_key, results_dir, logger=logging.getLogger(),
+                 max_workers=MAX_WORKERS, rate_limit=None, burst=None,
+                 daily_quota=None, max_retries=MAX_RETRIES,
+                 newsapi_client=None, use_cache=True, cache_ttls=None,
+                 http_pool_size=None, stream=False, storage='sqlite',
+                 dedup_ttl=SEEN_TTL, metrics=None,
+                 html_page_rows=HTML_PAGE_ROWS, catalog_ttl=CATALOG_TTL,
+                 max_results=None, max_shards=MAX_SHARDS):
         """
         Default arguments:
             api_key: News API key
             results_dir: Directory to save query results
+            max_workers: Maximum number of result pages fetched in parallel
+            rate_limit: Sustained number of News API calls per second
+                        allowed by the token bucket. None disables rate
+                        limiting.
+            burst: Number of calls allowed back to back before rate_limit
+                   applies. Default: max(1, rate_limit)
+            daily_quota: Requests allowed per UTC day by the News API plan.
+                         Requests are counted per endpoint in
+                         Data/quota.json across runs and fail with
+                         QuotaExceededError once it is used up. None only
+                         counts requests.
+            max_retries: Number of times a request is repeated, with
+                         exponential backoff and jitter, on rate limiting,
+                         server and connection errors
+            newsapi_client: NewsApiClient instance to use instead of
+                            creating one from api_key
+            use_cache: Serve repeated queries from the on-disk response
+                       cache instead of calling News API
+            cache_ttls: Dict of News API name to cache time to live in
+                        seconds
+            http_pool_size: Number of keep-alive connections kept in the
+                            shared HTTP session. Default: max_workers
+            stream: Write top headlines and everything results to disk
+                    page by page instead of collecting them in memory.
+                    See stream_query().
+            storage: Where query results are persisted. 'sqlite' keeps
+                     them in the article store Data/newsapi.db, 'json'
+                     writes one Data/<query_name>-<timestamp>.json blob per
+                     query, 'archive' appends them to the compressed run
+                     archive Data/Archive/, see RunArchive.
+            dedup_ttl: Seconds an article is remembered, in Data/seen.json,
+                       by queries run with dedup=True
+            metrics: Metrics the stage timings and counters are recorded
+                     in, eg one shared by several wrappers. Default: a new
+                     Metrics, see metrics()
+            html_page_rows: Maximum number of table rows per result HTML
+                            file; larger results are split into pages
+                            <name>.html, <name>-p2.html, ... None or 0
+                            writes a single file.
+            catalog_ttl: Seconds after which the local sources catalog,
+                         Data/sources.json, is refreshed in the
+                         background. See SourceCatalog.
+            max_results: Deepest result News API serves for one query on
+                         your plan, eg 100 on the Developer plan. When set,
+                         get_everything queries with more results are
+                         split into sub-queries by time window and source
+                         batch, see ShardPlanner. Default: None, every
+                         result page of one query is fetched.
+            max_shards: Most sub-queries one get_everything query is split
+                        into; results beyond them are dropped with a
+                        warning
         Keyword arguments passed in query_args:
             :
         """
         self._logger = logger
+        self._metrics = metrics or Metrics(logger=logger)
         if not os.path.exists(r"{}".format(results_dir)):
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), results_dir)
         self._results_dir = results_dir
@@ -42,48 +125,145 @@ class NewsApiWrapper:
         if not os.path.exists(data_dir):
             os.mkdir(data_dir)        
         self._data_dir = data_dir
+        self._watermarks = WatermarkStore(
+            os.path.join(data_dir, WATERMARK_FILE), logger=self._logger)
+        if storage not in ('sqlite', 'json', 'archive'):
+            raise ValueError("Invalid storage: {}".format(storage))
+        self._store = None
+        if storage == 'sqlite':
+            self._store = ArticleStore(os.path.join(data_dir, STORE_FILE),
+                                       logger=self._logger)
+        # Also read by json storage, for the runs compacted into it
+        self._archive = RunArchive(
+            os.path.join(data_dir, ARCHIVE_PATH.rstrip('/')),
+            logger=self._logger)
+        self._storage = storage
         self._template_dir = os.path.join(dir_path, TEMPLATE_PATH.lstrip('.'))
+        self._cache = None
+        if use_cache:
+            self._cache = ResponseCache(
+                os.path.join(dir_path, CACHE_PATH.lstrip('.')),
+                ttls=cache_ttls, logger=self._logger)
         self._html_template = HTML_TEMPLATE
+        self._html_page_rows = html_page_rows
+        self._style_sheet_copied = False
         self._pgsize = PAGE_SIZE
+        self._stream = stream
+        self._dedup = ArticleDeduplicator(
+            os.path.join(data_dir, SEEN_FILE), ttl=dedup_ttl,
+            logger=self._logger)
         self._logger.debug('results_dir: {}'.format(results_dir))
-        try:
-            self._newsapi = NewsApiClient(api_key=api_key)
-            self._newsapi_calls = {
-                'get_top_headlines': self._newsapi.get_top_headlines,
-                'get_everything': self._newsapi.get_everything,
-                'get_sources': self._newsapi.get_sources}
-        except:
-            self._logger.exception('Failed to initialize NewsApiClient')
-            raise
+        # The NewsApiClient is created on the first News API call so that
+        # cached queries do not pay for importing it
+        self._newsapi = newsapi_client
+        self._session = None
+        self._http_pool_size = http_pool_size or max_workers
+        self._client_lock = threading.Lock()
+        # Run names handed out, see _query_name_with_timestamp
+        self._run_names = set()
+        self._run_names_lock = threading.Lock()
+        self._newsapi_calls = {api_name: partial(self._call_newsapi, api_name)
+                               for api_name in NEWSAPI_CALLS}
+        self._api_key = api_key
+        self._max_workers = max_workers
+        self._quota = QuotaTracker(os.path.join(data_dir, QUOTA_FILE),
+                                   daily_quota, logger=self._logger)
+        self._scheduler = RequestScheduler(
+            self._newsapi_calls,
+            bucket=TokenBucket(rate_limit, burst),
+            quota=self._quota,
+            max_retries=max_retries, logger=self._logger)
+        self._pager = PageFetcher(self._scheduler.call,
+                                  max_workers=max_workers,
+                                  logger=self._logger)
+        self._planner = None
+        if max_results:
+            self._planner = ShardPlanner(
+                partial(self._fetch_page, 'get_everything'),
+                max_results=max_results, max_shards=max_shards,
+                max_workers=max_workers, logger=self._logger)
+        self._catalog = SourceCatalog(os.path.join(data_dir, CATALOG_FILE),
+                                      self._fetch_sources, ttl=catalog_ttl,
+                                      logger=self._logger)
                 
     #
     # Private methods
     #
-    def _cleanup_article_df(self, article_df):   
-        new_cols={
-            'author':'Author', 'title':'Title', 'description':'Summary', 
-            'url': 'URL','urlToImage':'URL to Image', 'publishedAt':'Date',
-            'content': 'Content', 'source.name': 'Source'}
-        new_order = [
-            'Date','Title', 'Summary', 'Author', 'Source', 'Content','URL',
-            'URL to Image']
-        article_df = article_df.rename(columns=new_cols)
-        article_df['Date'] = article_df['Date'].astype('datetime64[D]')
-        return article_df[new_order]
- 
-    def _cleanup_source_df(self, source_df):
-        new_cols={
-            'id': 'Source ID', 'name': 'Source Name', 
-            'description': 'Description', 'url': 'URL','category': 'Category',
-            'language': 'Language', 'country': 'Country'}
-        source_df = source_df.rename(columns=new_cols)
-        return source_df
+    def _newsapi_client(self):
+        with self._client_lock:
+            if self._newsapi is not None:
+                return self._newsapi
+            try:
+                import requests
+                from newsapi import NewsApiClient
+                # One HTTP session is shared by every call made through
+                # this wrapper so that connections are reused across pages
+                # and queries
+                self._session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self._http_pool_size,
+                    pool_maxsize=self._http_pool_size)
+                self._session.mount('https://', adapter)
+                self._newsapi = NewsApiClient(api_key=self._api_key,
+                                              session=self._session)
+            except:
+                self._logger.exception('Failed to initialize NewsApiClient')
+                raise
+            return self._newsapi
+
+    def _call_newsapi(self, api_name, **query_args):
+        self._metrics.count('api_calls')
+        with self._metrics.span('api_call'):
+            return getattr(self._newsapi_client(), api_name)(**query_args)
+
+    def _count_page(self, page):
+        # Counters of a validated result page
+        self._metrics.count('pages')
+        if 'articles' in page:
+            self._metrics.count('articles', len(page['articles']))
+        if 'sources' in page:
+            self._metrics.count('sources', len(page['sources']))
+
+    def _fetch_page(self, api_name, page, **query_args):
+        # One validated result page, for the shard planner
+        results = self._scheduler.call(api_name, page=page, **query_args)
+        self._validate_response(results, api_name)
+        self._count_page(results)
+        return results
+
+    def _fetch_sources(self):
+        # Every source known to News API, for the sources catalog
+        with self._metrics.span('catalog_refresh'):
+            results = self._scheduler.call('get_sources')
+        self._validate_response(results, 'get_sources')
+        self._count_page(results)
+        return results['sources']
+
+    def _count_bytes_written(self, *paths):
+        self._metrics.count('bytes_written', sum(
+            os.path.getsize(path) for path in paths if os.path.exists(path)))
 
     def _persist_query_response_blob(self, data, fname):
+        if self._store:
+            try:
+                with self._metrics.span('persist'):
+                    self._store.save_run(data, fname)
+            except Exception as e:
+                self._logger.exception(e)
+            return
+        if self._storage == 'archive':
+            try:
+                with self._metrics.span('persist'):
+                    entry = self._archive.append(fname, data)
+                self._metrics.count('bytes_written', entry['size'])
+            except Exception as e:
+                self._logger.exception(e)
+            return
         path = self._data_dir+fname+'.json'
         try:
-            with open(path, "w") as file:
+            with self._metrics.span('persist'), open(path, "w") as file:
                 json.dump(data, file)
+            self._count_bytes_written(path)
         except Exception as e:
             self._logger.exception(e)
 
@@ -97,80 +277,105 @@ class NewsApiWrapper:
             self._logger.exception(e)
             return ''
 
-    def _read_html_template(self):
-        try:
-            path = self._template_dir + self._html_template
-            with open(path, "r") as file:
-                data = file.read()
-                return data
-        except Exception as e:
-            self._logger.exception(e)
-            return ''
+    def _copy_style_sheet(self):
+        # Once per wrapper, not on every query
+        if self._style_sheet_copied:
+            return
+        dst_css = os.path.join(self._results_dir, 'style.css')
+        if not os.path.exists(dst_css):
+            shutil.copyfile(
+                self._template_dir + 'style_template.css',dst_css)
+        self._style_sheet_copied = True
+
+    def _latest_persisted_blob_name(self, query_name):
+        # File name of the newest blob persisted for query_name, if any
+        pattern = re.compile(re.escape(query_name) +
+                             r'-\d{2}_\d{2}_\d{4}-\d{2}_\d{2}_\d{2}\.json$')
+        fnames = [fname for fname in os.listdir(self._data_dir)
+                  if pattern.match(fname)]
+        if not fnames:
+            return None
+        return max(fnames, key=lambda fname: os.path.getmtime(
+            os.path.join(self._data_dir, fname)))
 
-    def _create_df_from_article_list(self, articles):
-        df = json_normalize(articles)
-        return self._cleanup_article_df(df)
+    def _load_latest_run(self, query_name):
+        # Results of the newest persisted run of query_name, if any
+        if self._store:
+            run_name = self._store.latest_run_name(query_name)
+            return self._store.load_run(run_name) if run_name else None
+        fname = None
+        if self._storage == 'json':
+            fname = self._latest_persisted_blob_name(query_name)
+        if fname:
+            return self._read_persisted_reponse_blob(fname)
+        # Runs archived, or compacted into the archive, see compact_data()
+        run_name = self._archive.latest_run_name(query_name)
+        return self._archive.load_run(run_name) if run_name else None
 
-    def _create_df_from_source_list(self, sources):
-        df = json_normalize(sources)
-        return self._cleanup_source_df(df)
-      
-    def _add_hyperlink_to_title(self, df):
-        title = df['Title']
-        url = df['URL']
-        return f'<a href="{url}">{title}</a>'
+    def _merge_articles(self, new_articles, old_articles):
+        # Union of both lists deduplicated by URL, newest first. New
+        # articles win over old ones with the same URL.
+        seen = set()
+        merged = []
+        for article in new_articles + old_articles:
+            url = article.get('url')
+            if url in seen:
+                continue
+            seen.add(url)
+            merged.append(article)
+        merged.sort(key=lambda article: article.get('publishedAt') or '',
+                    reverse=True)
+        return merged
+
+    def _load_html_template(self):
+        # Read and compiled once per process, see load_template()
+        return load_template(self._template_dir + self._html_template)
 
-    def _add_hyperlink_to_source_name(self, df):
-        title = df['Source Name']
-        url = df['URL']
-        return f'<a href="{url}">{title}</a>'
 
     def _build_query_string(self, query_data):
         self._logger.debug('_build_query_string: {}'.format(query_data))
         value = query_data.pop('Date')
-        string = "Date: "+value+"<br>"
+        string = "Date: "+escape(str(value))+"<br>"
         self._logger.debug('{}'.format(string))
         for key, value in query_data.items():
-            temp = '{}: {} <br>'.format(key, value)
+            temp = '{}: {} <br>'.format(escape(str(key)), escape(str(value)))
             string += temp
         return string
 
-    def _save_query_response_html(self, api_name, df, query_data, fname):
+    def _save_query_response_html(self, api_name, records, query_data,
+                                  fname):
         self._logger.debug('_save_query_response_html {}, {}'.format(
                             api_name, fname))
-        dst_css = os.path.join(self._results_dir, 'style.css')
-        if not os.path.exists(dst_css):
-            shutil.copyfile(
-                self._template_dir + 'style_template.css',dst_css)
+        self._copy_style_sheet()
         try:
             path = os.path.join(self._results_dir, fname+'.html')
             query_string = self._build_query_string(query_data)
-            html_template = self._read_html_template()
             if  api_name == 'get_sources':
-                df['Source Name'] = df.apply(
-                    lambda df: self._add_hyperlink_to_source_name(df), axis=1)
-                df = df.drop(['URL'], axis = 1) 
+                columns = [col for col in Source.COLUMNS if col != 'URL']
+                links = {'Source Name': 'URL'}
             else:
-                df['Title'] = df.apply(
-                    lambda df: self._add_hyperlink_to_title(df), axis=1)
-                df = df[['Date','Title', 'Summary', 'Author', 'Source']]
-            table = df.to_html(escape=False, index=False)
-            with open(path, "w") as file:
-                file.write(html_template.format(
-                    query=query_string, result=table))
+                columns = ARTICLE_HTML_COLUMNS
+                links = {'Title': 'URL'}
+            # Rows are rendered and written a chunk at a time
+            with self._metrics.span('render_html'), HtmlTableWriter(
+                    path, self._load_html_template(), query_string, columns,
+                    links, page_rows=self._html_page_rows) as html:
+                for start in range(0, len(records), OUTPUT_CHUNK):
+                    html.write(records[start:start + OUTPUT_CHUNK])
+            self._count_bytes_written(*html.paths)
             return path                                    
         except Exception as e:
             return str(e)
 
     def _validate_response(self, result, api_name):
         if not bool(result):
-            raise Exception("ERROR: Empty response from News API {}"\
+            raise NewsApiError("ERROR: Empty response from News API {}"\
                 .format(api_name))
         else:
             status = result['status']
             if status != 'ok':
-                raise Exception("ERROR: Not OK status from News API {}"\
-                    .format(api_name))
+                raise NewsApiError("ERROR: Not OK status from News API {}"\
+                    .format(api_name), result.get('code'))
 
     def _remove_empty_args(self, **args):
         to_remove = []
@@ -197,62 +402,472 @@ class NewsApiWrapper:
             # you can't mix category with the sources param.
             raise Exception("ERROR: you can't mix category with the sources \
                 param: ({}, {})".format(args['category'], args['sources']))
-        return args
+        return self._catalog.validate('get_top_headlines', args)
+
+    def _validate_everything_args(self, **args):
+        # Checked against the sources catalog, category and country
+        # expanded into sources
+        args = self._remove_empty_args(**args)
+        if not 'query_name' in args:
+            raise Exception("ERROR: query_name is not provided")
+        return self._catalog.validate('get_everything', args)
     
-    def _query_name_with_timestamp(self, queryname):
-        now = datetime.now()
-        time = now.strftime("%m_%d_%Y-%H_%M_%S")
-        return queryname + '-{}'.format(time)
+    def _page_count(self, total_results):
+        # Number of pages needed to retrieve total_results
+        return -(-total_results//self._pgsize)
 
-    #
-    # Public methods
-    #    
-    def query(self, api_name, queryname, persist=True, **query_args):
-        self._logger.debug('Query Name: {}'.format(queryname))
-        # pgsize language to query args
-        pgsize = self._pgsize        
-        query_args.update(language='en')
-        if not api_name == 'get_sources':
-            query_args.update(page_size=pgsize)
-        # Call corresponding News API 
+    def _iter_pages(self, api_name, query_args):
+        # Call corresponding News API and yield the validated response of
+        # every result page in page order
         self._logger.debug('Calling {}()'.format(api_name))
-        results = self._newsapi_calls[api_name](**query_args)
-        # Validate results
+        results = self._scheduler.call(api_name, **query_args)
         self._validate_response(results, api_name)       
-        status = results.pop('status','')
-        total_results = results.pop('totalResults', 0)
+        self._count_page(results)
+        yield results
         # if total results are more than pgsize, repeat query to get
         # all results
         if not api_name == 'get_sources':
+            total_results = results.get('totalResults', 0)
             self._logger.debug('status: {}, total_results: {}, pgsize: {}'\
-                .format(status, total_results, self._pgsize))
-            if total_results > self._pgsize:
-                if total_results%self._pgsize != 0:
-                    total = total_results + (pgsize 
-                            - (total_results%self._pgsize))
-                remaining = total//(self._pgsize - 1)
-                self._logger.debug('Retrieving remaining pages')
-                for count in range(remaining):
-                    pg = count+2
-                    self._logger.debug('Calling {}() for page {}'\
-                        .format(api_name, pg))
-                    next_pg = self._newsapi_calls[api_name](
-                        page=pg, **query_args)
+                .format(results['status'], total_results, self._pgsize))
+            pages = self._page_count(total_results)
+            if pages > 1:
+                self._logger.debug('Retrieving remaining {} pages'.format(
+                    pages - 1))
+                for next_pg in self._pager.fetch(
+                        api_name, range(2, pages + 1), **query_args):
                     self._validate_response(next_pg, api_name)
+                    self._count_page(next_pg)
+                    yield next_pg
+
+    def _iter_cached_pages(self, results):
+        # Split a cached response back into pages of pgsize articles
+        articles = results.pop('articles')
+        for start in range(0, max(len(articles), 1), self._pgsize):
+            page = dict(results)
+            page.update(articles=articles[start:start + self._pgsize])
+            yield page
+
+    def _iter_batched_pages(self, api_name, query_args):
+        # Pages of every batch of at most MAX_SOURCES sources, see
+        # split_sources(), or of every shard of a get_everything query.
+        # totalResults is the running total of the batches.
+        if api_name == 'get_everything' and self._planner:
+            yield from self._planner.pages(query_args)
+            return
+        total_results = 0
+        for batch_args in split_sources(query_args):
+            batch_total = None
+            for page in self._iter_pages(api_name, batch_args):
+                if batch_total is None:
+                    batch_total = page.get('totalResults', 0)
+                    total_results += batch_total
+                page['totalResults'] = total_results
+                yield page
+
+    def _fetch_all_pages(self, api_name, query_args):
+        with self._metrics.span('fetch'):
+            if api_name == 'get_everything' and self._planner:
+                return self._fetch_shards(query_args)
+            responses = []
+            for batch_args in split_sources(query_args):
+                pages = self._iter_pages(api_name, batch_args)
+                results = next(pages)
+                for next_pg in pages:
                     results['articles'] += next_pg['articles']
-        # Add query name and date to results to save
-        query_args.update(api_name=api_name)
-        query_args.update(query_name=queryname)
+                responses.append(results)
+            return merge_responses(responses, query_args.get('sort_by'))
+
+    def _fetch_shards(self, query_args):
+        # get_everything results through the shard planner
+        results = self._planner.fetch(query_args)
+        if 'shards' in results:
+            self._metrics.count('shards', results['shards']['shards'])
+            self._logger.debug('Query split into {} shards'.format(
+                results['shards']))
+        return results
+
+    def _catalog_sources(self, query_args):
+        # get_sources response served from the sources catalog, refreshed
+        # first when the wrapper does not use cached responses
+        if not self._cache:
+            self._catalog.refresh()
+        if not self._catalog.available():
+            raise NewsApiError("ERROR: The sources catalog is not available")
+        return {'status': 'ok', 'sources': self._catalog.sources(
+            category=query_args.get('category'),
+            language=query_args.get('language'),
+            country=query_args.get('country'))}
+
+    def _query_metadata(self, api_name, queryname, query_args):
+        # Query name, date and arguments saved along with the results
+        query_data = dict(query_args)
+        query_data.update(api_name=api_name)
+        query_data.update(query_name=queryname)
         now = date.today()
-        query_args.update(Date=now.strftime("%m-%d-%Y"))
-        query_args.pop('page_size',0)
-        results.update(query=query_args)
+        query_data.update(Date=now.strftime("%m-%d-%Y"))
+        query_data.pop('page_size',0)
+        return query_data
+
+    def _prepare_query_args(self, api_name, query_args):
+        # pgsize language to query args
+        query_args.update(language='en')
+        if not api_name == 'get_sources':
+            query_args.update(page_size=self._pgsize)
+
+    def _cached_response(self, api_name, query_args):
+        if not self._cache:
+            return None
+        with self._metrics.span('cache_read'):
+            results = self._cache.get(api_name, query_args)
+        self._metrics.count('cache_hits' if results is not None
+                            else 'cache_misses')
+        self._logger.debug('Cache {} for {}()'.format(
+            'hit' if results is not None else 'miss', api_name))
+        return results
+
+    def _cache_response(self, api_name, query_args, results):
+        if self._cache:
+            with self._metrics.span('cache_write'):
+                self._cache.put(api_name, query_args, results)
+
+    def _dedup_articles(self, articles):
+        # Articles not seen by this or earlier deduplicated queries
+        with self._metrics.span('dedup'):
+            kept = self._dedup.filter(articles)
+            try:
+                self._dedup.save()
+            except OSError as e:
+                self._logger.exception(e)
+        self._metrics.count('duplicates', len(articles) - len(kept))
+        return kept
+
+    def _finish_query(self, api_name, queryname, results, query_args,
+                      persist, dedup=False):
+        status = results.pop('status','')
+        total_results = results.pop('totalResults', 0)
+        # Add query name and date to results to save
+        results.update(
+            query=self._query_metadata(api_name, queryname, query_args))
         # Add query status to results to save
         results.update(
             query_status={'status':status, 'totalResults':total_results})
+        if 'shards' in results:
+            results['query_status'].update(shards=results.pop('shards'))
+        if dedup and 'articles' in results:
+            fetched = len(results['articles'])
+            results['articles'] = self._dedup_articles(results['articles'])
+            results['query_status'].update(
+                duplicateArticles=fetched - len(results['articles']))
         if persist:
             self._persist_query_response_blob(results, queryname)
-        return results  
+        return results
+
+    def _apply_watermark(self, query_name, query_args):
+        watermark = self._watermarks.get(query_name)
+        if watermark and not query_args.get('from_param'):
+            self._logger.debug('Fetching {} since {}'.format(
+                query_name, watermark))
+            query_args.update(from_param=watermark)
+
+    def _merge_with_latest_run(self, query_name, queryname, results):
+        previous = (self._load_latest_run(query_name) or {}).get(
+            'articles', [])
+        fetched = len(results['articles'])
+        results['articles'] = self._merge_articles(
+            results['articles'], previous)
+        results['query_status'].update(
+            fetchedArticles=fetched,
+            newArticles=len(results['articles']) - len(previous))
+        self._persist_query_response_blob(results, queryname)
+        self._watermarks.update(query_name, results['articles'])
+        return results
+
+    def _write_outputs(self, records, record_type, queryname, formats):
+        # Write records in each of the output formats next to the HTML
+        # result, a chunk at a time
+        if not formats:
+            return
+        writers = open_writers(formats, os.path.join(self._results_dir,
+                                                     queryname), record_type)
+        try:
+            with self._metrics.span('write_outputs'):
+                for start in range(0, len(records), OUTPUT_CHUNK):
+                    chunk = records[start:start + OUTPUT_CHUNK]
+                    for writer in writers:
+                        writer.write(chunk)
+        finally:
+            for writer in writers:
+                writer.close()
+        self._count_bytes_written(*[writer.path for writer in writers])
+
+    def _render_articles(self, api_name, results, queryname, formats=None):
+        with self._metrics.span('normalize'):
+            articles = articles_from_json(results['articles'])
+        self._write_outputs(articles, Article, queryname, formats)
+        return self._save_query_response_html(
+            api_name, articles, results['query'], queryname)
+
+    def _render_sources(self, results, queryname, formats=None):
+        with self._metrics.span('normalize'):
+            sources = sources_from_json(results['sources'])
+        self._write_outputs(sources, Source, queryname, formats)
+        return self._save_query_response_html(
+            'get_sources', sources, results['query'], queryname)
+
+    def _query_name_with_timestamp(self, queryname):
+        # Runs of the same query name starting in the same second, e.g.
+        # batch entries sharing a query_name, get the following free
+        # seconds so that they do not overwrite each other's outputs
+        now = datetime.now().replace(microsecond=0)
+        with self._run_names_lock:
+            while True:
+                name = queryname + '-{}'.format(
+                    now.strftime("%m_%d_%Y-%H_%M_%S"))
+                if name not in self._run_names:
+                    self._run_names.add(name)
+                    return name
+                now += timedelta(seconds=1)
+
+    #
+    # Public methods
+    #    
+    def query(self, api_name, queryname, persist=True, dedup=False,
+              **query_args):
+        """Call api_name with query_args, fetching all result pages, and
+        return the response with the query metadata added.
+        Default arguments:
+            persist: Save the results in the article store or Data/
+            dedup: Drop articles already seen by this or other queries run
+                   with dedup, within dedup_ttl, by URL or by a
+                   near-duplicate title
+        """
+        self._logger.debug('Query Name: {}'.format(queryname))
+        with self._metrics.span('query'):
+            self._prepare_query_args(api_name, query_args)
+            results = self._cached_response(api_name, query_args)
+            if results is None:
+                results = self._fetch_all_pages(api_name, query_args)
+                self._cache_response(api_name, query_args, results)
+            return self._finish_query(api_name, queryname, results,
+                                      query_args, persist, dedup)
+
+    def sources_query(self, queryname, persist=True, **query_args):
+        """Return the sources matching the category, language and country
+        of query_args like query('get_sources', ...) does, from the local
+        sources catalog instead of calling News API
+        """
+        self._logger.debug('Query Name: {}'.format(queryname))
+        with self._metrics.span('query'):
+            self._prepare_query_args('get_sources', query_args)
+            results = self._catalog_sources(query_args)
+            return self._finish_query('get_sources', queryname, results,
+                                      query_args, persist)
+
+    def incremental_query(self, query_name, queryname, **query_args):
+        """Run a get_everything query fetching only the articles published
+        since the previous incremental run of query_name. The from_param
+        argument is set to the stored watermark, the newest publishedAt
+        seen so far, unless it is given explicitly. The fetched delta is
+        merged with the articles of the latest persisted run of
+        query_name, deduplicated by URL, and the merged result set is
+        persisted and returned like query() does.
+        """
+        self._apply_watermark(query_name, query_args)
+        results = self.query('get_everything', queryname, persist=False,
+                             **query_args)
+        return self._merge_with_latest_run(query_name, queryname, results)
+
+    def stream_query(self, api_name, queryname, formats=None, dedup=False,
+                     **query_args):
+        """Run a get_top_headlines or get_everything query like query()
+        but normalize and write the articles of every result page as the
+        page arrives, so that memory use is bounded by the page size
+        instead of the total number of results. The articles are written
+        to Data/<queryname>.jsonl and as rows of <results_dir>/
+        <queryname>.html, and added page by page to the article store.
+        With json storage the persisted blob Data/<queryname>.json only
+        holds the query and its status. Responses are read from, but not
+        added to, the response cache.
+        Keyword arguments:
+            formats: Output formats, see parse_formats(), also written to
+                     <results_dir>/<queryname>.<format> page by page
+            dedup: Drop articles already seen, see query()
+        Response:
+            Path of the HTML file.
+        """
+        self._logger.debug('Stream Query Name: {}'.format(queryname))
+        self._prepare_query_args(api_name, query_args)
+        cached = self._cached_response(api_name, query_args)
+        if cached is not None:
+            pages = self._iter_cached_pages(cached)
+        else:
+            pages = self._iter_batched_pages(api_name, query_args)
+        query_data = self._query_metadata(api_name, queryname, query_args)
+        self._copy_style_sheet()
+        html_path = os.path.join(self._results_dir, queryname+'.html')
+        jsonl_path = os.path.join(self._data_dir, queryname+'.jsonl')
+        status, total_results, position, duplicates = '', 0, 0, 0
+        run_id, writers = None, []
+        try:
+            writers = open_writers(formats or [], os.path.join(
+                self._results_dir, queryname))
+            if self._store:
+                run_id = self._store.start_run(queryname, query_data)
+            with HtmlTableWriter(html_path, self._load_html_template(),
+                                 self._build_query_string(dict(query_data)),
+                                 ARTICLE_HTML_COLUMNS,
+                                 links={'Title': 'URL'},
+                                 page_rows=self._html_page_rows) as html, \
+                 JsonLinesWriter(jsonl_path) as jsonl:
+                for page in pages:
+                    status = page.get('status', status)
+                    total_results = page.get('totalResults', total_results)
+                    if dedup:
+                        fetched = len(page['articles'])
+                        page['articles'] = self._dedup_articles(
+                            page['articles'])
+                        duplicates += fetched - len(page['articles'])
+                    # Normalize once, write every format from the records
+                    with self._metrics.span('normalize'):
+                        records = articles_from_json(page['articles'])
+                    with self._metrics.span('write_page'):
+                        for writer in [html, jsonl] + writers:
+                            writer.write(records)
+                    if run_id:
+                        self._store.add_articles(run_id, page['articles'],
+                                                 position)
+                    position += len(page['articles'])
+        except BaseException:
+            # A partial run must not become the latest run incremental
+            # queries merge with
+            if run_id:
+                self._store.delete_run(run_id)
+            raise
+        finally:
+            for writer in writers:
+                writer.close()
+        self._count_bytes_written(*html.paths, jsonl_path,
+                                  *[writer.path for writer in writers])
+        query_status = {'status':status, 'totalResults':total_results}
+        if dedup:
+            query_status.update(duplicateArticles=duplicates)
+        if run_id:
+            self._store.finish_run(run_id, query_status)
+        else:
+            self._persist_query_response_blob({
+                'query': query_data,
+                'query_status': query_status,
+                'articles_path': jsonl_path}, queryname)
+        return html_path
+
+    def to_dataframe(self, results):
+        """Return the articles, or the sources, of results as returned by
+        query() as a pandas DataFrame for analysis. Articles have the
+        columns of the result HTML table plus Content, URL and URL to
+        Image, with Date as datetime64.
+        """
+        if 'sources' in results:
+            return to_dataframe(sources_from_json(results['sources']),
+                                Source)
+        return to_dataframe(articles_from_json(results['articles']),
+                            Article)
+
+    def find_articles(self, **filters):
+        """Return articles from the article store, newest first. See
+        ArticleStore.find_articles() for the filters. Eg:
+            find_articles(source='BBC News', since='2020-08-18')
+        """
+        if not self._store:
+            raise Exception("ERROR: find_articles needs sqlite storage")
+        return self._store.find_articles(**filters)
+
+    def search_articles(self, q, limit=20, **filters):
+        """Search the title, description and content of the articles in
+        the article store, without calling News API. q uses the syntax of
+        the q parameter of get_all_news(): "exact phrase", +must,
+        -must_not, AND / OR / NOT and parentheses.
+        Eg: crypto AND (ethereum OR litecoin) NOT bitcoin.
+        Keyword arguments:
+            limit: Maximum number of articles returned
+            source: Source name or source id the articles are from
+            since: Oldest publishedAt allowed, ISO 8601 date or time
+        Response:
+            List of (score, article), best match first.
+        """
+        if not self._store:
+            raise Exception("ERROR: search_articles needs sqlite storage")
+        return self._store.search(to_fts_query(q), limit=limit, **filters)
+
+    def archive(self):
+        """Return the RunArchive of this wrapper, to list archived runs
+        and read them, or part of their articles, eg:
+            for run in news.archive().runs('ai'):
+                latest = news.archive().items(run['run'], 0, 10)
+        """
+        return self._archive
+
+    def compact_data(self, remove=True):
+        """Migrate the query runs persisted as JSON blobs in Data/ into
+        the compressed run archive, oldest first, and remove the blobs
+        unless remove is False. Archived runs are still found by
+        incremental queries.
+        Response:
+            {'runs', 'failed', 'bytes_before', 'bytes_after'}
+        """
+        with self._metrics.span('compact'):
+            stats = self._archive.import_blobs(self._data_dir, remove=remove)
+        self._logger.debug('Compacted data: {}'.format(stats))
+        return stats
+
+    def close(self):
+        """Release the pooled HTTP connections, the article store and
+        the archive
+        """
+        if self._session:
+            self._session.close()
+        if self._store:
+            self._store.close()
+        self._archive.close()
+
+    def request_stats(self):
+        """Return the number of retries and today's News API requests per
+        endpoint
+        """
+        return self._scheduler.stats()
+
+    def quota_remaining(self):
+        """Return the number of News API requests left today, or None
+        when no daily_quota is set
+        """
+        return self._quota.remaining()
+
+    def metrics(self):
+        """Return the Metrics of this wrapper: per-stage timings (query,
+        fetch, api_call, cache_read, cache_write, dedup, normalize,
+        render_html, write_outputs, write_page, persist, compact and one
+        per get_* method) and counters (api_calls, pages, articles,
+        sources, cache_hits, cache_misses, duplicates, bytes_written).
+        Use Metrics.add_hook() to receive them as they are recorded and
+        Metrics.stats(), to_prometheus() or dump() to read them.
+        """
+        return self._metrics
+
+    def sources_catalog(self):
+        """Return the SourceCatalog queries are validated against and
+        get_sources() is answered from
+        """
+        return self._catalog
+
+    def cache_stats(self):
+        """Return the response cache hit/miss statistics"""
+        return self._cache.stats() if self._cache else {}
+
+    def dedup_stats(self):
+        """Return the number of duplicate articles dropped by URL and by
+        title and the number of articles remembered
+        """
+        return self._dedup.stats()
 
     def get_top_headlines_html(self, **query_args):
         """Get top headlines by calling newsapi get_top_headlines with 
@@ -278,24 +893,41 @@ class NewsApiWrapper:
                 A comma-seperated string of identifiers for the news sources
                 or blogs you want headlines from. Use the /sources endpoint 
                 to locate these programmatically or look at the sources index.
+                Sources are checked against the local sources catalog and
+                more than 20 are queried in batches of 20.
                 Note: you can't mix this param with the country or category
                 params.
             q
                 Keywords or a phrase to search for.
+            dedup:
+                If true, drop articles already returned by this or other
+                queries run with dedup in the last dedup_ttl seconds: same
+                URL or a near-duplicate title, as syndicated articles have.
+                Default: false
+            formats:
+                Output formats written next to the html file, as a list or
+                a comma-seperated string.
+                Possible options: jsonl csv parquet (parquet needs pyarrow)
         Response:
             Saves the results under <results_dir> with name 
-            query_name-<timestamp>.html". 
+            query_name-<timestamp>.html", and query_name-<timestamp>.<format>
+            for each of formats.
         """
         try:
-            args = self._validate_top_headlines_args(**query_args)
-            # Get query name and append it with timestamp to use it as 
-            # html/json filename
-            queryname = self._query_name_with_timestamp(args.pop('query_name'))
-            # Call get_top_headlines with provided query args
-            results = self.query('get_top_headlines', queryname, **args)
-            article_df = self._create_df_from_article_list(results['articles'])
-            return self._save_query_response_html(
-                'get_top_headlines', article_df, results['query'], queryname)
+            with self._metrics.span('get_top_headlines_html'):
+                args = self._validate_top_headlines_args(**query_args)
+                formats = parse_formats(args.pop('formats', None))
+                # Get query name and append it with timestamp to use it as 
+                # html/json filename
+                queryname = self._query_name_with_timestamp(
+                    args.pop('query_name'))
+                if self._stream:
+                    return self.stream_query('get_top_headlines', queryname,
+                                             formats=formats, **args)
+                # Call get_top_headlines with provided query args
+                results = self.query('get_top_headlines', queryname, **args)
+                return self._render_articles('get_top_headlines', results,
+                                             queryname, formats)
         except Exception as e:
             self._logger.exception(e)
 
@@ -324,10 +956,17 @@ class NewsApiWrapper:
                 Keywords or phrases to search for in the article title only.
                 Format similar to 'q' parameter above
             sources:
-                A comma-seperated string of identifiers (maximum 20) for the
-                news sources or blogs you want headlines from. Use the sources
-                API to locate these programmatically or look at the sources
-                index in newsapi.org.
+                A comma-seperated string of identifiers for the news sources
+                or blogs you want headlines from. Use the sources API to
+                locate these programmatically or look at the sources index
+                in newsapi.org. Sources are checked against the local
+                sources catalog and more than 20 are queried in batches of
+                20, merged newest first.
+            category, country:
+                Not supported by News API for everything: expanded, from
+                the local sources catalog, into the sources of this
+                category and/or country. Comma-seperated lists allowed.
+                Note: you can't mix these params with the sources param.
             domains:
                 A comma-seperated string of domains (eg bbc.co.uk, 
                 techcrunch.com, engadget.com) to restrict the search to.
@@ -356,27 +995,56 @@ class NewsApiWrapper:
                     come first.
                     publishedAt = newest articles come first.
                 Default: publishedAt
+            incremental:
+                If true, only fetch articles published since the previous
+                incremental run of query_name and merge them, deduplicated
+                by URL, into its result set. from_param defaults to the
+                newest publishedAt seen by the previous runs.
+                Default: false
+            dedup:
+                If true, drop articles already returned by this or other
+                queries run with dedup in the last dedup_ttl seconds: same
+                URL or a near-duplicate title, as syndicated articles have.
+                Default: false
+            formats:
+                Output formats written next to the html file, as a list or
+                a comma-seperated string.
+                Possible options: jsonl csv parquet (parquet needs pyarrow)
         Response:
             Saves the results under <results_dir> with name 
-            query_name-<timestamp>.html". 
+            query_name-<timestamp>.html", and query_name-<timestamp>.<format>
+            for each of formats.
         """
         try:
-            args = self._remove_empty_args(**query_args)
-            # Get query name and append it with timestamp to use it as 
-            # html/json filename
-            queryname = self._query_name_with_timestamp(
-                args.pop('query_name'))
-            # Call get_everything with provided query args
-            results = self.query('get_everything', queryname, **args)
-            article_df = self._create_df_from_article_list(
-                results['articles'])
-            return self._save_query_response_html(
-                'get_everything', article_df, results['query'], queryname)
+            with self._metrics.span('get_all_news'):
+                args = self._validate_everything_args(**query_args)
+                incremental = args.pop('incremental', False)
+                formats = parse_formats(args.pop('formats', None))
+                # Get query name and append it with timestamp to use it as 
+                # html/json filename
+                query_name = args.pop('query_name')
+                queryname = self._query_name_with_timestamp(query_name)
+                if incremental:
+                    # Fetch only articles newer than the previous run and
+                    # merge them into its result set
+                    results = self.incremental_query(query_name, queryname,
+                                                     **args)
+                elif self._stream:
+                    return self.stream_query('get_everything', queryname,
+                                             formats=formats, **args)
+                else:
+                    # Call get_everything with provided query args
+                    results = self.query('get_everything', queryname, **args)
+                return self._render_articles('get_everything', results,
+                                             queryname, formats)
         except Exception as e:
             self._logger.exception(e)
 
     def get_sources(self, **query_args):
-        """ Return the available news publishers; 
+        """ Return the available news publishers; served from the local
+        sources catalog, Data/sources.json, which is fetched from News API
+        on first use and refreshed in the background every catalog_ttl,
+        or before every call with use_cache=False.
         Keyword arguments:
         category: 
             Find sources that display news of this category. 
@@ -395,21 +1063,26 @@ class NewsApiWrapper:
                 ie il in it jp kr lt lv ma mx my ng nl no nz ph pl pt ro rs 
                 ru sa se sg si sk th tr tw ua us ve za . 
             Default: all countries.
+        formats:
+            Output formats written next to the html file, as a list or a
+            comma-seperated string.
+            Possible options: jsonl csv parquet (parquet needs pyarrow)
         Response:
             Saves the results under <results_dir> with name 
-            query_name-<timestamp>.html". 
+            query_name-<timestamp>.html", and query_name-<timestamp>.<format>
+            for each of formats.
         """
         try:
-            args = self._remove_empty_args(**query_args)
-            # Get query name and append it with timestamp to use it as 
-            # html/json filename
-            queryname = self._query_name_with_timestamp(args.pop(
-                'query_name'))
-            # Call get_everything with provided query args
-            results = self.query('get_sources', queryname, **args)
-            df = self._create_df_from_source_list(results['sources'])
-            return self._save_query_response_html(
-                'get_sources', df, results['query'], queryname)
+            with self._metrics.span('get_sources'):
+                args = self._remove_empty_args(**query_args)
+                formats = parse_formats(args.pop('formats', None))
+                # Get query name and append it with timestamp to use it as 
+                # html/json filename
+                queryname = self._query_name_with_timestamp(args.pop(
+                    'query_name'))
+                # Served from the sources catalog
+                results = self.sources_query(queryname, **args)
+                return self._render_sources(results, queryname, formats)
         except Exception as e:
             self._logger.exception(e)
 
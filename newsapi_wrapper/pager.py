@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+class PageFetcher:
+    #
+    # Constructor
+    #
+    def __init__(self, call, max_workers=MAX_WORKERS,
+                 logger=logging.getLogger()):
+        """
+        Default arguments:
+            call: Callable issuing a News API request, called with the API
+                  name and the query arguments. Rate limiting and retries
+                  are up to it, see RequestScheduler.call.
+            max_workers: Maximum number of pages fetched concurrently
+        """
+        self._call = call
+        self._max_workers = max(1, max_workers)
+        self._logger = logger
+
+    #
+    # Private methods
+    #
+    def _fetch_page(self, api_name, page, query_args):
+        self._logger.debug('Calling {}() for page {}'.format(api_name, page))
+        return self._call(api_name, page=page, **query_args)
+
+    #
+    # Public methods
+    #
+    def fetch(self, api_name, pages, **query_args):
+        """Fetch the given page numbers of api_name concurrently.
+        Responses are yielded in the order of pages. At most max_workers
+        requests are in flight and at most max_workers responses are held
+        waiting to be consumed, so memory stays bounded by the page size.
+        """
+        pages = iter(pages)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            try:
+                for page in pages:
+                    pending.append(executor.submit(
+                        self._fetch_page, api_name, page, query_args))
+                    if len(pending) >= self._max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+ARTICLE_COLUMNS = ('Date', 'Title', 'Summary', 'Author', 'Source', 'Content',
+                   'URL', 'URL to Image')
+SOURCE_COLUMNS = ('Source ID', 'Source Name', 'Description', 'URL',
+                  'Category', 'Language', 'Country')
+
+_pd = None
+
+def _pandas():
+    # pandas is imported on first use only, it dominates the start up time
+    # of the command line utility
+    global _pd
+    if _pd is None:
+        import pandas as pd
+        pd.options.display.float_format = '{:.2f}'.format
+        pd.set_option('display.max_columns', 30)
+        pd.set_option('display.max_rows', 100)
+        _pd = pd
+    return _pd
+
+
+class Record:
+    """Flattened News API item with a fixed set of columns. Values are
+    kept in __slots__, one attribute per column in COLUMNS order, and can
+    be read by column name with get() like from a dict.
+    """
+    __slots__ = ()
+    COLUMNS = ()
+    # Columns converted to datetime64 in to_dataframe()
+    DATE_COLUMNS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._attrs = dict(zip(cls.COLUMNS, cls.__slots__))
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.as_dict())
+
+    def get(self, column, default=None):
+        attr = self._attrs.get(column)
+        return default if attr is None else getattr(self, attr)
+
+    def values(self):
+        return [getattr(self, attr) for attr in self.__slots__]
+
+    def as_dict(self):
+        return dict(zip(self.COLUMNS, self.values()))
+
+
+class Article(Record):
+    """Article of a top headlines or everything response"""
+    __slots__ = ('date', 'title', 'summary', 'author', 'source', 'content',
+                 'url', 'url_to_image')
+    COLUMNS = ARTICLE_COLUMNS
+    DATE_COLUMNS = ('Date',)
+
+    def __init__(self, date, title, summary, author, source, content, url,
+                 url_to_image):
+        self.date = date
+        self.title = title
+        self.summary = summary
+        self.author = author
+        self.source = source
+        self.content = content
+        self.url = url
+        self.url_to_image = url_to_image
+
+    @classmethod
+    def from_json(cls, article):
+        """Flatten an article as returned by News API. Date is the
+        YYYY-MM-DD part of publishedAt and Source the source name.
+        """
+        get = article.get
+        return cls((get('publishedAt') or '')[:10], get('title'),
+                   get('description'), get('author'),
+                   (get('source') or {}).get('name'), get('content'),
+                   get('url'), get('urlToImage'))
+
+
+class Source(Record):
+    """News source of a sources response"""
+    __slots__ = ('id', 'name', 'description', 'url', 'category',
+                 'language', 'country')
+    COLUMNS = SOURCE_COLUMNS
+
+    def __init__(self, id, name, description, url, category, language,
+                 country):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.url = url
+        self.category = category
+        self.language = language
+        self.country = country
+
+    @classmethod
+    def from_json(cls, source):
+        """Wrap a source as returned by News API"""
+        get = source.get
+        return cls(get('id'), get('name'), get('description'), get('url'),
+                   get('category'), get('language'), get('country'))
+
+
+def articles_from_json(articles):
+    """Return the Article records of a list of News API articles"""
+    return [Article.from_json(article) for article in articles]
+
+def sources_from_json(sources):
+    """Return the Source records of a list of News API sources"""
+    return [Source.from_json(source) for source in sources]
+
+def to_dataframe(records, record_type):
+    """Return records as a pandas DataFrame with one column per column of
+    record_type, dates as datetime64.
+    """
+    pd = _pandas()
+    data = {}
+    for column, attr in zip(record_type.COLUMNS, record_type.__slots__):
+        data[column] = [getattr(record, attr) for record in records]
+    df = pd.DataFrame(data, columns=list(record_type.COLUMNS))
+    for column in record_type.DATE_COLUMNS:
+        df[column] = pd.to_datetime(df[column], errors='coerce')
+    return df
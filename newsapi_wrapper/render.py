@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+import threading
+from html import escape
+
+TABLE_TAIL = '  </tbody>\n</table>'
+PAGE_FILE_FORMAT = '{}-p{}.html'
+
+# Page templates read by load_template(), by path
+_templates = {}
+_templates_lock = threading.Lock()
+
+#
+# Page templates
+#
+class PageTemplate:
+    """Result page template split once at its {query} and {result}
+    placeholders, so pages are written as a head, the rows and a tail
+    without formatting the whole page as one string.
+    """
+    __slots__ = ('_head', '_tail')
+
+    def __init__(self, text):
+        self._head, self._tail = text.split('{result}', 1)
+
+    def head(self, query_string):
+        """Return the page up to the {result} placeholder"""
+        return self._head.replace('{query}', query_string)
+
+    def tail(self):
+        """Return the page after the {result} placeholder"""
+        return self._tail
+
+def load_template(path):
+    """Return the PageTemplate of the file at path, read and split once
+    per process
+    """
+    with _templates_lock:
+        template = _templates.get(path)
+        if template is None:
+            with open(path, 'r') as file:
+                template = _templates[path] = PageTemplate(file.read())
+        return template
+
+def page_file_name(base_name, number):
+    """Return the file name of page number of a report, the first page
+    being base_name.html
+    """
+    if number == 1:
+        return base_name + '.html'
+    return PAGE_FILE_FORMAT.format(base_name, number)
+
+def page_links(base_name, number, has_next):
+    """Return the previous/next navigation of page number of a report"""
+    links = ['\n<p class="p pagination">']
+    if number > 1:
+        links.append('<a href="{}">&laquo; Previous</a>'.format(
+            escape(page_file_name(base_name, number - 1))))
+    links.append('Page {}'.format(number))
+    if has_next:
+        links.append('<a href="{}">Next &raquo;</a>'.format(
+            escape(page_file_name(base_name, number + 1))))
+    return '\n'.join(links) + '\n</p>\n'
+
+#
+# Record rendering
+#
+def table_head(columns):
+    """Return the table markup up to and including <tbody>"""
+    head = ['<table border="1" class="dataframe">\n',
+            '  <thead>\n    <tr style="text-align: right;">\n']
+    for column in columns:
+        head.append('      <th>{}</th>\n'.format(escape(column)))
+    head.append('    </tr>\n  </thead>\n  <tbody>\n')
+    return ''.join(head)
+
+def _row_format(count):
+    return '    <tr>\n' + '      <td>{}</td>\n'*count + '    </tr>\n'
+
+def _text(value):
+    return '' if value is None else escape(str(value))
+
+def render_rows(records, columns, links=None):
+    """Return the <tr> markup of records, dicts or Record instances.
+    Cells are built a column at a time and rows are assembled with one
+    pre-built row format.
+    Keyword arguments:
+        columns: Record keys written as table columns, in order
+        links: Dict of column to the record key holding the URL the
+               column is linked to
+    """
+    links = links or {}
+    cells = []
+    for column in columns:
+        text = [_text(record.get(column)) for record in records]
+        if column in links:
+            urls = [_text(record.get(links[column])) for record in records]
+            text = ['<a href="{}">{}</a>'.format(href, label) if href
+                    else label for label, href in zip(text, urls)]
+        cells.append(text)
+    return ''.join(map(_row_format(len(columns)).format, *cells))
+
+def render_records(records, columns, links=None):
+    """Render records as an HTML table, see render_rows()"""
+    return table_head(columns) + render_rows(records, columns, links) + \
+        TABLE_TAIL
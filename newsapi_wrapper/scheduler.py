@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import random
+import threading
+import logging
+from datetime import datetime, timezone
+
+from .filelock import file_lock
+
+QUOTA_FILE = "quota.json"
+MAX_RETRIES = 4
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# News API error codes worth retrying, see https://newsapi.org/docs/errors
+RETRYABLE_CODES = ('rateLimited', 'unexpectedError')
+
+class NewsApiError(Exception):
+    """Error response from News API"""
+    def __init__(self, message, code=None):
+        Exception.__init__(self, message)
+        self.code = code
+
+class RetryableError(NewsApiError):
+    """Transient News API failure; the request can be repeated"""
+
+class QuotaExceededError(NewsApiError):
+    """The configured daily request quota is used up"""
+
+
+def error_from_response(api_name, response):
+    """Return the NewsApiError matching an error response body"""
+    code = response.get('code')
+    cls = RetryableError if code in RETRYABLE_CODES else NewsApiError
+    return cls("ERROR: News API {} failed: {} {}".format(
+        api_name, code, response.get('message')), code)
+
+def is_retryable(error):
+    """True for failures worth repeating the request for: rate limiting,
+    News API server errors, connection errors, timeouts and responses that
+    are not JSON (typically an HTML 5xx page from a proxy).
+    """
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, NewsApiError):
+        return False
+    if isinstance(error, (json.JSONDecodeError, ConnectionError,
+                          TimeoutError)):
+        return True
+    # Exceptions of asyncio and of the HTTP libraries, matched by name so
+    # that they do not need to be imported here
+    names = [cls.__name__ for cls in type(error).__mro__]
+    if 'NewsAPIException' in names:
+        return error.get_code() in RETRYABLE_CODES
+    return any(name in names for name in (
+        'ConnectionError', 'Timeout', 'TimeoutError', 'ChunkedEncodingError',
+        'ClientConnectionError', 'ServerDisconnectedError'))
+
+
+class TokenBucket:
+    """Token bucket rate limiter: allows bursts of up to capacity calls and
+    refills at rate calls per second.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, rate=None, capacity=None):
+        """
+        Default arguments:
+            rate: Tokens added per second. None or 0 disables limiting.
+            capacity: Maximum number of tokens; the largest burst allowed.
+                      Default: max(1, rate)
+        """
+        self._rate = rate or 0
+        self._capacity = capacity or max(1, self._rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    #
+    # Public methods
+    #
+    def reserve(self):
+        """Take a token and return the number of seconds to wait before
+        using it. Tokens are handed out in the order they are reserved.
+        """
+        if not self._rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens +
+                               (now - self._updated)*self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens/self._rate
+
+    def wait(self):
+        """Block until a token is available"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class QuotaTracker:
+    """Count News API requests per endpoint and UTC day in a JSON file so
+    that the daily quota of the plan is accounted for across runs. The
+    file is re-read and updated under a file lock on every request, so
+    that processes sharing it, eg a --watch daemon and cron runs, add up
+    their counts.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, daily_quota=None, logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: JSON file the request counts are kept in
+            daily_quota: Maximum number of requests per UTC day. None
+                         only counts requests.
+        """
+        self._path = path
+        self._daily_quota = daily_quota
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._counts = self._load()
+
+    #
+    # Private methods
+    #
+    def _today(self):
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self._logger.exception(e)
+            return {}
+
+    def _save(self):
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self._counts, file, indent=2)
+        os.replace(tmp_path, self._path)
+
+    #
+    # Public methods
+    #
+    def used(self, day=None):
+        """Return the number of requests made on day (default: today)"""
+        with self._lock:
+            self._counts = self._load()
+            return sum(self._counts.get(day or self._today(), {}).values())
+
+    def remaining(self):
+        if self._daily_quota is None:
+            return None
+        return max(0, self._daily_quota - self.used())
+
+    def acquire(self, api_name):
+        """Count a request to api_name. Raises QuotaExceededError if the
+        daily quota is used up.
+        """
+        with self._lock, file_lock(self._path):
+            # Other processes may have counted requests since
+            self._counts = self._load()
+            today = self._today()
+            # Keep only the current day; older counts are not needed
+            self._counts = {today: self._counts.get(today, {})}
+            counts = self._counts[today]
+            if self._daily_quota is not None and \
+                    sum(counts.values()) >= self._daily_quota:
+                raise QuotaExceededError(
+                    "ERROR: daily News API quota of {} requests used up"\
+                        .format(self._daily_quota), 'quotaExceeded')
+            counts[api_name] = counts.get(api_name, 0) + 1
+            try:
+                self._save()
+            except OSError as e:
+                self._logger.exception(e)
+
+    def stats(self):
+        with self._lock:
+            self._counts = self._load()
+            return dict(self._counts.get(self._today(), {}))
+
+
+class RequestScheduler:
+    """Issue News API requests through a token bucket, count them against
+    the daily quota and retry transient failures with exponential backoff
+    and full jitter.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, calls, bucket=None, quota=None,
+                 max_retries=MAX_RETRIES, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF, logger=logging.getLogger()):
+        """
+        Default arguments:
+            calls: Dict of News API name to the callable issuing the request
+            bucket: TokenBucket shared by all requests
+            quota: QuotaTracker the requests are counted in
+            max_retries: Maximum number of times a request is repeated
+            backoff: Base delay in seconds before the first retry
+            max_backoff: Upper bound of the delay between retries
+        """
+        self._calls = calls
+        self._bucket = bucket or TokenBucket()
+        self._quota = quota
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    #
+    # Private methods
+    #
+    def _delay(self, attempt):
+        # Full jitter: uniform in [0, min(max_backoff, backoff * 2^attempt)]
+        return random.uniform(0, min(self._max_backoff,
+                                     self._backoff*(2**attempt)))
+
+    def _check(self, api_name, result):
+        if isinstance(result, dict) and result.get('status') == 'error':
+            raise error_from_response(api_name, result)
+        return result
+
+    def _should_retry(self, api_name, attempt, error):
+        if attempt >= self._max_retries or not is_retryable(error):
+            return False
+        with self._lock:
+            self._retries += 1
+        self._logger.warning('{}() failed, retry {} of {}: {}'.format(
+            api_name, attempt + 1, self._max_retries, error))
+        return True
+
+    #
+    # Public methods
+    #
+    def call(self, api_name, **query_args):
+        """Call api_name with query_args, waiting for the rate limit and
+        retrying transient failures. Raises QuotaExceededError without
+        calling News API once the daily quota is used up.
+        """
+        attempt = 0
+        while True:
+            if self._quota:
+                self._quota.acquire(api_name)
+            self._bucket.wait()
+            try:
+                return self._check(api_name,
+                                   self._calls[api_name](**query_args))
+            except Exception as e:
+                if not self._should_retry(api_name, attempt, e):
+                    raise
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def call_async(self, api_name, request, **query_args):
+        """Coroutine variant of call(). request is a coroutine function
+        called with api_name and query_args.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            if self._quota:
+                # File lock and quota file I/O, off the event loop
+                await loop.run_in_executor(None, self._quota.acquire,
+                                           api_name)
+            delay = self._bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return self._check(api_name,
+                                   await request(api_name, **query_args))
+            except Exception as e:
+                if not self._should_retry(api_name, attempt, e):
+                    raise
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    def stats(self):
+        """Return the number of retries and today's requests per endpoint"""
+        return {'retries': self._retries,
+                'requests': self._quota.stats() if self._quota else {}}
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+import re
+
+# Phrases, words (with optional +/- prefix and * suffix), parentheses
+# (opening ones with optional +/- prefix)
+TOKEN_RE = re.compile(
+    r'\s*(?:([+-]?)"([^"]*)"|([+-]?)(\()|(\))|([+-]?)([^\s()"]+))')
+OPERATORS = ('AND', 'OR', 'NOT')
+
+def _quote(term):
+    # FTS5 string literal; a trailing * is kept as a prefix query
+    prefix = term.endswith('*') and len(term) > 1
+    term = term.rstrip('*') if prefix else term
+    return '"{}"'.format(term.replace('"', '""')) + ('*' if prefix else '')
+
+def _tokens(q):
+    pos = 0
+    q = q.strip()
+    while pos < len(q):
+        match = TOKEN_RE.match(q, pos)
+        if not match or match.end() == pos:
+            raise ValueError("Invalid search query near: {}".format(q[pos:]))
+        pos = match.end()
+        sign, phrase, gsign, lparen, rparen, wsign, word = match.groups()
+        if phrase is not None:
+            yield 'term', sign, _quote(phrase)
+        elif lparen:
+            yield 'lparen', gsign, '('
+        elif rparen:
+            yield 'rparen', '', ')'
+        elif word in OPERATORS and not wsign:
+            yield 'op', '', word
+        else:
+            yield 'term', wsign, _quote(word)
+
+def _group(tokens, q, nested=False):
+    # FTS5 query of the tokens up to the closing parenthesis of a group,
+    # or the end of q. -term and NOT term, unary where NOT starts the
+    # group or follows another operator, are excluded from their group.
+    parts, excluded, negate = [], [], False
+    for kind, sign, text in tokens:
+        if kind == 'rparen':
+            if not nested:
+                raise ValueError("Unbalanced parenthesis in: {}".format(q))
+            break
+        if kind == 'op':
+            if text == 'NOT' and (not parts or parts[-1] in OPERATORS):
+                negate = True
+            elif parts and parts[-1] not in OPERATORS:
+                parts.append(text)
+            continue
+        if kind == 'lparen':
+            text = _group(tokens, q, nested=True)
+        if sign == '-' or negate:
+            excluded.append(text)
+            negate = False
+            continue
+        if parts and parts[-1] not in OPERATORS:
+            # Implicit AND between juxtaposed terms
+            parts.append('AND')
+        parts.append(text)
+    else:
+        if nested:
+            raise ValueError("Unbalanced parenthesis in: {}".format(q))
+    while parts and parts[-1] in OPERATORS:
+        parts.pop()
+    if not parts:
+        if excluded:
+            raise ValueError("Search query {} only excludes terms; add a "
+                             "term to match next to them".format(q))
+        raise ValueError("Search query needs at least one term to match")
+    query = '({})'.format(' '.join(parts))
+    if not excluded:
+        return query
+    query += ' NOT ({})'.format(' OR '.join(excluded))
+    return '({})'.format(query) if nested else query
+
+def to_fts_query(q):
+    """Translate a query in the syntax of the News API q parameter into an
+    SQLite FTS5 query:
+        "exact phrase"      phrase match
+        +word, +(group)     word, or group, must appear
+        -word, -(group)     word, or group, must not appear
+        AND / OR / NOT      boolean operators, grouped with parentheses
+        word*               prefix match
+    Words without an operator in between must all appear. FTS5 has no
+    unary NOT, so -word terms, and NOT word at the start of a group or
+    after another operator, are collected and excluded from the rest of
+    their group: 'crypto -bitcoin' becomes '("crypto") NOT ("bitcoin")'
+    and '(a OR -b)' matches a but not b. 'crypto -(bitcoin OR eth)'
+    excludes the whole group the same way. Raises ValueError for queries
+    that only exclude terms.
+    """
+    return _group(_tokens(q), q)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .pager import MAX_WORKERS
+from .catalog import split_sources, DATE_SORTS
+
+# Deepest result News API serves for one query; the Developer plan stops
+# at 100 results with a maximumResultsReached error
+MAX_RESULTS = 100
+# Most sub-queries one query is split into; further results are dropped
+MAX_SHARDS = 64
+# Narrowest time window a query is split into, in seconds
+MIN_WINDOW = 60
+# Width of the first split of a query without from_param; its oldest
+# shard stays open ended, so older articles are still fetched
+HISTORY = 30*24*60*60
+# Windows are sized for this share of max_results, since articles are
+# not published evenly over time
+FILL = 0.7
+DEFAULT_PAGE_SIZE = 20
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def parse_time(value, end=False):
+    """Return value, a News API from/to date or date and time, as a naive
+    UTC datetime. A date alone is its first second, or its last one with
+    end=True.
+    """
+    value = str(value).strip().replace('Z', '')
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value) <= len('YYYY-MM-DD'):
+        parsed += timedelta(days=1, seconds=-1)
+    return parsed
+
+def format_time(value):
+    return value.strftime(TIME_FORMAT)
+
+def error_code(error):
+    # News API error code of a NewsApiError or of a NewsAPIException
+    # raised by newsapi-python
+    if hasattr(error, 'get_code'):
+        return error.get_code()
+    return getattr(error, 'code', None)
+
+
+class ShardPlanner:
+    """Split get_everything queries whose results go deeper than
+    max_results into sub-queries, the shards, and fetch them in parallel.
+    A query is first split into batches of at most 20 sources. Every
+    shard starts by fetching its first page; if its totalResults exceeds
+    max_results its from/to window is split into as many equal windows as
+    the observed totalResults needs, and each is planned the same way, so
+    the window size adapts to how densely articles were published. A
+    window without from_param is split over the history seconds before
+    its newest article and its oldest shard keeps no from_param, so older
+    articles are fetched, or split again, too. The first pages of split shards are kept; the
+    remaining pages of the other shards are fetched concurrently. Articles
+    of all shards are merged, duplicates by URL dropped. Results that
+    cannot be reached, because max_shards is used up or a window cannot
+    be narrowed below min_window, are logged as a warning.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, fetch_page, max_results=MAX_RESULTS,
+                 max_shards=MAX_SHARDS, max_workers=MAX_WORKERS,
+                 min_window=MIN_WINDOW, history=HISTORY,
+                 logger=logging.getLogger()):
+        """
+        Default arguments:
+            fetch_page: Called with (page, **query_args); returns the
+                        validated get_everything response of that page
+            max_results: Deepest result News API serves for one query
+            max_shards: Most shards one query is split into
+            max_workers: Maximum number of requests in flight
+            min_window: Narrowest time window in seconds
+            history: Seconds back from 'to' a query without from_param is
+                     split over first
+        """
+        self._fetch_page = fetch_page
+        self._max_results = max_results
+        self._max_shards = max_shards
+        self._max_workers = max(1, max_workers)
+        self._min_window = timedelta(seconds=min_window)
+        self._history = timedelta(seconds=history)
+        self._logger = logger
+
+    #
+    # Private methods
+    #
+    def _window(self, query_args, first):
+        # (start, newest, end) of the window of query_args; newest is the
+        # newest article of the first page, or end
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        end = parse_time(query_args['to'], end=True) \
+            if query_args.get('to') else now
+        newest = max([article.get('publishedAt') or ''
+                      for article in first['articles']] + [''])
+        newest = min(end, parse_time(newest[:19])) if newest else end
+        start = parse_time(query_args['from_param']) \
+            if query_args.get('from_param') else newest - self._history
+        return min(start, newest), newest, end
+
+    def _split(self, query_args, first, budget):
+        # Sub-windows of the window of query_args, newest first. Articles
+        # sorted by date are all at or before the newest one of the first
+        # page; otherwise newer ones are fetched by one more shard. The
+        # window up to the newest article is split into equal windows,
+        # the oldest open ended when query_args has no from_param.
+        start, newest, end = self._window(query_args, first)
+        shards = []
+        if newest < end and query_args.get('sort_by') not in DATE_SORTS:
+            shard_args = dict(query_args)
+            shard_args.update(from_param=format_time(
+                newest + timedelta(seconds=1)), to=format_time(end))
+            shards.append(shard_args)
+            budget -= 1
+        count = -(-first['totalResults']//int(self._max_results*FILL))
+        count = min(count, budget, int((newest - start)/self._min_window))
+        if count < 2:
+            return []
+        step = (newest - start)/count
+        for number in reversed(range(count)):
+            shard_start = start + step*number
+            shard_end = newest if number == count - 1 else \
+                start + step*(number + 1) - timedelta(seconds=1)
+            shard_args = dict(query_args)
+            shard_args.update(to=format_time(shard_end))
+            if number or query_args.get('from_param'):
+                shard_args.update(from_param=format_time(shard_start))
+            shards.append(shard_args)
+        return shards
+
+    def _first_page(self, query_args, root):
+        return query_args, root, self._fetch_page(page=1, **query_args)
+
+    def _page(self, query_args, page, shard):
+        # Articles of a page after the first; none once News API refuses
+        # to go deeper
+        try:
+            return self._fetch_page(page=page, **query_args)['articles']
+        except Exception as e:
+            if error_code(e) != 'maximumResultsReached':
+                raise
+            if not shard['limited']:
+                shard['limited'] = True
+                self._logger.warning('Result depth limit reached at page '
+                                     '{}; set max_results lower'.format(page))
+            return []
+
+    def _plan(self, shard_args, first, budget, stats):
+        # (sub-shards, remaining page numbers) of a shard from its first
+        # page
+        total = first.get('totalResults', 0)
+        if total > self._max_results:
+            shards = self._split(shard_args, first, budget)
+            if shards:
+                return shards, []
+            self._logger.debug('Results of {} to {} truncated to {}'.format(
+                shard_args.get('from_param'), shard_args.get('to'),
+                self._max_results))
+            stats['truncated'] += 1
+            stats['unreachable'] += total - self._max_results
+        page_size = shard_args.get('page_size') or DEFAULT_PAGE_SIZE
+        pages = -(-min(total, self._max_results)//page_size)
+        if len(first['articles']) >= total:
+            return [], []
+        return [], list(range(2, pages + 1))
+
+    def _unseen(self, articles, seen, stats):
+        kept = []
+        for article in articles:
+            url = article.get('url')
+            if url in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(url)
+            kept.append(article)
+        return kept
+
+    def _ready(self, shard, page, articles):
+        # Articles of the pages of shard now in order after page arrived
+        shard['done'][page] = articles
+        ready = []
+        while shard['next'] in shard['done']:
+            ready += shard['done'].pop(shard['next'])
+            shard['next'] += 1
+        return ready
+
+    def _warn_truncated(self, stats, total_results):
+        if not stats['truncated']:
+            return
+        self._logger.warning(
+            'Query truncated: {} of about {} results could not be fetched '
+            'from {} of {} shards ({} shards at most, windows of at least '
+            '{}s); raise max_shards or narrow the query or its from/to '
+            'window'.format(
+                stats['unreachable'], total_results, stats['truncated'],
+                stats['shards'], self._max_shards,
+                int(self._min_window.total_seconds())))
+
+    #
+    # Public methods
+    #
+    def pages(self, query_args, stats=None):
+        """Fetch query_args shard by shard and yield a response per shard
+        page, holding the articles not yielded before, as they arrive; the
+        pages of a shard in order. totalResults of the responses is the
+        total of the query. stats, a dict, is updated with the number of
+        shards, truncated shards, results they could not reach and
+        duplicates dropped.
+        """
+        stats = stats if stats is not None else {}
+        stats.update(shards=0, truncated=0, unreachable=0, duplicates=0)
+        seen = set()
+        total_results = 0
+        # (query arguments, True for the source batches of query_args)
+        pending = [(batch_args, True)
+                   for batch_args in split_sources(query_args)]
+        # Future -> None for first pages, (shard, page) for the others
+        running = {}
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            try:
+                while pending or running:
+                    while pending and len(running) < self._max_workers:
+                        stats['shards'] += 1
+                        running[executor.submit(self._first_page,
+                                                *pending.pop(0))] = None
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = running.pop(future)
+                        if task is not None:
+                            shard, page = task
+                            articles = self._ready(shard, page,
+                                                   future.result())
+                        else:
+                            shard_args, root, first = future.result()
+                            articles = first['articles']
+                            if root:
+                                total_results += first.get('totalResults', 0)
+                            shards, rest = self._plan(
+                                shard_args, first,
+                                self._max_shards - stats['shards'] -
+                                len(pending), stats)
+                            pending += [(shard, False) for shard in shards]
+                            shard = {'next': 2, 'done': {}, 'limited': False}
+                            for page in rest:
+                                running[executor.submit(
+                                    self._page, shard_args, page,
+                                    shard)] = (shard, page)
+                        yield {'status': 'ok', 'totalResults': total_results,
+                               'articles': self._unseen(articles, seen,
+                                                        stats)}
+            finally:
+                for future in running:
+                    future.cancel()
+        self._warn_truncated(stats, total_results)
+
+    def fetch(self, query_args):
+        """Return the merged response of all shards of query_args, newest
+        first unless sorted by relevancy or popularity. When the query was
+        split, its 'shards' key holds the stats of pages().
+        """
+        stats = {}
+        articles = []
+        total_results = 0
+        for response in self.pages(query_args, stats):
+            articles += response['articles']
+            total_results = response['totalResults']
+        if query_args.get('sort_by') in DATE_SORTS:
+            articles.sort(key=lambda article: article.get('publishedAt') or '',
+                          reverse=True)
+        results = {'status': 'ok', 'totalResults': total_results,
+                   'articles': articles}
+        if stats['shards'] > 1:
+            results.update(shards=stats)
+        return results
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# coding: utf-8
+import re
+import json
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+
+STORE_FILE = "newsapi.db"
+# Suffix added to query names by NewsApiWrapper._query_name_with_timestamp
+RUN_SUFFIX_RE = re.compile(r'-\d{2}_\d{2}_\d{4}-\d{2}_\d{2}_\d{2}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    source_id TEXT,
+    source_name TEXT,
+    author TEXT,
+    title TEXT,
+    description TEXT,
+    content TEXT,
+    url_to_image TEXT,
+    published_at TEXT,
+    first_seen TEXT);
+CREATE INDEX IF NOT EXISTS articles_source_idx
+    ON articles (source_name, published_at);
+CREATE INDEX IF NOT EXISTS articles_published_idx
+    ON articles (published_at);
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    source_id TEXT,
+    name TEXT NOT NULL,
+    description TEXT,
+    url TEXT,
+    category TEXT,
+    language TEXT,
+    country TEXT,
+    UNIQUE (source_id, name));
+CREATE TABLE IF NOT EXISTS query_runs (
+    id INTEGER PRIMARY KEY,
+    run_name TEXT NOT NULL UNIQUE,
+    query_name TEXT NOT NULL,
+    api_name TEXT,
+    run_at TEXT,
+    query TEXT,
+    status TEXT,
+    total_results INTEGER,
+    query_status TEXT);
+CREATE INDEX IF NOT EXISTS query_runs_name_idx
+    ON query_runs (query_name, run_at);
+CREATE TABLE IF NOT EXISTS run_articles (
+    run_id INTEGER NOT NULL REFERENCES query_runs (id),
+    article_id INTEGER NOT NULL REFERENCES articles (id),
+    position INTEGER,
+    PRIMARY KEY (run_id, article_id));
+CREATE TABLE IF NOT EXISTS run_sources (
+    run_id INTEGER NOT NULL REFERENCES query_runs (id),
+    source_id INTEGER NOT NULL REFERENCES sources (id),
+    position INTEGER,
+    PRIMARY KEY (run_id, source_id));
+"""
+
+# Full-text index over the article text, kept in sync with the articles
+# table by triggers so that it is updated as results are persisted
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5 (
+    title, description, content,
+    content='articles', content_rowid='id', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles
+BEGIN
+    INSERT INTO articles_fts (rowid, title, description, content)
+    VALUES (new.id, new.title, new.description, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles
+BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, title, description,
+                              content)
+    VALUES ('delete', old.id, old.title, old.description, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE ON articles
+BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, title, description,
+                              content)
+    VALUES ('delete', old.id, old.title, old.description, old.content);
+    INSERT INTO articles_fts (rowid, title, description, content)
+    VALUES (new.id, new.title, new.description, new.content);
+END;
+"""
+# bm25 weights of the title, description and content columns
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+ARTICLE_COLUMNS = ('url, source_id, source_name, author, title, '
+                   'description, content, url_to_image, published_at')
+
+class ArticleStore:
+    """SQLite persistence for query runs. Articles are stored once,
+    deduplicated by URL, and linked to every query run that returned them.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: Path of the SQLite database file
+        """
+        self._path = path
+        self._logger = logger
+        self._local = threading.local()
+        self._has_fts = False
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._create_fts(conn)
+
+    #
+    # Private methods
+    #
+    def _connect(self):
+        # One connection per thread; sqlite3 connections can not be shared
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_fts(self, conn):
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'articles_fts'"
+            ).fetchone()
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5
+            self._logger.warning('Full-text search disabled: {}'.format(e))
+            return
+        self._has_fts = True
+        if not exists:
+            # Index the articles stored before the index existed
+            conn.execute(
+                "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+
+    def _article_row(self, article):
+        source = article.get('source') or {}
+        return (article.get('url'), source.get('id'), source.get('name'),
+                article.get('author'), article.get('title'),
+                article.get('description'), article.get('content'),
+                article.get('urlToImage'), article.get('publishedAt'))
+
+    def _article_from_row(self, row):
+        return {
+            'source': {'id': row['source_id'], 'name': row['source_name']},
+            'author': row['author'], 'title': row['title'],
+            'description': row['description'], 'url': row['url'],
+            'urlToImage': row['url_to_image'],
+            'publishedAt': row['published_at'], 'content': row['content']}
+
+    def _source_row(self, source):
+        return (source.get('id'), source.get('name'),
+                source.get('description'), source.get('url'),
+                source.get('category'), source.get('language'),
+                source.get('country'))
+
+    #
+    # Public methods
+    #
+    def start_run(self, run_name, query_data):
+        """Record a query run and return its id.
+        Default arguments:
+            run_name: Query name with timestamp, as used for the file names
+            query_data: Query arguments saved with the results
+        """
+        query_name = RUN_SUFFIX_RE.sub('', run_name)
+        with self._connect() as conn:
+            # A run saved again under the same name replaces the old one
+            for table in ('run_articles', 'run_sources'):
+                conn.execute(
+                    'DELETE FROM {} WHERE run_id IN (SELECT id FROM '
+                    'query_runs WHERE run_name = ?)'.format(table),
+                    (run_name,))
+            conn.execute('DELETE FROM query_runs WHERE run_name = ?',
+                         (run_name,))
+            cursor = conn.execute(
+                'INSERT INTO query_runs '
+                '(run_name, query_name, api_name, run_at, query) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (run_name, query_name, query_data.get('api_name'),
+                 datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(query_data)))
+            return cursor.lastrowid
+
+    def add_articles(self, run_id, articles, position=0):
+        """Insert articles, skipping URLs already stored, and link them to
+        run_id in the given order starting at position.
+        """
+        rows = [self._article_row(article) for article in articles
+                if article.get('url')]
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO articles ({}, first_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'.format(
+                    ARTICLE_COLUMNS),
+                [row + (now,) for row in rows])
+            conn.executemany(
+                'INSERT OR IGNORE INTO run_articles '
+                '(run_id, article_id, position) '
+                'SELECT ?, id, ? FROM articles WHERE url = ?',
+                [(run_id, position + count, row[0])
+                 for count, row in enumerate(rows)])
+
+    def add_sources(self, run_id, sources):
+        """Insert or refresh sources and link them to run_id"""
+        rows = [self._source_row(source) for source in sources]
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO sources (source_id, name, description, url, '
+                'category, language, country) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source_id, name) DO UPDATE SET '
+                'description=excluded.description, url=excluded.url, '
+                'category=excluded.category, language=excluded.language, '
+                'country=excluded.country', rows)
+            conn.executemany(
+                'INSERT OR IGNORE INTO run_sources '
+                '(run_id, source_id, position) '
+                'SELECT ?, id, ? FROM sources WHERE source_id IS ? '
+                'AND name = ?',
+                [(run_id, count, row[0], row[1])
+                 for count, row in enumerate(rows)])
+
+    def finish_run(self, run_id, query_status):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE query_runs SET status = ?, total_results = ?, '
+                'query_status = ? WHERE id = ?',
+                (query_status.get('status'),
+                 query_status.get('totalResults'), json.dumps(query_status),
+                 run_id))
+
+    def delete_run(self, run_id):
+        """Remove a query run, e.g. one that failed before finish_run().
+        Its articles and sources stay stored.
+        """
+        with self._connect() as conn:
+            for table in ('run_articles', 'run_sources'):
+                conn.execute('DELETE FROM {} WHERE run_id = ?'.format(table),
+                             (run_id,))
+            conn.execute('DELETE FROM query_runs WHERE id = ?', (run_id,))
+
+    def save_run(self, results, run_name):
+        """Persist a query() response: the query, its status and the
+        articles or sources it returned.
+        """
+        run_id = self.start_run(run_name, results.get('query', {}))
+        if 'articles' in results:
+            self.add_articles(run_id, results['articles'])
+        if 'sources' in results:
+            self.add_sources(run_id, results['sources'])
+        self.finish_run(run_id, results.get('query_status', {}))
+        return run_id
+
+    def latest_run_name(self, query_name):
+        """Return the run name of the newest finished run of query_name
+        or None
+        """
+        # Runs without query_status were not finished: still being
+        # streamed or interrupted
+        row = self._connect().execute(
+            'SELECT run_name FROM query_runs WHERE query_name = ? '
+            'AND query_status IS NOT NULL '
+            'ORDER BY run_at DESC, id DESC LIMIT 1', (query_name,)).fetchone()
+        return row['run_name'] if row else None
+
+    def load_run(self, run_name):
+        """Return a persisted run in the same shape query() returned it,
+        or None if there is no such run.
+        """
+        conn = self._connect()
+        run = conn.execute('SELECT * FROM query_runs WHERE run_name = ?',
+                           (run_name,)).fetchone()
+        if run is None:
+            return None
+        results = {
+            'query': json.loads(run['query']),
+            'query_status': json.loads(run['query_status'] or '{}')}
+        if run['api_name'] == 'get_sources':
+            rows = conn.execute(
+                'SELECT s.* FROM run_sources r JOIN sources s '
+                'ON s.id = r.source_id WHERE r.run_id = ? '
+                'ORDER BY r.position', (run['id'],))
+            results['sources'] = [{
+                'id': row['source_id'], 'name': row['name'],
+                'description': row['description'], 'url': row['url'],
+                'category': row['category'], 'language': row['language'],
+                'country': row['country']} for row in rows]
+        else:
+            rows = conn.execute(
+                'SELECT a.* FROM run_articles r JOIN articles a '
+                'ON a.id = r.article_id WHERE r.run_id = ? '
+                'ORDER BY r.position', (run['id'],))
+            results['articles'] = [self._article_from_row(row)
+                                   for row in rows]
+        return results
+
+    def find_articles(self, source=None, since=None, until=None,
+                      query_name=None, limit=None):
+        """Return stored articles, newest first.
+        Keyword arguments:
+            source: Source name or source id the articles are from
+            since: Oldest publishedAt allowed, ISO 8601 date or time
+            until: Newest publishedAt allowed, ISO 8601 date or time
+            query_name: Only articles returned by runs of this query
+            limit: Maximum number of articles returned
+        """
+        sql = 'SELECT DISTINCT a.* FROM articles a'
+        where, params = [], []
+        if query_name:
+            sql += (' JOIN run_articles r ON r.article_id = a.id'
+                    ' JOIN query_runs q ON q.id = r.run_id')
+            where.append('q.query_name = ?')
+            params.append(query_name)
+        if source:
+            where.append('(a.source_name = ? OR a.source_id = ?)')
+            params += [source, source]
+        if since:
+            where.append('a.published_at >= ?')
+            params.append(since)
+        if until:
+            # Dates without time include the whole day
+            where.append('a.published_at <= ?')
+            params.append(until if 'T' in until else until + 'T99')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY a.published_at DESC'
+        if limit:
+            sql += ' LIMIT {:d}'.format(limit)
+        rows = self._connect().execute(sql, params)
+        return [self._article_from_row(row) for row in rows]
+
+    def search(self, fts_query, limit=20, source=None, since=None):
+        """Return (rank, article) of the articles matching fts_query, an
+        SQLite FTS5 query, best match first. Matches in the title weigh
+        more than matches in the description, which weigh more than
+        matches in the content.
+        Keyword arguments:
+            limit: Maximum number of articles returned
+            source: Source name or source id the articles are from
+            since: Oldest publishedAt allowed, ISO 8601 date or time
+        """
+        if not self._has_fts:
+            raise Exception("ERROR: SQLite full-text search (FTS5) is not "
+                            "available")
+        sql = ('SELECT a.*, bm25(articles_fts, {}, {}, {}) AS rank '
+               'FROM articles_fts JOIN articles a ON a.id = articles_fts.rowid '
+               'WHERE articles_fts MATCH ?').format(*FTS_WEIGHTS)
+        params = [fts_query]
+        if source:
+            sql += ' AND (a.source_name = ? OR a.source_id = ?)'
+            params += [source, source]
+        if since:
+            sql += ' AND a.published_at >= ?'
+            params.append(since)
+        sql += ' ORDER BY rank LIMIT {:d}'.format(limit)
+        try:
+            rows = self._connect().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError("Invalid search query {}: {}".format(
+                fts_query, e))
+        # bm25 is negative, lower is better
+        return [(-row['rank'], self._article_from_row(row)) for row in rows]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
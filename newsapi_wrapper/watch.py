@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import re
+import json
+import time
+import heapq
+import threading
+import logging
+from datetime import datetime, timedelta, timezone
+
+# Seconds between two runs of a query without an interval
+WATCH_INTERVAL = 15*60
+MIN_INTERVAL = 60
+# Seconds between the first runs of the queries, so they do not all
+# start at once
+STAGGER = 5
+INTERVAL_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$')
+INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60*60, 'd': 24*60*60}
+STATUS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def parse_interval(value):
+    """Return value, a number of seconds or a string like 90s, 15m, 2h or
+    1d, in seconds. Raises ValueError for intervals under MIN_INTERVAL.
+    """
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = INTERVAL_RE.match(str(value).lower())
+        if not match:
+            raise ValueError("Invalid interval: {}".format(value))
+        seconds = float(match.group(1))*INTERVAL_UNITS[match.group(2)]
+    if seconds < MIN_INTERVAL:
+        raise ValueError("Interval {} is shorter than {} seconds".format(
+            value, MIN_INTERVAL))
+    return seconds
+
+def _timestamp(seconds):
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds).strftime(STATUS_FORMAT)
+
+
+class QueryWatcher:
+    """Run queries again and again, each at its own interval, until
+    stop() is called. Due queries run one at a time, so they share the
+    rate limit of the wrapper instead of piling up on it. A query that
+    overruns its interval is not run again to catch up. When the daily
+    quota is used up the watcher waits for the next UTC day. The state of
+    every query is written to a JSON status file after each run.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, run, queries, status_path, quota_remaining=None,
+                 stagger=STAGGER, logger=logging.getLogger()):
+        """
+        Default arguments:
+            run: Called with (label, params) for every due query; returns
+                 the path of the results or None on failure
+            queries: List of (label, params). The 'interval' key of params,
+                     see parse_interval(), is the time between two runs.
+                     Default: WATCH_INTERVAL
+            status_path: JSON file the watcher state is written to
+            quota_remaining: Callable returning the number of requests
+                             left today, or None when not limited
+            stagger: Seconds between the first runs of the queries
+        """
+        self._run = run
+        self._status_path = status_path
+        self._quota_remaining = quota_remaining
+        self._logger = logger
+        self._stop = threading.Event()
+        self._started = None
+        self._state = 'starting'
+        self._queries = {}
+        for label, params in queries:
+            params = dict(params)
+            interval = parse_interval(params.pop('interval', WATCH_INTERVAL))
+            self._queries[label] = {
+                'params': params, 'interval': interval, 'runs': 0,
+                'failures': 0, 'last_run': None, 'last_status': None,
+                'last_duration': None, 'last_path': None, 'next_run': None}
+        self._stagger = stagger
+
+    #
+    # Private methods
+    #
+    def _write_status(self):
+        status = {
+            'pid': os.getpid(),
+            'state': self._state,
+            'started': _timestamp(self._started),
+            'updated': _timestamp(time.time()),
+            'queries': {}}
+        for label, query in self._queries.items():
+            status['queries'][label] = {
+                'interval': query['interval'],
+                'runs': query['runs'],
+                'failures': query['failures'],
+                'last_run': _timestamp(query['last_run']),
+                'last_status': query['last_status'],
+                'last_duration': query['last_duration'],
+                'last_path': query['last_path'],
+                'next_run': _timestamp(query['next_run'])}
+        try:
+            tmp_path = self._status_path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(status, file, indent=2)
+            os.replace(tmp_path, self._status_path)
+        except OSError as e:
+            self._logger.exception(e)
+
+    def _seconds_to_next_day(self):
+        now = datetime.now(timezone.utc)
+        tomorrow = (now + timedelta(days=1)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        return (tomorrow - now).total_seconds()
+
+    def _quota_used_up(self):
+        if self._quota_remaining is None:
+            return False
+        return self._quota_remaining() == 0
+
+    def _run_query(self, label):
+        query = self._queries[label]
+        start = time.time()
+        try:
+            path = self._run(label, dict(query['params']))
+            status = 'ok' if path and os.path.exists(path) else 'failed'
+        except Exception as e:
+            self._logger.exception(e)
+            status, path = 'failed', str(e)
+        query['runs'] += 1
+        query['failures'] += status != 'ok'
+        query['last_run'] = start
+        query['last_status'] = status
+        query['last_duration'] = round(time.time() - start, 3)
+        query['last_path'] = path
+        self._logger.info('{} {} in {:.2f}s -> {}'.format(
+            label, status, query['last_duration'], path))
+
+    #
+    # Public methods
+    #
+    def daily_requests(self):
+        """Return the least number of News API requests per day the
+        queries make at their intervals, one per run
+        """
+        return sum(int(24*60*60//query['interval'])
+                   for query in self._queries.values())
+
+    def run(self):
+        """Run the queries until stop() is called. The query running when
+        stop() is called is finished first.
+        """
+        self._started = time.time()
+        self._state = 'running'
+        schedule = []
+        for count, label in enumerate(self._queries):
+            next_run = self._started + count*self._stagger
+            self._queries[label]['next_run'] = next_run
+            heapq.heappush(schedule, (next_run, count, label))
+        self._write_status()
+        while schedule and not self._stop.is_set():
+            next_run, count, label = schedule[0]
+            delay = next_run - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+                continue
+            if self._quota_used_up():
+                delay = self._seconds_to_next_day()
+                self._logger.warning('Daily quota used up, waiting {:.0f}s'\
+                    .format(delay))
+                self._state = 'waiting for quota'
+                self._write_status()
+                self._stop.wait(delay)
+                self._state = 'running'
+                continue
+            heapq.heappop(schedule)
+            self._run_query(label)
+            query = self._queries[label]
+            # Skip the runs missed while this or other queries ran
+            next_run += query['interval']
+            missed = (time.time() - next_run)//query['interval'] + 1
+            if missed > 0:
+                next_run += missed*query['interval']
+            query['next_run'] = next_run
+            heapq.heappush(schedule, (next_run, count, label))
+            self._write_status()
+        self._state = 'stopped'
+        for query in self._queries.values():
+            query['next_run'] = None
+        self._write_status()
+
+    def stop(self):
+        """Ask run() to return; safe to call from a signal handler"""
+        self._stop.set()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import threading
+import logging
+from datetime import datetime
+
+from .filelock import file_lock
+
+WATERMARK_FILE = "watermarks.json"
+# Format accepted by News API for the from/to parameters
+WATERMARK_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+class WatermarkStore:
+    """Remember, per query name, the publishedAt time of the newest article
+    seen so that recurring queries only need to fetch newer articles.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, logger=logging.getLogger()):
+        """
+        Default arguments:
+            path: JSON file the watermarks are kept in
+        """
+        self._path = path
+        self._logger = logger
+        self._lock = threading.Lock()
+
+    #
+    # Private methods
+    #
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self._logger.exception(e)
+            return {}
+
+    #
+    # Public methods
+    #
+    def get(self, query_name):
+        """Return the watermark of query_name as YYYY-MM-DDTHH:MM:SS or
+        None if the query never ran incrementally.
+        """
+        with self._lock:
+            entry = self._load().get(query_name)
+        return entry['publishedAt'] if entry else None
+
+    def update(self, query_name, articles):
+        """Advance the watermark of query_name to the newest publishedAt
+        of articles. The watermark never moves backwards.
+        Response:
+            The watermark after the update.
+        """
+        published = [article['publishedAt'][:19] for article in articles
+                     if article.get('publishedAt')]
+        # The file lock keeps processes running queries at the same time
+        # from dropping each other's watermarks
+        with self._lock, file_lock(self._path):
+            watermarks = self._load()
+            entry = watermarks.get(query_name, {})
+            newest = max(published + [entry.get('publishedAt', '')])
+            if not newest:
+                return None
+            watermarks[query_name] = {
+                'publishedAt': newest,
+                'updated': datetime.now().strftime(WATERMARK_FORMAT)}
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(watermarks, file, indent=2)
+            os.replace(tmp_path, self._path)
+        return newest
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import csv
+import json
+from datetime import date
+
+from .records import Article
+from .render import table_head, render_rows, page_file_name, page_links, \
+    PageTemplate, TABLE_TAIL
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 10000
+
+class JsonLinesWriter:
+    """Write records to a JSON Lines file as they arrive"""
+    #
+    # Constructor
+    #
+    def __init__(self, path, record_type=Article):
+        """
+        Default arguments:
+            path: Path of the .jsonl file to create
+            record_type: Record class of the records written
+        """
+        self.path = path
+        self._columns = record_type.COLUMNS
+        self._file = open(path, 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # Public methods
+    #
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(dict(zip(self._columns,
+                                                 record.values()))))
+            self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+
+
+class HtmlTableWriter:
+    """Write a query result HTML report one table row at a time.
+    Every page is written from the result template: everything up to the
+    {result} placeholder is written when the page is opened, rows are
+    appended as they arrive and the rest of the template is written when
+    the page is closed. With page_rows the report is split into pages of
+    at most page_rows rows, <name>.html, <name>-p2.html, ..., linked to
+    each other; a full page is only closed once the next row arrives, so
+    the last page has no link to a next one.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, template, query_string, columns, links=None,
+                 page_rows=None):
+        """
+        Default arguments:
+            path: Path of the .html file of the first page
+            template: PageTemplate, or template text, of the result page
+                      with {query} and {result} placeholders
+            query_string: HTML describing the query, put in {query}
+            columns: Record keys written as table columns, in order
+            links: Dict of column to the record key holding the URL the
+                   column is linked to
+            page_rows: Maximum number of rows per page. None writes a
+                       single page.
+        """
+        self.path = path
+        # Paths of the pages written so far, the first being path
+        self.paths = []
+        self._dir, name = os.path.split(path)
+        self._base_name = os.path.splitext(name)[0]
+        if isinstance(template, str):
+            template = PageTemplate(template)
+        self._template = template
+        self._query_string = query_string
+        self._columns = columns
+        self._links = links or {}
+        self._page_rows = page_rows
+        self._rows = 0
+        self._open_page()
+
+    #
+    # Private methods
+    #
+    def _open_page(self):
+        number = len(self.paths) + 1
+        path = self.path if number == 1 else os.path.join(
+            self._dir, page_file_name(self._base_name, number))
+        self.paths.append(path)
+        self._rows = 0
+        self._file = open(path, 'w')
+        self._file.write(self._template.head(self._query_string))
+        self._file.write(table_head(self._columns))
+
+    def _close_page(self, has_next):
+        self._file.write(TABLE_TAIL)
+        if has_next or len(self.paths) > 1:
+            self._file.write(page_links(self._base_name, len(self.paths),
+                                        has_next))
+        self._file.write(self._template.tail())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # Public methods
+    #
+    def write(self, records):
+        if not self._page_rows:
+            self._file.write(render_rows(records, self._columns,
+                                         self._links))
+            return
+        start = 0
+        while start < len(records):
+            if self._rows == self._page_rows:
+                self._close_page(has_next=True)
+                self._open_page()
+            chunk = records[start:start + self._page_rows - self._rows]
+            self._file.write(render_rows(chunk, self._columns, self._links))
+            self._rows += len(chunk)
+            start += len(chunk)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._close_page(has_next=False)
+
+
+class CsvWriter:
+    """Write records to a CSV file, one chunk of rows at a time. Missing
+    values are written as empty fields.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, record_type=Article):
+        """
+        Default arguments:
+            path: Path of the .csv file to create
+            record_type: Record class of the records written; its columns
+                         make the header row
+        """
+        self.path = path
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(record_type.COLUMNS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # Public methods
+    #
+    def write(self, records):
+        self._writer.writerows(record.values() for record in records)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Write records to a Parquet file. Rows are buffered and written a
+    row group of row_group_size rows at a time. Date columns are stored
+    as date32, all other columns as strings. Needs pyarrow.
+    """
+    #
+    # Constructor
+    #
+    def __init__(self, path, record_type=Article,
+                 row_group_size=PARQUET_ROW_GROUP):
+        """
+        Default arguments:
+            path: Path of the .parquet file to create
+            record_type: Record class of the records written
+            row_group_size: Number of rows per row group
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow: "
+                              "pip install pyarrow")
+        self._pa = pyarrow
+        self.path = path
+        self._attrs = record_type.__slots__
+        self._dates = [column in record_type.DATE_COLUMNS
+                       for column in record_type.COLUMNS]
+        self._schema = pyarrow.schema([
+            (column, pyarrow.date32() if is_date else pyarrow.string())
+            for column, is_date in zip(record_type.COLUMNS, self._dates)])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self._row_group_size = row_group_size
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #
+    # Private methods
+    #
+    def _to_date(self, value):
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _flush(self):
+        if not self._rows:
+            return
+        arrays = []
+        for attr, is_date, field in zip(self._attrs, self._dates,
+                                        self._schema):
+            values = [getattr(record, attr) for record in self._rows]
+            if is_date:
+                values = [self._to_date(value) for value in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_table(self._pa.Table.from_arrays(
+            arrays, schema=self._schema))
+        self._rows = []
+
+    #
+    # Public methods
+    #
+    def write(self, records):
+        self._rows.extend(records)
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._flush()
+        self._writer.close()
+        self._writer = None
+
+
+# Output formats selectable in addition to the HTML result page
+OUTPUT_FORMATS = {
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter}
+
+def parse_formats(formats):
+    """Return the list of output formats named by formats, a comma
+    separated string or a list. Raises ValueError for unknown formats.
+    """
+    if not formats:
+        return []
+    if isinstance(formats, str):
+        formats = formats.split(',')
+    formats = [fmt.strip().lower() for fmt in formats if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError("Invalid output format: {}; choose from {}".format(
+            ', '.join(unknown), ', '.join(OUTPUT_FORMATS)))
+    return list(dict.fromkeys(formats))
+
+def open_writers(formats, path, record_type=Article):
+    """Return a writer per output format, writing to path plus the format
+    as extension. Writers already opened are closed if one fails to open.
+    """
+    writers = []
+    try:
+        for fmt in formats:
+            writers.append(OUTPUT_FORMATS[fmt](
+                '{}.{}'.format(path, fmt), record_type))
+    except:
+        for writer in writers:
+            writer.close()
+        raise
+    return writers
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import newsapi_wrapper.newsapi_wrapper as nw_module
+
+
+def make_articles(count, prefix='article'):
+    """count News API articles, newest first"""
+    return [{
+        'source': {'id': None, 'name': 'Source {}'.format(index % 7)},
+        'author': 'Author {}'.format(index),
+        'title': '{} {} title'.format(prefix, index),
+        'description': 'Description of {} {}'.format(prefix, index),
+        'url': 'https://example.com/{}/{}'.format(prefix, index),
+        'urlToImage': None,
+        'publishedAt': '2020-08-{:02d}T{:02d}:00:00Z'.format(
+            28 - index//24 % 28, 23 - index % 24),
+        'content': 'Content of {} {}'.format(prefix, index)}
+        for index in range(count)]
+
+
+class StubNewsApiClient:
+    """NewsApiClient stand-in serving total_results articles in pages"""
+
+    def __init__(self, total_results):
+        self.articles = make_articles(total_results)
+        self.calls = []
+
+    def _page(self, page=1, page_size=20, **query_args):
+        self.calls.append(dict(query_args, page=page, page_size=page_size))
+        start = (page - 1)*page_size
+        return {'status': 'ok', 'totalResults': len(self.articles),
+                'articles': self.articles[start:start + page_size]}
+
+    def get_top_headlines(self, **query_args):
+        return self._page(**query_args)
+
+    def get_everything(self, **query_args):
+        return self._page(**query_args)
+
+    def get_sources(self, **query_args):
+        return {'status': 'ok', 'sources': []}
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Keep the files the wrapper writes to Data/ and Cache/ in temporary
+    directories
+    """
+    path = tmp_path / 'data'
+    path.mkdir()
+    monkeypatch.setattr(nw_module, 'DATA_PATH', str(path) + os.sep)
+    monkeypatch.setattr(nw_module, 'CACHE_PATH',
+                        str(tmp_path / 'cache') + os.sep)
+    return path
+
+
+@pytest.fixture
+def results_dir(tmp_path):
+    path = tmp_path / 'results'
+    path.mkdir()
+    return str(path)
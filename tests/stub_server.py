@@ -0,0 +1,105 @@
+"""aiohttp server mimicking the three News API endpoints used by
+AsyncNewsApiWrapper, for tests pointing base_url at it.
+
+Special q values trigger error responses:
+    error   400 parameterInvalid
+    slow    answers after StubNewsApi.slow_delay seconds
+    flaky   500 unexpectedError on the first request, then ok
+"""
+import asyncio
+import threading
+
+from aiohttp import web
+
+from conftest import make_articles
+
+API_KEY = 'test-key'
+
+
+class StubNewsApi:
+
+    def __init__(self, total_results=45, source_count=12):
+        self.articles = make_articles(total_results)
+        self.sources = [{
+            'id': 'source-{}'.format(index), 'name': 'Source {}'.format(index),
+            'description': 'Source number {}'.format(index),
+            'url': 'https://source{}.com'.format(index),
+            'category': 'general', 'language': 'en',
+            'country': 'us' if index % 2 else 'gb'}
+            for index in range(source_count)]
+        self.slow_delay = 1.0
+        # (endpoint, query parameters, api key header) of every request
+        self.requests = []
+        self._runner = None
+        self._loop = None
+        self._thread = None
+        self.base_url = None
+
+    def _error(self, status, code):
+        return web.json_response({'status': 'error', 'code': code,
+                                  'message': 'Stub {} error'.format(code)},
+                                 status=status)
+
+    async def _articles(self, request):
+        endpoint = request.match_info['endpoint']
+        params = dict(request.query)
+        self.requests.append((endpoint, params,
+                              request.headers.get('X-Api-Key')))
+        if request.headers.get('X-Api-Key') != API_KEY:
+            return self._error(401, 'apiKeyInvalid')
+        q = params.get('q')
+        if q == 'error':
+            return self._error(400, 'parameterInvalid')
+        if q == 'slow':
+            await asyncio.sleep(self.slow_delay)
+        if q == 'flaky' and len([r for r in self.requests
+                                 if r[1].get('q') == 'flaky']) == 1:
+            return self._error(500, 'unexpectedError')
+        page = int(params.get('page', 1))
+        page_size = int(params.get('pageSize', 20))
+        start = (page - 1)*page_size
+        return web.json_response({
+            'status': 'ok', 'totalResults': len(self.articles),
+            'articles': self.articles[start:start + page_size]})
+
+    async def _sources(self, request):
+        self.requests.append(('top-headlines/sources', dict(request.query),
+                              request.headers.get('X-Api-Key')))
+        return web.json_response({'status': 'ok', 'sources': self.sources})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/v2/top-headlines/sources', self._sources)
+        app.router.add_get('/v2/{endpoint:top-headlines|everything}',
+                           self._articles)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = 'http://127.0.0.1:{}/v2'.format(port)
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def start_thread(self):
+        """Serve from a thread with an event loop of its own, for tests
+        blocking the event loop of the client
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def endpoint_requests(self, endpoint):
+        return [params for name, params, _ in self.requests
+                if name == endpoint]
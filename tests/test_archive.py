@@ -0,0 +1,148 @@
+import os
+import json
+import multiprocessing
+
+import pytest
+
+from newsapi_wrapper.archive import RunArchive, INDEX_FILE
+
+
+def run(count, name='run'):
+    return {'query': {'api_name': 'get_everything', 'q': name},
+            'query_status': {'status': 'ok', 'totalResults': count},
+            'articles': [{'title': '{} {}'.format(name, index),
+                          'url': 'https://example.com/{}/{}'.format(
+                              name, index)}
+                         for index in range(count)]}
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    return str(tmp_path / 'archive')
+
+
+def open_archive(path, **options):
+    options.setdefault('codec', 'gzip')
+    options.setdefault('chunk_items', 7)
+    return RunArchive(path, **options)
+
+
+def test_run_is_read_back_as_appended(archive_dir):
+    archive = open_archive(archive_dir)
+    results = run(30)
+    entry = archive.append('ai-08_28_2020-10_00_00', results)
+    assert entry['query_name'] == 'ai'
+    assert entry['count'] == 30
+    assert [chunk[2:] for chunk in entry['chunks']] == \
+        [[0, 7], [7, 7], [14, 7], [21, 7], [28, 2]]
+    # Frames follow each other in the segment
+    frames = [entry['meta']] + [chunk[:2] for chunk in entry['chunks']]
+    for (offset, length), (next_offset, _) in zip(frames, frames[1:]):
+        assert offset + length == next_offset
+    assert archive.load_run('ai-08_28_2020-10_00_00') == results
+    archive.close()
+
+
+@pytest.mark.parametrize('start, stop', [
+    (0, 30), (0, 7), (6, 8), (7, 14), (13, 29), (25, 100), (30, 40),
+    (10, None)])
+def test_items_slices_across_chunks(archive_dir, start, stop):
+    archive = open_archive(archive_dir)
+    results = run(30)
+    archive.append('ai', results)
+    assert archive.items('ai', start, stop) == \
+        results['articles'][start:stop]
+    archive.close()
+
+
+def test_unknown_run(archive_dir):
+    archive = open_archive(archive_dir)
+    assert archive.load_run('missing') is None
+    with pytest.raises(KeyError):
+        archive.items('missing')
+
+
+def test_segments_roll_over_at_segment_size(archive_dir):
+    archive = open_archive(archive_dir, segment_size=2000)
+    entries = [archive.append('run-{}'.format(count), run(20, str(count)))
+               for count in range(10)]
+    segments = [entry['segment'] for entry in entries]
+    assert segments == sorted(segments)
+    assert segments[-1] > 1
+    for number in set(segments):
+        path = os.path.join(archive_dir, 'segment-{:05d}.nwa'.format(number))
+        runs = [entry for entry in entries if entry['segment'] == number]
+        # A run starts a new segment once the current one is full
+        assert runs[-1]['meta'][0] < 2000
+        assert os.path.getsize(path) == \
+            runs[-1]['meta'][0] + runs[-1]['size']
+        if number != segments[-1]:
+            assert os.path.getsize(path) >= 2000
+    assert archive.stats()['segments'] == len(set(segments))
+    for count, entry in enumerate(entries):
+        assert archive.load_run(entry['run']) == run(20, str(count))
+    archive.close()
+
+
+def test_run_appended_again_supersedes_the_earlier_one(archive_dir):
+    archive = open_archive(archive_dir)
+    archive.append('ai-08_27_2020-10_00_00', run(5, 'old'))
+    archive.append('ai-08_28_2020-10_00_00', run(5, 'other'))
+    archive.append('ai-08_27_2020-10_00_00', run(3, 'new'))
+    assert archive.load_run('ai-08_27_2020-10_00_00') == run(3, 'new')
+    assert {entry['run']: entry['count'] for entry in archive.runs()} == \
+        {'ai-08_27_2020-10_00_00': 3, 'ai-08_28_2020-10_00_00': 5}
+    # Other archives on the same directory read the index the same way
+    other = open_archive(archive_dir)
+    assert other.load_run('ai-08_27_2020-10_00_00') == run(3, 'new')
+    assert len(other.runs('ai')) == 2
+    archive.close()
+    other.close()
+
+
+def test_import_blobs(archive_dir, tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for name, count in (('ai-08_27_2020-10_00_00', 12),
+                        ('ml-08_28_2020-10_00_00', 3)):
+        (data_dir / (name + '.json')).write_text(json.dumps(run(count)))
+    (data_dir / 'broken-08_28_2020-11_00_00.json').write_text('{')
+    (data_dir / 'sources.json').write_text('[]')
+    archive = open_archive(archive_dir)
+    stats = archive.import_blobs(str(data_dir))
+    assert stats['runs'] == 2
+    assert stats['failed'] == 1
+    assert sorted(os.listdir(data_dir)) == [
+        'broken-08_28_2020-11_00_00.json', 'sources.json']
+    assert archive.load_run('ai-08_27_2020-10_00_00') == run(12)
+    assert archive.latest_run_name('ml') == 'ml-08_28_2020-10_00_00'
+    archive.close()
+
+
+def append_runs(path, writer, count):
+    archive = open_archive(path, segment_size=4000)
+    for number in range(count):
+        archive.append('w{}-{}'.format(writer, number),
+                       run(9, '{}-{}'.format(writer, number)))
+    archive.close()
+
+
+def test_processes_append_to_one_archive(archive_dir):
+    processes = [multiprocessing.Process(target=append_runs,
+                                         args=(archive_dir, writer, 15))
+                 for writer in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    archive = open_archive(archive_dir)
+    runs = archive.runs()
+    assert len(runs) == 60
+    with open(os.path.join(archive_dir, INDEX_FILE)) as file:
+        assert len(file.read().splitlines()) == 60
+    for entry in runs:
+        writer, number = entry['run'][1:].split('-')
+        assert archive.load_run(entry['run']) == \
+            run(9, '{}-{}'.format(writer, number))
+    archive.close()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from stub_server import StubNewsApi, API_KEY
+from newsapi_wrapper import AsyncNewsApiWrapper, NewsApiError
+
+
+def run_with_stub(test, stub=None, threaded=False, **kwargs):
+    """Run the coroutine function test(news, stub) against a started stub
+    server, with an AsyncNewsApiWrapper pointed at it. With threaded the
+    stub serves from a thread of its own, so test can block the loop.
+    """
+    stub = stub or StubNewsApi()
+    if threaded:
+        stub.start_thread()
+
+    async def main():
+        if not threaded:
+            await stub.start()
+        try:
+            options = dict(use_cache=False, storage='json', max_retries=0,
+                           max_results=None)
+            options.update(kwargs)
+            async with AsyncNewsApiWrapper(
+                    options.pop('api_key', API_KEY), options.pop('results'),
+                    base_url=stub.base_url, **options) as news:
+                return await test(news, stub)
+        finally:
+            if threaded:
+                stub.stop_thread()
+            else:
+                await stub.stop()
+
+    return asyncio.run(main())
+
+
+def test_pages_are_fetched_in_order(data_dir, results_dir):
+    async def test(news, stub):
+        news._pgsize = 20
+        results = await news.query('get_top_headlines', 'headlines',
+                                   persist=False, country='us')
+        return results, stub
+
+    results, stub = run_with_stub(test, results=results_dir)
+    assert results['articles'] == stub.articles
+    assert results['query_status']['totalResults'] == 45
+    pages = stub.endpoint_requests('top-headlines')
+    assert sorted(int(params.get('page', 1))
+                  for params in pages) == [1, 2, 3]
+    assert all(key == API_KEY for _, _, key in stub.requests)
+
+
+def test_argument_names_are_mapped(data_dir, results_dir):
+    async def test(news, stub):
+        await news.query('get_everything', 'everything', persist=False,
+                         q='ai', qintitle='robots', from_param='2020-08-01',
+                         to='2020-08-28', sort_by='publishedAt',
+                         exclude_domains='example.org', language='en')
+        return stub.endpoint_requests('everything')[0]
+
+    params = run_with_stub(test, results=results_dir)
+    assert params['qInTitle'] == 'robots'
+    assert params['from'] == '2020-08-01'
+    assert params['to'] == '2020-08-28'
+    assert params['sortBy'] == 'publishedAt'
+    assert params['excludeDomains'] == 'example.org'
+    assert params['pageSize'] == '100'
+    for name in ('qintitle', 'from_param', 'sort_by', 'exclude_domains',
+                 'page_size'):
+        assert name not in params
+
+
+def test_html_report_is_written(data_dir, results_dir):
+    async def test(news, stub):
+        return await news.get_all_news(query_name='report', q='ai')
+
+    path = run_with_stub(test, results=results_dir)
+    assert os.path.exists(path)
+    with open(path) as file:
+        assert 'article 44 title' in file.read()
+
+
+def test_sources_come_from_the_sources_endpoint(data_dir, results_dir):
+    async def test(news, stub):
+        path = await news.get_sources(query_name='sources')
+        return path, news.sources_catalog().stats(), stub
+
+    path, stats, stub = run_with_stub(test, results=results_dir)
+    assert os.path.exists(path)
+    assert stats['sources'] == len(stub.sources)
+    assert len(stub.endpoint_requests('top-headlines/sources')) == 1
+
+
+def test_sources_are_refreshed_without_cache(data_dir, results_dir):
+    async def test(news, stub):
+        await news.get_sources(query_name='sources')
+        await news.get_sources(query_name='sources')
+        return stub
+
+    stub = run_with_stub(test, results=results_dir)
+    assert len(stub.endpoint_requests('top-headlines/sources')) == 2
+    # With the cache, the catalog saved by the first run is used
+    stub = run_with_stub(test, results=results_dir, use_cache=True)
+    assert stub.endpoint_requests('top-headlines/sources') == []
+
+
+def test_catalog_can_be_refreshed_in_a_coroutine(data_dir, results_dir):
+    async def test(news, stub):
+        # Blocking call on the event loop the wrapper uses
+        news.sources_catalog().refresh()
+        return news.sources_catalog().stats(), stub
+
+    stats, stub = run_with_stub(test, results=results_dir, threaded=True)
+    assert stats['sources'] == len(stub.sources)
+    assert len(stub.endpoint_requests('top-headlines/sources')) == 1
+
+
+def test_file_io_runs_off_the_event_loop(data_dir, results_dir):
+    threads = []
+
+    def recorded(name, func):
+        def call(*args, **kwargs):
+            threads.append((name, threading.current_thread()))
+            return func(*args, **kwargs)
+        return call
+
+    async def test(news, stub):
+        news._scheduler._quota.acquire = recorded(
+            'quota', news._scheduler._quota.acquire)
+        news._cache.get = recorded('cache_get', news._cache.get)
+        news._cache.put = recorded('cache_put', news._cache.put)
+        await news.query('get_top_headlines', 'headlines', persist=False,
+                         country='us')
+
+    run_with_stub(test, results=results_dir, use_cache=True,
+                  daily_quota=100)
+    assert {name for name, _ in threads} == {'quota', 'cache_get',
+                                              'cache_put'}
+    assert all(thread is not threading.main_thread()
+               for _, thread in threads)
+
+
+def test_error_response_raises(data_dir, results_dir):
+    async def test(news, stub):
+        with pytest.raises(NewsApiError) as error:
+            await news.query('get_everything', 'error', persist=False,
+                             q='error')
+        return error.value
+
+    error = run_with_stub(test, results=results_dir)
+    assert error.code == 'parameterInvalid'
+
+
+def test_invalid_api_key_raises(data_dir, results_dir):
+    async def test(news, stub):
+        with pytest.raises(NewsApiError) as error:
+            await news.query('get_everything', 'key', persist=False, q='ai')
+        return error.value
+
+    error = run_with_stub(test, results=results_dir, api_key='wrong')
+    assert error.code == 'apiKeyInvalid'
+
+
+def test_timeout_raises(data_dir, results_dir):
+    async def test(news, stub):
+        with pytest.raises(asyncio.TimeoutError):
+            await news.query('get_everything', 'slow', persist=False,
+                             q='slow')
+
+    run_with_stub(test, results=results_dir, timeout=0.1)
+
+
+def test_server_error_is_retried(data_dir, results_dir):
+    async def test(news, stub):
+        # No backoff delay between the attempts
+        news._scheduler._backoff = 0
+        results = await news.query('get_everything', 'flaky',
+                                   persist=False, q='flaky')
+        return results, stub, news.request_stats()
+
+    results, stub, stats = run_with_stub(test, results=results_dir,
+                                         max_retries=2)
+    assert len(results['articles']) == 45
+    assert len(stub.endpoint_requests('everything')) == 2
+    assert stats['retries'] == 1
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+import newsapi_wrapper.cache as cache_module
+from newsapi_wrapper.cache import ResponseCache
+
+RESPONSE = {'status': 'ok', 'totalResults': 1,
+            'articles': [{'title': 'Article', 'url': 'https://a.com/1'}]}
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace time.time() of the cache module by clock.now"""
+    class Clock:
+        now = 1000000.0
+    monkeypatch.setattr(cache_module.time, 'time', lambda: Clock.now)
+    return Clock
+
+
+@pytest.mark.parametrize('args, same_args', [
+    ({'q': 'ai', 'page': 1, 'page_size': 20}, {'q': 'ai', 'page': 3}),
+    ({'q': 'ai', 'language': 'en'}, {'language': 'en', 'q': ' ai '}),
+    ({'q': 'ai', 'domains': 'b.com,a.com'}, {'q': 'ai',
+                                             'domains': 'A.com, b.com'}),
+    ({'sources': 'bbc-news,cnn'}, {'sources': 'cnn,bbc-news,'}),
+    ({'q': 'ai', 'sort_by': None}, {'q': 'ai', 'sort_by': ''}),
+    ({'q': 'ai', 'qintitle': 'x'}, {'q': 'ai', 'qInTitle': 'x'}),
+])
+def test_equivalent_queries_have_the_same_key(cache_dir, args, same_args):
+    cache = ResponseCache(cache_dir)
+    assert cache.make_key('get_everything', args) == \
+        cache.make_key('get_everything', same_args)
+
+
+@pytest.mark.parametrize('args, other_args', [
+    ({'q': 'ai'}, {'q': 'AI'}),
+    ({'q': 'ai', 'language': 'en'}, {'q': 'ai', 'language': 'de'}),
+    ({'q': 'ai', 'domains': 'a.com'}, {'q': 'ai', 'domains': 'a.com,b.com'}),
+])
+def test_other_queries_have_other_keys(cache_dir, args, other_args):
+    cache = ResponseCache(cache_dir)
+    assert cache.make_key('get_everything', args) != \
+        cache.make_key('get_everything', other_args)
+    assert cache.make_key('get_everything', args) != \
+        cache.make_key('get_top_headlines', args)
+
+
+def test_response_is_served_until_its_ttl(cache_dir, clock):
+    cache = ResponseCache(cache_dir, ttls={'get_everything': 60})
+    assert cache.get('get_everything', {'q': 'ai'}) is None
+    cache.put('get_everything', {'q': 'ai'}, RESPONSE)
+    clock.now += 60
+    assert cache.get('get_everything', {'q': 'ai', 'page': 2}) == RESPONSE
+    # Top headlines keep their default ttl
+    assert cache.ttl('get_top_headlines') == 5*60
+    clock.now += 1
+    assert cache.get('get_everything', {'q': 'ai'}) is None
+    assert os.listdir(cache_dir) == []
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0,
+                             'entries': 0, 'bytes': 0}
+
+
+def test_least_recently_used_entries_are_evicted(cache_dir):
+    cache = ResponseCache(cache_dir, max_entries=3)
+    for q in ('a', 'b', 'c'):
+        cache.put('get_everything', {'q': q}, RESPONSE)
+    # a becomes the most recently used
+    assert cache.get('get_everything', {'q': 'a'}) == RESPONSE
+    cache.put('get_everything', {'q': 'd'}, RESPONSE)
+    assert cache.get('get_everything', {'q': 'b'}) is None
+    for q in ('a', 'c', 'd'):
+        assert cache.get('get_everything', {'q': q}) == RESPONSE
+    assert cache.stats()['evictions'] == 1
+    assert len(os.listdir(cache_dir)) == 3
+
+
+def test_entries_are_evicted_by_size(cache_dir):
+    probe = ResponseCache(cache_dir)
+    probe.put('get_everything', {'q': 'a'}, RESPONSE)
+    size = probe.stats()['bytes']
+    probe.clear()
+    cache = ResponseCache(cache_dir, max_bytes=2*size + size//2)
+    for q in ('a', 'b', 'c'):
+        cache.put('get_everything', {'q': q}, RESPONSE)
+    assert cache.get('get_everything', {'q': 'a'}) is None
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] <= 2*size + size//2
+
+
+def test_entries_are_found_by_a_new_cache(cache_dir):
+    ResponseCache(cache_dir).put('get_everything', {'q': 'ai'}, RESPONSE)
+    cache = ResponseCache(cache_dir)
+    assert cache.stats()['entries'] == 1
+    assert cache.get('get_everything', {'q': 'ai'}) == RESPONSE
+
+
+def test_unreadable_entry_is_dropped(cache_dir):
+    cache = ResponseCache(cache_dir)
+    cache.put('get_everything', {'q': 'ai'}, RESPONSE)
+    key = cache.make_key('get_everything', {'q': 'ai'})
+    with open(os.path.join(cache_dir, key + '.json'), 'w') as file:
+        file.write('{"stored_at": ')
+    assert cache.get('get_everything', {'q': 'ai'}) is None
+    assert os.listdir(cache_dir) == []
+    assert cache.stats()['entries'] == 0
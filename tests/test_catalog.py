@@ -0,0 +1,169 @@
+import pytest
+
+import newsapi_wrapper.catalog as catalog
+from newsapi_wrapper.catalog import SourceCatalog, split_sources, \
+    merge_responses, RETRY_AFTER, CATALOG_TTL
+from newsapi_wrapper.scheduler import NewsApiError
+
+SOURCES = [
+    {'id': 'bbc-news', 'category': 'general', 'language': 'en',
+     'country': 'gb'},
+    {'id': 'bbc-sport', 'category': 'sports', 'language': 'en',
+     'country': 'gb'},
+    {'id': 'cnn', 'category': 'general', 'language': 'en', 'country': 'us'},
+    {'id': 'espn', 'category': 'sports', 'language': 'en', 'country': 'us'},
+    {'id': 'le-monde', 'category': 'general', 'language': 'fr',
+     'country': 'fr'}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1000000.0
+    monkeypatch.setattr(catalog.time, 'time', lambda: Clock.now)
+    return Clock
+
+
+class Fetch:
+    """Stub fetch returning SOURCES, or raising error when set"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return [dict(source) for source in SOURCES]
+
+
+@pytest.fixture
+def fetch():
+    return Fetch()
+
+
+@pytest.fixture
+def sources(tmp_path, fetch, clock):
+    return SourceCatalog(str(tmp_path / 'sources.json'), fetch)
+
+
+def codes(sources, api_name, args):
+    with pytest.raises(NewsApiError) as excinfo:
+        sources.validate(api_name, args)
+    return excinfo.value.code
+
+
+@pytest.mark.parametrize('api_name, args', [
+    ('get_top_headlines', {'category': 'weather'}),
+    ('get_top_headlines', {'country': 'us,xx'}),
+    ('get_everything', {'language': 'klingon'}),
+    ('get_everything', {'domains': 'bbc.co.uk,not a domain'}),
+    ('get_everything', {'exclude_domains': '-bad.com'}),
+    ('get_everything', {'category': 'general', 'sources': 'cnn'})])
+def test_invalid_arguments_are_rejected(sources, api_name, args):
+    assert codes(sources, api_name, args) == 'parameterInvalid'
+
+
+def test_unknown_sources_are_rejected(sources):
+    assert codes(sources, 'get_everything',
+                 {'sources': 'cnn,no-such-source'}) == 'sourceDoesNotExist'
+    assert sources.validate('get_everything', {'sources': 'cnn, espn'}) \
+        == {'sources': 'cnn, espn'}
+
+
+def test_category_and_country_are_expanded_for_everything(sources):
+    args = {'q': 'ai', 'category': 'general', 'country': 'gb,us'}
+    assert sources.validate('get_everything', args) == {
+        'q': 'ai', 'sources': 'bbc-news,cnn'}
+    # The arguments of the caller are left alone
+    assert 'category' in args
+    assert sources.validate('get_everything', {'country': 'fr'}) == {
+        'sources': 'le-monde'}
+    assert codes(sources, 'get_everything',
+                 {'category': 'sports', 'country': 'fr'}) \
+        == 'sourcesDoNotExist'
+
+
+def test_top_headlines_filters_are_passed_on(sources, fetch):
+    args = {'category': 'sports', 'country': 'us'}
+    assert sources.validate('get_top_headlines', args) == args
+    # Top headlines support the filters, the catalog is not needed
+    assert fetch.calls == 0
+
+
+def test_catalog_is_fetched_once_and_saved(tmp_path, sources, fetch, clock):
+    assert [source['id'] for source in sources.sources(category='sports')] \
+        == ['bbc-sport', 'espn']
+    assert sources.source('cnn')['country'] == 'us'
+    assert sources.source('nope') is None
+    assert fetch.calls == 1
+    # Another catalog on the same file does not fetch again
+    other_fetch = Fetch()
+    other = SourceCatalog(str(tmp_path / 'sources.json'), other_fetch)
+    assert len(other.sources(language='en')) == 4
+    assert other_fetch.calls == 0
+    assert other.stats() == {'sources': 5, 'updated': clock.now, 'age': 0}
+
+
+def test_stale_catalog_is_refreshed_in_the_background(sources, fetch,
+                                                      clock, monkeypatch):
+    started = []
+    monkeypatch.setattr(sources, '_start_refresh',
+                        lambda: started.append(True))
+    assert sources.available()
+    clock.now += CATALOG_TTL + 1
+    # The stale catalog is used while it is refreshed
+    assert sources.source('cnn')
+    assert started == [True]
+    assert fetch.calls == 1
+
+
+def test_failed_fetch_is_retried_after_a_while(sources, fetch, clock):
+    fetch.error = ConnectionError('down')
+    assert not sources.available()
+    assert not sources.available()
+    assert fetch.calls == 1
+    assert codes(sources, 'get_everything', {'country': 'us'}) \
+        == 'parameterInvalid'
+    # Unknown sources cannot be checked, News API is asked instead
+    assert sources.validate('get_everything', {'sources': 'whatever'})
+    assert fetch.calls == 1
+    fetch.error = None
+    clock.now += RETRY_AFTER
+    assert sources.available()
+    assert fetch.calls == 2
+
+
+def test_split_sources_batches_long_source_lists():
+    args = {'q': 'ai', 'sources': ','.join(str(i) for i in range(45))}
+    batches = split_sources(args, size=20)
+    assert [len(batch['sources'].split(',')) for batch in batches] \
+        == [20, 20, 5]
+    assert all(batch['q'] == 'ai' for batch in batches)
+    assert ','.join(batch['sources'] for batch in batches) == args['sources']
+    short = {'q': 'ai', 'sources': 'cnn,espn'}
+    assert split_sources(short) == [short]
+    assert split_sources({'q': 'ai'}) == [{'q': 'ai'}]
+
+
+def response(*published):
+    return {'status': 'ok', 'totalResults': len(published),
+            'articles': [{'publishedAt': date} for date in published]}
+
+
+def test_merge_responses_sorts_by_date():
+    merged = merge_responses([response('2020-08-27', '2020-08-25'),
+                              response('2020-08-28', '2020-08-26')])
+    assert merged['totalResults'] == 4
+    assert [article['publishedAt'] for article in merged['articles']] == [
+        '2020-08-28', '2020-08-27', '2020-08-26', '2020-08-25']
+
+
+def test_merge_responses_concatenates_other_orders():
+    merged = merge_responses([response('2020-08-25'),
+                              response('2020-08-28')], sort_by='relevancy')
+    assert [article['publishedAt'] for article in merged['articles']] == [
+        '2020-08-25', '2020-08-28']
+    single = response('2020-08-25')
+    assert merge_responses([single]) is single
@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import importlib
+
+import pytest
+
+from conftest import ROOT_DIR, StubNewsApiClient
+import newsapi_wrapper as nw
+import newsapi_wrapper.newsapi_wrapper as nw_module
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """StubNewsApiClient called by the wrappers newsapi_cmd creates"""
+    client = StubNewsApiClient(45)
+    wrapper_class = nw.NewsApiWrapper
+
+    def create(*args, **kwargs):
+        kwargs.update(newsapi_client=client)
+        return wrapper_class(*args, **kwargs)
+
+    monkeypatch.setattr(nw, 'NewsApiWrapper', create)
+    return client
+
+
+@pytest.fixture
+def cmd(tmp_path, monkeypatch, data_dir, results_dir, client):
+    """newsapi_cmd run from tmp_path, configured by the environment"""
+    shutil.copy(os.path.join(ROOT_DIR, 'newsapi_cmd_log.ini'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NEWSAPI_KEY', 'key')
+    monkeypatch.setenv('RESULTS_DIR_NAME', results_dir)
+    return sys.modules.get('newsapi_cmd') or \
+        importlib.import_module('newsapi_cmd')
+
+
+class CycleWatcher:
+    """QueryWatcher stand-in running every query cycles times at once"""
+
+    cycles = 2
+
+    def __init__(self, run, queries, status_path, quota_remaining=None,
+                 logger=None):
+        self._run = run
+        self._queries = queries
+
+    def daily_requests(self):
+        return 0
+
+    def run(self):
+        for _ in range(self.cycles):
+            for label, params in self._queries:
+                self._run(label, dict(params))
+
+    def stop(self):
+        pass
+
+
+def test_watch_cycles_call_news_api(cmd, client, tmp_path, monkeypatch):
+    import newsapi_wrapper.watch
+    monkeypatch.setattr(newsapi_wrapper.watch, 'QueryWatcher', CycleWatcher)
+    path = tmp_path / 'watched.yaml'
+    path.write_text('action: topnews\nquery_name: watched\ncountry: us\n'
+                    'interval: 2m\n')
+    cmd.watch([str(path)], storage='json',
+              status_file=str(tmp_path / 'status.json'))
+    # Both cycles run within the cache lifetime of top headlines
+    pages = [call['page'] for call in client.calls]
+    assert pages.count(1) == CycleWatcher.cycles
+
+
+def test_batch_entries_sharing_a_query_name_keep_their_outputs(
+        cmd, results_dir, tmp_path, capsys):
+    path = tmp_path / 'batch.yaml'
+    path.write_text('\n---\n'.join(
+        'action: topnews\nquery_name: same\ncountry: {}\n'.format(country)
+        for country in ('us', 'gb', 'fr')))
+    cmd.batch_query([str(path)], use_cache=False)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[-1].startswith('3 queries, 0 failed')
+    # All entries run in the same second but get their own run name
+    html_paths = {line.split(' -> ')[1] for line in lines[:-1]}
+    assert len(html_paths) == 3
+    assert all(os.path.exists(path) for path in html_paths)
+
+
+def test_query_closes_the_wrapper(cmd, tmp_path, monkeypatch):
+    closed = []
+    monkeypatch.setattr(nw_module.NewsApiWrapper, 'close',
+                        lambda self: closed.append(self))
+    path = tmp_path / 'query.yaml'
+    path.write_text('query_name: single\ncountry: us\n')
+    cmd.query('topnews', [str(path)], use_cache=False)
+    assert len(closed) == 1
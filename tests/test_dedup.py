@@ -0,0 +1,126 @@
+import pytest
+
+import newsapi_wrapper.dedup as dedup
+from newsapi_wrapper.dedup import ArticleDeduplicator, url_key, \
+    title_words, simhash
+
+TITLE = 'Apple unveils new iPhone with faster chip and better camera'
+
+
+def article(url, title=TITLE):
+    return {'url': url, 'title': title}
+
+
+@pytest.fixture
+def seen_path(data_dir):
+    return str(data_dir / 'seen.json')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace time.time() of the dedup module by clock.now"""
+    class Clock:
+        now = 1000000.0
+    monkeypatch.setattr(dedup.time, 'time', lambda: Clock.now)
+    return Clock
+
+
+@pytest.mark.parametrize('url', [
+    'http://example.com/news/1',
+    'https://www.example.com/news/1/',
+    'https://example.com/news/1#comments',
+    'https://EXAMPLE.com/news/1?utm_source=feed&fbclid=abc',
+])
+def test_url_variants_have_the_same_key(url):
+    assert url_key(url) == url_key('https://example.com/news/1')
+
+
+def test_url_query_order_is_ignored_but_not_its_values():
+    assert url_key('https://example.com/a?x=1&y=2') == \
+        url_key('https://example.com/a?y=2&x=1')
+    assert url_key('https://example.com/a?x=1') != \
+        url_key('https://example.com/a?x=2')
+    assert url_key('https://example.com/a') != url_key('https://example.com/b')
+
+
+def test_title_words_drop_the_publisher_suffix():
+    assert title_words(TITLE + ' - The Verge') == title_words(TITLE)
+    assert title_words('Markets | Reuters') == ['markets']
+
+
+@pytest.mark.parametrize('title, near', [
+    (TITLE + ' | The Verge', True),
+    ('Apple unveils new iPhone with faster chip and a better camera', True),
+    ('Apple unveils the new iPhone with faster chip and better camera',
+     False),
+    ('Stocks fall as investors weigh inflation data', False),
+])
+def test_near_duplicate_titles(seen_path, title, near):
+    deduplicator = ArticleDeduplicator(seen_path)
+    assert deduplicator.filter([article('https://a.com/1')])
+    kept = deduplicator.filter([article('https://b.com/1', title)])
+    assert (not kept) == near
+    distance = bin(simhash(title_words(TITLE)) ^
+                   simhash(title_words(title))).count('1')
+    assert (distance <= dedup.MAX_DISTANCE) == near
+
+
+def test_bands_find_every_fingerprint_within_max_distance(seen_path):
+    deduplicator = ArticleDeduplicator(seen_path, max_distance=6)
+    deduplicator.filter([])
+    fingerprint = simhash(title_words(TITLE))
+    deduplicator._remember('key', fingerprint, 0)
+    # One differing bit in 6 of the 7 bands, or all in one band
+    spread = sum(1 << band*deduplicator._band_bits for band in range(6))
+    assert deduplicator._near_duplicate(fingerprint ^ spread)
+    assert deduplicator._near_duplicate(fingerprint ^ 0b111111)
+    # A seventh bit is beyond the distance
+    assert not deduplicator._near_duplicate(fingerprint ^ 0b1111111)
+    assert not deduplicator._near_duplicate(
+        fingerprint ^ (spread | 1 << 6*deduplicator._band_bits))
+
+
+def test_short_titles_are_only_deduplicated_by_url(seen_path):
+    deduplicator = ArticleDeduplicator(seen_path)
+    kept = deduplicator.filter([article('https://a.com/1', 'Markets today'),
+                                article('https://b.com/1', 'Markets today'),
+                                article('https://www.a.com/1/', 'Other')])
+    assert [item['url'] for item in kept] == ['https://a.com/1',
+                                              'https://b.com/1']
+    assert deduplicator.stats() == {'url_duplicates': 1,
+                                    'title_duplicates': 0, 'seen': 2}
+
+
+def test_seen_articles_expire(seen_path, clock):
+    deduplicator = ArticleDeduplicator(seen_path, ttl=60)
+    deduplicator.filter([article('https://a.com/1')])
+    deduplicator.save()
+    clock.now += 30
+    assert not ArticleDeduplicator(seen_path, ttl=60).filter(
+        [article('https://a.com/1')])
+    clock.now += 31
+    assert ArticleDeduplicator(seen_path, ttl=60).filter(
+        [article('https://a.com/1')])
+
+
+def test_saves_of_two_deduplicators_are_merged(seen_path, clock):
+    first = ArticleDeduplicator(seen_path)
+    second = ArticleDeduplicator(seen_path)
+    first.filter([article('https://a.com/1'),
+                  article('https://c.com/1', 'Short title')])
+    clock.now += 10
+    # Loaded before first saved
+    second.filter([article('https://b.com/1', 'Stocks fall as investors '
+                           'weigh inflation data'),
+                   article('https://a.com/1')])
+    first.save()
+    second.save()
+    merged = ArticleDeduplicator(seen_path)
+    merged.filter([])
+    assert merged.stats()['seen'] == 3
+    # The article keeps the time it was first seen
+    seen_at = merged._seen[url_key('https://a.com/1')][1]
+    assert seen_at == clock.now - 10
+    assert not merged.filter([article('https://a.com/1'),
+                              article('https://b.com/1'),
+                              article('https://c.com/1')])
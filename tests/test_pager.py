@@ -0,0 +1,84 @@
+import random
+import threading
+import time
+
+import pytest
+
+from conftest import StubNewsApiClient
+from newsapi_wrapper import NewsApiWrapper
+from newsapi_wrapper.pager import PageFetcher
+
+
+class RecordingCall:
+    """call() for PageFetcher answering after a random delay and
+    recording the number of requests in flight
+    """
+
+    def __init__(self, fail_page=None):
+        self.fail_page = fail_page
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, api_name, page, **query_args):
+        with self._lock:
+            self.requested.append(page)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(random.uniform(0, 0.01))
+            if page == self.fail_page:
+                raise ConnectionError('page {} failed'.format(page))
+            return {'page': page, 'query_args': query_args}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_pages_are_yielded_in_order():
+    call = RecordingCall()
+    fetcher = PageFetcher(call, max_workers=4)
+    pages = list(fetcher.fetch('get_everything', range(2, 30), q='ai'))
+    assert [page['page'] for page in pages] == list(range(2, 30))
+    assert all(page['query_args'] == {'q': 'ai'} for page in pages)
+
+
+def test_requests_in_flight_are_bounded():
+    call = RecordingCall()
+    list(PageFetcher(call, max_workers=3).fetch('get_everything',
+                                                range(1, 40)))
+    assert 1 < call.max_in_flight <= 3
+
+
+def test_exception_propagates_and_stops_fetching():
+    call = RecordingCall(fail_page=5)
+    fetcher = PageFetcher(call, max_workers=2)
+    received = []
+    with pytest.raises(ConnectionError, match='page 5 failed'):
+        for page in fetcher.fetch('get_everything', range(1, 100)):
+            received.append(page['page'])
+    assert received == [1, 2, 3, 4]
+    # Pages after the failure are not all requested
+    assert len(call.requested) < 20
+
+
+@pytest.mark.parametrize('total_results, page_size, calls', [
+    (0, 100, 1), (1, 100, 1), (100, 100, 1), (101, 100, 2),
+    (250, 100, 3), (45, 20, 3), (60, 20, 3)])
+def test_page_count_follows_total_results(data_dir, results_dir,
+                                          total_results, page_size, calls):
+    client = StubNewsApiClient(total_results)
+    news = NewsApiWrapper('key', results_dir, newsapi_client=client,
+                          use_cache=False, storage='json', max_results=None)
+    news._pgsize = page_size
+    try:
+        results = news.query('get_top_headlines', 'pager', persist=False,
+                             country='us')
+    finally:
+        news.close()
+    assert len(client.calls) == calls
+    assert sorted(call['page'] for call in client.calls) == \
+        list(range(1, calls + 1))
+    assert results['articles'] == client.articles
+    assert results['query_status']['totalResults'] == total_results
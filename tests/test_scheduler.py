@@ -0,0 +1,171 @@
+import multiprocessing
+
+import pytest
+
+import newsapi_wrapper.scheduler as scheduler
+from newsapi_wrapper.scheduler import RequestScheduler, TokenBucket, \
+    QuotaTracker, NewsApiError, RetryableError, QuotaExceededError
+
+OK = {'status': 'ok', 'totalResults': 0, 'articles': []}
+
+
+def error(code):
+    return {'status': 'error', 'code': code, 'message': code}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stub time.monotonic() and time.sleep() of the scheduler module;
+    sleeping advances clock.now and is recorded in clock.sleeps. Backoff
+    delays are their upper bound.
+    """
+    class Clock:
+        now = 100.0
+        sleeps = []
+
+        @classmethod
+        def sleep(cls, seconds):
+            cls.sleeps.append(seconds)
+            cls.now += seconds
+
+    Clock.sleeps = []
+    monkeypatch.setattr(scheduler.time, 'monotonic', lambda: Clock.now)
+    monkeypatch.setattr(scheduler.time, 'sleep', Clock.sleep)
+    monkeypatch.setattr(scheduler.random, 'uniform', lambda a, b: b)
+    return Clock
+
+
+class Responses:
+    """News API call answering with responses in turn; exceptions in
+    responses are raised
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, **query_args):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_scheduler(call, **options):
+    return RequestScheduler({'get_everything': call}, **options)
+
+
+@pytest.mark.parametrize('failure', [
+    error('rateLimited'), error('unexpectedError'),
+    ConnectionError('reset'), TimeoutError('timed out')])
+def test_transient_failures_are_retried_with_backoff(clock, failure):
+    call = Responses(failure, failure, failure, OK)
+    requests = make_scheduler(call, backoff=1.0, max_backoff=3.0)
+    assert requests.call('get_everything', q='ai') == OK
+    assert call.calls == 4
+    # Exponential backoff capped at max_backoff
+    assert clock.sleeps == [1.0, 2.0, 3.0]
+    assert requests.stats()['retries'] == 3
+
+
+def test_retries_give_up_after_max_retries(clock):
+    call = Responses(error('rateLimited'))
+    requests = make_scheduler(call, max_retries=2)
+    with pytest.raises(RetryableError) as excinfo:
+        requests.call('get_everything', q='ai')
+    assert excinfo.value.code == 'rateLimited'
+    assert call.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+@pytest.mark.parametrize('code', [
+    'apiKeyInvalid', 'parameterInvalid', 'maximumResultsReached'])
+def test_other_errors_are_not_retried(clock, code):
+    call = Responses(error(code), OK)
+    requests = make_scheduler(call)
+    with pytest.raises(NewsApiError) as excinfo:
+        requests.call('get_everything', q='ai')
+    assert excinfo.value.code == code
+    assert not isinstance(excinfo.value, RetryableError)
+    assert call.calls == 1
+    assert clock.sleeps == []
+
+
+def test_token_bucket_allows_bursts_then_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # Further tokens are handed out every 1/rate seconds
+    assert [bucket.reserve() for _ in range(3)] == [0.5, 1.0, 1.5]
+    clock.now += 10
+    assert bucket.reserve() == 0
+
+
+def test_scheduler_waits_for_the_rate(clock):
+    requests = make_scheduler(Responses(OK),
+                              bucket=TokenBucket(rate=4, capacity=1))
+    for _ in range(5):
+        requests.call('get_everything', q='ai')
+    assert clock.sleeps == [0.25]*4
+
+
+def test_token_bucket_without_rate_does_not_wait(clock):
+    bucket = TokenBucket()
+    assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+def test_daily_quota_is_enforced(tmp_path, clock):
+    path = str(tmp_path / 'quota.json')
+    call = Responses(OK)
+    requests = make_scheduler(call, quota=QuotaTracker(path, daily_quota=3))
+    for _ in range(3):
+        requests.call('get_everything', q='ai')
+    with pytest.raises(QuotaExceededError):
+        requests.call('get_everything', q='ai')
+    assert call.calls == 3
+    tracker = QuotaTracker(path, daily_quota=5)
+    assert tracker.stats() == {'get_everything': 3}
+    assert tracker.remaining() == 2
+
+
+def test_counts_of_earlier_days_are_dropped(tmp_path, monkeypatch):
+    path = str(tmp_path / 'quota.json')
+    tracker = QuotaTracker(path, daily_quota=2)
+    monkeypatch.setattr(tracker, '_today', lambda: '2020-08-27')
+    tracker.acquire('get_everything')
+    tracker.acquire('get_everything')
+    monkeypatch.setattr(tracker, '_today', lambda: '2020-08-28')
+    tracker.acquire('get_top_headlines')
+    assert tracker.used('2020-08-27') == 0
+    assert tracker.used() == 1
+
+
+def test_trackers_sharing_a_file_add_up(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    first = QuotaTracker(path, daily_quota=3)
+    second = QuotaTracker(path, daily_quota=3)
+    first.acquire('get_everything')
+    second.acquire('get_everything')
+    first.acquire('get_top_headlines')
+    with pytest.raises(QuotaExceededError):
+        second.acquire('get_everything')
+    assert first.stats() == {'get_everything': 2, 'get_top_headlines': 1}
+
+
+def acquire_many(path, count):
+    tracker = QuotaTracker(path)
+    for _ in range(count):
+        tracker.acquire('get_everything')
+
+
+def test_processes_sharing_a_quota_file_add_up(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    processes = [multiprocessing.Process(target=acquire_many,
+                                         args=(path, 50))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert QuotaTracker(path).used() == 200
@@ -0,0 +1,72 @@
+import pytest
+
+from newsapi_wrapper.search import to_fts_query
+from newsapi_wrapper.store import ArticleStore
+
+
+@pytest.mark.parametrize('q, fts_query', [
+    ('crypto', '("crypto")'),
+    ('crypto bitcoin', '("crypto" AND "bitcoin")'),
+    ('+crypto', '("crypto")'),
+    ('crypto*', '("crypto"*)'),
+    ('"bitcoin price"', '("bitcoin price")'),
+    ('"bitcoin price" -"eth price"', '("bitcoin price") NOT ("eth price")'),
+    ('crypto OR stocks', '("crypto" OR "stocks")'),
+    ('crypto AND NOT bitcoin', '("crypto") NOT ("bitcoin")'),
+    ('crypto -bitcoin -eth', '("crypto") NOT ("bitcoin" OR "eth")'),
+    ('(crypto OR stocks) AND (bitcoin OR gold)',
+     '(("crypto" OR "stocks") AND ("bitcoin" OR "gold"))'),
+    ('a (b (c OR d))', '("a" AND ("b" AND ("c" OR "d")))'),
+    # Leading NOT
+    ('NOT bitcoin crypto', '("crypto") NOT ("bitcoin")'),
+    ('(NOT bitcoin crypto) OR stocks',
+     '((("crypto") NOT ("bitcoin")) OR "stocks")'),
+    # -term and -(group) inside groups
+    ('(crypto OR -bitcoin)', '((("crypto") NOT ("bitcoin")))'),
+    ('stocks (crypto -bitcoin)',
+     '("stocks" AND (("crypto") NOT ("bitcoin")))'),
+    ('crypto -(bitcoin OR eth)', '("crypto") NOT (("bitcoin" OR "eth"))'),
+    ('crypto +(bitcoin OR eth)', '("crypto" AND ("bitcoin" OR "eth"))'),
+    ('x (y -(z w))', '("x" AND (("y") NOT (("z" AND "w"))))'),
+    # Dangling operators are dropped
+    ('crypto OR', '("crypto")'),
+    ('AND crypto', '("crypto")'),
+])
+def test_to_fts_query(q, fts_query):
+    assert to_fts_query(q) == fts_query
+
+
+@pytest.mark.parametrize('q', [
+    '', '-bitcoin', 'NOT bitcoin', '-(bitcoin OR eth)', '(crypto',
+    'crypto)', 'OR'])
+def test_invalid_queries_raise(q):
+    with pytest.raises(ValueError):
+        to_fts_query(q)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ArticleStore(str(tmp_path / 'articles.db'))
+    if not store._has_fts:
+        pytest.skip('SQLite without FTS5')
+    run_id = store.start_run('search', {'api_name': 'get_everything'})
+    store.add_articles(run_id, [
+        {'url': 'https://example.com/{}'.format(count), 'title': title,
+         'source': {'id': None, 'name': 'Example'}}
+        for count, title in enumerate([
+            'crypto markets rally', 'crypto and bitcoin',
+            'crypto and eth', 'stocks fall'])])
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('q, titles', [
+    ('crypto -(bitcoin OR eth)', ['crypto markets rally']),
+    ('crypto +(bitcoin OR eth)', ['crypto and bitcoin', 'crypto and eth']),
+    ('stocks OR (crypto -bitcoin -eth)',
+     ['crypto markets rally', 'stocks fall']),
+    ('NOT rally crypto', ['crypto and bitcoin', 'crypto and eth']),
+])
+def test_translated_queries_match(store, q, titles):
+    results = store.search(to_fts_query(q))
+    assert sorted(article['title'] for _, article in results) == titles
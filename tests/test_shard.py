@@ -0,0 +1,164 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from newsapi_wrapper import NewsApiWrapper, NewsApiError
+from newsapi_wrapper.shard import ShardPlanner, parse_time, format_time
+
+START = datetime(2020, 8, 1)
+
+
+class ArchiveNewsApi:
+    """fetch_page for ShardPlanner answering get_everything from count
+    articles published every step apart, newest first, of sources
+    source-0 to source-<sources - 1>, no deeper than max_results
+    """
+
+    def __init__(self, count, step=timedelta(minutes=10), sources=1,
+                 max_results=100):
+        self.articles = [{
+            'source': {'id': 'source-{}'.format(index % sources),
+                       'name': 'Source {}'.format(index % sources)},
+            'title': 'Article {}'.format(index),
+            'url': 'https://example.com/{}'.format(index),
+            'publishedAt': format_time(START + step*index) + 'Z'}
+            for index in reversed(range(count))]
+        self.max_results = max_results
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, page=1, page_size=20, **query_args):
+        with self._lock:
+            self.calls.append(dict(query_args, page=page))
+        articles = self.articles
+        if query_args.get('from_param'):
+            start = parse_time(query_args['from_param'])
+            articles = [article for article in articles
+                        if parse_time(article['publishedAt'][:19]) >= start]
+        if query_args.get('to'):
+            end = parse_time(query_args['to'], end=True)
+            articles = [article for article in articles
+                        if parse_time(article['publishedAt'][:19]) <= end]
+        if query_args.get('sources'):
+            sources = query_args['sources'].split(',')
+            assert len(sources) <= 20
+            articles = [article for article in articles
+                        if article['source']['id'] in sources]
+        if page*page_size > self.max_results:
+            raise NewsApiError('Too deep', 'maximumResultsReached')
+        start = (page - 1)*page_size
+        return {'status': 'ok', 'totalResults': len(articles),
+                'articles': articles[start:start + page_size]}
+
+
+def window_args(**query_args):
+    query_args.setdefault('from_param', format_time(START))
+    query_args.setdefault('to', format_time(START + timedelta(days=30)))
+    query_args.setdefault('page_size', 20)
+    return query_args
+
+
+def test_windows_are_split_until_every_result_is_reachable():
+    api = ArchiveNewsApi(1000)
+    planner = ShardPlanner(api, max_results=100, max_shards=64,
+                           max_workers=4)
+    results = planner.fetch(window_args())
+    assert len(results['articles']) == 1000
+    assert [article['url'] for article in results['articles']] == \
+        [article['url'] for article in api.articles]
+    stats = results['shards']
+    assert stats['shards'] > 1
+    assert stats['truncated'] == stats['unreachable'] == 0
+    # No shard goes deeper than News API serves
+    assert all(call['page'] <= 5 for call in api.calls)
+
+
+def test_split_windows_cover_the_window_without_overlap():
+    api = ArchiveNewsApi(1000)
+    planner = ShardPlanner(api, max_results=100)
+    query_args = window_args()
+    shards = planner._split(query_args, api(**query_args), budget=64)
+    assert len(shards) > 1
+    # Newest first, from the newest article down to from_param
+    assert shards[0]['to'] == api.articles[0]['publishedAt'][:19]
+    assert shards[-1]['from_param'] == query_args['from_param']
+    for newer, older in zip(shards, shards[1:]):
+        assert parse_time(older['to']) + timedelta(seconds=1) == \
+            parse_time(newer['from_param'])
+
+
+def test_oldest_window_stays_open_ended_without_from_param():
+    # A week of articles, split a day at a time
+    api = ArchiveNewsApi(1000)
+    planner = ShardPlanner(api, max_results=100, max_shards=256,
+                           history=24*60*60)
+    query_args = {'to': format_time(START + timedelta(days=30)),
+                  'page_size': 20}
+    shards = planner._split(query_args, api(**query_args), budget=64)
+    assert 'from_param' not in shards[-1]
+    assert all('from_param' in shard for shard in shards[:-1])
+    results = planner.fetch(query_args)
+    assert len(results['articles']) == 1000
+    assert results['shards']['truncated'] == 0
+
+
+def test_sources_are_fetched_in_batches():
+    sources = ','.join('source-{}'.format(index) for index in range(45))
+    api = ArchiveNewsApi(90, sources=45)
+    planner = ShardPlanner(api, max_results=100)
+    results = planner.fetch(window_args(sources=sources))
+    assert len(results['articles']) == 90
+    batches = {call['sources'] for call in api.calls}
+    assert [len(batch.split(',')) for batch in sorted(batches, key=len)] \
+        == [5, 20, 20]
+    assert set(','.join(batches).split(',')) == set(sources.split(','))
+
+
+def test_truncated_shards_are_counted_and_logged(caplog):
+    api = ArchiveNewsApi(1000)
+    planner = ShardPlanner(api, max_results=100, max_shards=4)
+    with caplog.at_level(logging.WARNING):
+        results = planner.fetch(window_args())
+    stats = results['shards']
+    assert stats['shards'] == 4
+    assert stats['truncated'] > 0
+    assert stats['unreachable'] == 1000 - len(results['articles'])
+    assert any('Query truncated' in record.message
+               for record in caplog.records)
+
+
+def test_results_under_max_results_are_not_split():
+    api = ArchiveNewsApi(90)
+    planner = ShardPlanner(api, max_results=100)
+    results = planner.fetch(window_args())
+    assert len(results['articles']) == 90
+    assert 'shards' not in results
+    assert sorted(call['page'] for call in api.calls) == [1, 2, 3, 4, 5]
+
+
+def test_deeper_pages_than_served_are_dropped(caplog):
+    # News API serves less than max_results claims
+    api = ArchiveNewsApi(1000, max_results=60)
+    planner = ShardPlanner(api, max_results=100, min_window=24*60*60)
+    with caplog.at_level(logging.WARNING):
+        results = planner.fetch(window_args(
+            to=format_time(START + timedelta(hours=23))))
+    assert len(results['articles']) == 60
+    assert any('Result depth limit' in record.message
+               for record in caplog.records)
+
+
+def test_wrapper_does_not_shard_by_default(data_dir, results_dir):
+    news = NewsApiWrapper('key', results_dir, use_cache=False)
+    try:
+        assert news._planner is None
+    finally:
+        news.close()
+    news = NewsApiWrapper('key', results_dir, use_cache=False,
+                          max_results=100)
+    try:
+        assert news._planner is not None
+    finally:
+        news.close()
@@ -0,0 +1,106 @@
+import pytest
+
+from conftest import StubNewsApiClient
+from newsapi_wrapper import NewsApiWrapper
+import newsapi_wrapper.newsapi_wrapper as nw_module
+
+
+class FailingNewsApiClient(StubNewsApiClient):
+    """StubNewsApiClient raising on the request of fail_page"""
+
+    def __init__(self, total_results, fail_page):
+        super().__init__(total_results)
+        self.fail_page = fail_page
+
+    def _page(self, page=1, **query_args):
+        if page == self.fail_page:
+            raise ConnectionError('page {} failed'.format(page))
+        return super()._page(page=page, **query_args)
+
+
+def stream(client, results_dir, queryname='streamed', setup=None):
+    news = NewsApiWrapper('key', results_dir, newsapi_client=client,
+                          use_cache=False, storage='sqlite', max_results=None,
+                          max_retries=0)
+    news._pgsize = 20
+    if setup:
+        setup(news)
+    try:
+        news.stream_query('get_everything', queryname, formats=['csv'],
+                          q='ai')
+    finally:
+        news.close()
+    return news
+
+
+def test_finished_run_is_the_latest_run(data_dir, results_dir):
+    news = stream(StubNewsApiClient(45), results_dir)
+    assert news._store.latest_run_name('streamed') == 'streamed'
+    results = news._store.load_run('streamed')
+    assert len(results['articles']) == 45
+    assert results['query_status']['totalResults'] == 45
+
+
+def test_failed_run_is_removed(data_dir, results_dir):
+    news = stream(StubNewsApiClient(45), results_dir,
+                  'streamed-08_27_2020-10_00_00')
+    with pytest.raises(ConnectionError):
+        stream(FailingNewsApiClient(45, fail_page=2), results_dir,
+               'streamed-08_28_2020-10_00_00')
+    # The previous run stays the latest one
+    assert news._store.latest_run_name('streamed') == \
+        'streamed-08_27_2020-10_00_00'
+    assert news._store.load_run('streamed-08_28_2020-10_00_00') is None
+
+
+def fail_template(news):
+    def load_html_template():
+        raise OSError('template not found')
+    news._load_html_template = load_html_template
+
+
+def fail_start_run(news):
+    def start_run(run_name, query_data):
+        raise OSError('database is locked')
+    news._store.start_run = start_run
+
+
+@pytest.mark.parametrize('setup', [fail_template, fail_start_run])
+def test_run_and_writers_are_cleaned_up_when_opening_fails(
+        data_dir, results_dir, monkeypatch, setup):
+    opened = []
+
+    def open_writers(*args, **kwargs):
+        writers = real_open_writers(*args, **kwargs)
+        opened.extend(writers)
+        return writers
+
+    real_open_writers = nw_module.open_writers
+    monkeypatch.setattr(nw_module, 'open_writers', open_writers)
+    news = stream(StubNewsApiClient(45), results_dir,
+                  'streamed-08_27_2020-10_00_00')
+    with pytest.raises(OSError):
+        stream(StubNewsApiClient(45), results_dir,
+               'streamed-08_28_2020-10_00_00', setup)
+    assert len(opened) == 2
+    assert all(writer._file.closed for writer in opened)
+    assert news._store.latest_run_name('streamed') == \
+        'streamed-08_27_2020-10_00_00'
+    assert news._store.load_run('streamed-08_28_2020-10_00_00') is None
+
+
+@pytest.mark.parametrize('streamed', [True, False])
+def test_query_is_escaped_in_the_html_header(data_dir, results_dir,
+                                             streamed):
+    news = NewsApiWrapper('key', results_dir,
+                          newsapi_client=StubNewsApiClient(5),
+                          use_cache=False, storage='sqlite', stream=streamed)
+    try:
+        path = news.get_all_news(query_name='escaped',
+                                 q='"<b>AT&T</b>" <script>')
+    finally:
+        news.close()
+    with open(path) as file:
+        page = file.read()
+    assert '&quot;&lt;b&gt;AT&amp;T&lt;/b&gt;&quot; &lt;script&gt;' in page
+    assert '<script>' not in page and '<b>AT' not in page
@@ -0,0 +1,56 @@
+import json
+import multiprocessing
+
+from newsapi_wrapper.watermark import WatermarkStore
+
+
+def article(published):
+    return {'publishedAt': published, 'url': 'https://example.com/' + published}
+
+
+def test_watermark_advances_and_never_moves_backwards(tmp_path):
+    store = WatermarkStore(str(tmp_path / 'watermarks.json'))
+    assert store.get('ai') is None
+    assert store.update('ai', []) is None
+    assert store.update('ai', [article('2020-08-27T10:00:00Z'),
+                               article('2020-08-28T09:30:00Z')]) \
+        == '2020-08-28T09:30:00'
+    assert store.update('ai', [article('2020-08-26T00:00:00Z')]) \
+        == '2020-08-28T09:30:00'
+    assert store.get('ai') == '2020-08-28T09:30:00'
+
+
+def test_stores_sharing_a_file_keep_each_others_watermarks(tmp_path):
+    path = str(tmp_path / 'watermarks.json')
+    first = WatermarkStore(path)
+    second = WatermarkStore(path)
+    first.update('ai', [article('2020-08-27T10:00:00Z')])
+    second.update('covid', [article('2020-08-28T10:00:00Z')])
+    first.update('ai', [article('2020-08-29T10:00:00Z')])
+    assert second.get('ai') == '2020-08-29T10:00:00'
+    assert first.get('covid') == '2020-08-28T10:00:00'
+
+
+def update_many(path, query_name, count):
+    store = WatermarkStore(path)
+    for day in range(1, count + 1):
+        store.update(query_name,
+                     [article('2020-08-{:02d}T00:00:00Z'.format(day))])
+
+
+def test_processes_sharing_a_file_keep_each_others_watermarks(tmp_path):
+    path = str(tmp_path / 'watermarks.json')
+    query_names = ['query{}'.format(i) for i in range(6)]
+    processes = [multiprocessing.Process(target=update_many,
+                                         args=(path, query_name, 28))
+                 for query_name in query_names]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    with open(path) as file:
+        watermarks = json.load(file)
+    assert sorted(watermarks) == query_names
+    assert {entry['publishedAt'] for entry in watermarks.values()} \
+        == {'2020-08-28T00:00:00'}